@@ -1,42 +1,141 @@
-from datetime import datetime
+import csv
+import hashlib
+import io
+import os
+import uuid
+from datetime import date, datetime, timedelta
 from functools import wraps  # IMPORTANTE: Para el decorador
 
+import click
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash, session
+    Flask, Response, jsonify, make_response, render_template, request, redirect, url_for,
+    flash, send_file, session, stream_with_context
+)
+from jinja2 import FileSystemBytecodeCache
+
+from assets import construir_assets, generar_logos, registrar_assets
+from claves import ClavesSaturadas, verificar_clave
+from eventos import stream_agenda, ultimo_evento
+from metricas import registrar_metricas
+from recordatorios import enviar_recordatorios
+from trabajos import (
+    cancelar_trabajo,
+    encolar,
+    listar_trabajos,
+    obtener_trabajo,
+    registrar_trabajos,
+    ruta_archivo,
 )
-from werkzeug.security import check_password_hash, generate_password_hash
-
 # Importamos las funciones de DB y Services
-from db import init_db, seed_veterinarios, seed_admin
+from db import (
+    init_db, seed_veterinarios, seed_admin, liberar_conexion, preparar_bd, version_esquema,
+    abrir_conexion, VERSION_ESQUEMA, ClinicaDesconocida, clinica_actual, crear_clinica,
+    existe_clinica, fijar_clinica, migrar_clinicas, multiclinica, transaccion
+)
 from services import (
     crear_dueno,
     crear_mascota,
-    listar_mascotas,
+    datos_formulario_cita,
     listar_veterinarios,
     crear_cita,
     listar_citas_hoy,
-    listar_citas_todas,
+    listar_citas_ventana,
+    contar_citas_por_urgencia,
+    contar_citas_calendario,
+    BLOQUES_ATENCION,
     listar_pacientes_detalle,
-    contar_mascotas,
-    contar_duenos,
-    contar_citas_hoy,
-    contar_citas_urgencia_hoy,
+    obtener_paciente,
+    proxima_cita_paciente,
+    historial_paciente,
+    resumen_paciente,
+    obtener_resumen_panel,
     analizar_urgencia,
-    existe_cita_en_horario,
+    calcular_disponibilidad,
+    duracion_servicio,
+    HorarioOcupado,
     obtener_cita_por_id,
     obtener_cita_cruda,
     actualizar_cita,
     eliminar_cita,
-    obtener_usuario_por_username # Nueva función importada
+    obtener_usuario_por_username, # Nueva función importada
+    actualizar_hash_usuario,
+    reclasificar_urgencias,
+    reporte_mensual,
+    reconstruir_reportes,
+    meses_entre,
+    MAX_MESES_REPORTE,
+    validar_paciente,
+    importar_pacientes_csv,
+    CAMPOS_PACIENTE,
+    iterar_citas_exportacion,
+    iterar_pacientes_exportacion,
+    FORMATOS_EXPORTACION,
+    COLUMNAS_EXPORT_CITAS,
+    COLUMNAS_EXPORT_PACIENTES,
+    buscar,
+    version_datos,
+    listar_citas_todas
 )
 
 app = Flask(__name__)
 app.secret_key = "vetify-secret-key"
 
-# Inicialización
-init_db()
-seed_veterinarios()
-seed_admin() # Creamos el admin si no existe
+# Las plantillas compiladas se guardan en disco y los workers nuevos las
+# cargan de ahí en vez de volver a compilarlas.
+_jinja_cache = os.environ.get("VETIFY_JINJA_CACHE") or os.path.join(app.instance_path, "jinja_cache")
+os.makedirs(_jinja_cache, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(_jinja_cache)
+
+# Estáticos con hash en el nombre y precomprimidos (ver assets.py).
+# Se generan con: flask --app app build-assets
+registrar_assets(app)
+
+# Latencia y SQL por endpoint en /metrics (formato Prometheus); requiere
+# sesión iniciada o el token de VETIFY_METRICS_TOKEN.
+# VETIFY_SLOW_MS=500 registra en el log las peticiones más lentas que eso.
+registrar_metricas(app)
+
+# Inicialización: si el esquema está al día solo cuesta un PRAGMA.
+# Para hacerlo de forma explícita: flask --app app init-db / seed
+# Con varias clínicas (VETIFY_CLINICAS, ver db.py) cada base se migra con
+# su primera conexión, o con: flask --app app migrar-clinicas
+if not multiclinica():
+    preparar_bd()
+
+
+# La clínica de la sesión elige la base de datos de toda la petición
+@app.before_request
+def fijar_clinica_peticion():
+    clinica = session.get("clinica")
+    if multiclinica() and "user_id" in session and not existe_clinica(clinica or ""):
+        # La clínica se dio de baja o ya no la atiende este nodo
+        session.clear()
+        clinica = None
+    fijar_clinica(clinica)
+
+
+@app.context_processor
+def datos_clinica():
+    return {"multiclinica": multiclinica()}
+
+
+# Trabajos en segundo plano (ver trabajos.py); sus archivos van a instance/
+registrar_trabajos(app, os.path.join(app.instance_path, "trabajos"))
+
+
+# La conexión SQLite es persistente por hilo (ver db.get_connection);
+# al terminar cada petición solo se descarta una transacción a medias.
+@app.teardown_appcontext
+def teardown_db(exception):
+    liberar_conexion()
+    fijar_clinica(None)
+
+# Filas rechazadas que se muestran tras una importación desde la web
+MAX_RECHAZOS_VISIBLES = 200
+
+# Los CSV más grandes que esto se importan como trabajo en segundo plano
+IMPORTACION_DIRECTA_MAX_BYTES = 256 * 1024
+
 
 # --- DECORADOR PARA PROTEGER RUTAS ---
 def login_required(f):
@@ -60,15 +159,35 @@ def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "").strip()
+        clinica = request.form.get("clinica", "").strip().lower() if multiclinica() else ""
+
+        if multiclinica() and not existe_clinica(clinica):
+            flash("Clínica, usuario o contraseña incorrectos.", "error")
+            return render_template("login.html")
+        fijar_clinica(clinica)
 
         user = obtener_usuario_por_username(username)
 
         # Verificamos si el usuario existe y si la contraseña coincide con el hash
-        if user and check_password_hash(user['password'], password):
+        # (en el pool de claves.py, fuera del hilo de la petición)
+        valida, hash_nuevo = False, None
+        if user:
+            try:
+                valida, hash_nuevo = verificar_clave(user['password'], password)
+            except ClavesSaturadas:
+                flash("Hay muchos inicios de sesión en curso. Intenta de nuevo en unos segundos.", "error")
+                return render_template("login.html"), 503
+
+        if valida:
+            if hash_nuevo:
+                # Cambió VETIFY_HASH_METODO: se guarda con el método actual
+                actualizar_hash_usuario(user['id'], hash_nuevo)
             # Login exitoso
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['rol'] = user['rol']
+            if clinica:
+                session['clinica'] = clinica
             flash(f"Bienvenido, {user['username']}.", "success")
             return redirect(url_for('index'))
         else:
@@ -89,18 +208,14 @@ def logout():
 @app.route("/")
 @login_required  # <--- Agregamos esto a todas las rutas protegidas
 def index():
-    total_mascotas = contar_mascotas()
-    total_duenos = contar_duenos()
-    total_citas_hoy = contar_citas_hoy()
-    urgencias = contar_citas_urgencia_hoy()
-    urg_altas = urgencias.get("alta", 0)
+    resumen = obtener_resumen_panel()
 
     return render_template(
         "index.html",
-        total_mascotas=total_mascotas,
-        total_duenos=total_duenos,
-        total_citas_hoy=total_citas_hoy,
-        urg_altas=urg_altas
+        total_mascotas=resumen["total_mascotas"],
+        total_duenos=resumen["total_duenos"],
+        total_citas_hoy=resumen["total_citas_hoy"],
+        urg_altas=resumen["urg_alta"]
     )
 
 
@@ -108,48 +223,65 @@ def index():
 @login_required
 def register():
     if request.method == "POST":
-        owner_name = request.form.get("owner_name", "").strip()
-        owner_phone = request.form.get("owner_phone", "").strip()
-        owner_email = request.form.get("owner_email", "").strip()
-        pet_name = request.form.get("pet_name", "").strip()
-        pet_type = request.form.get("pet_type", "").strip() or "Otro"
-        pet_breed = request.form.get("pet_breed", "").strip()
-        pet_age_str = request.form.get("pet_age", "").strip() or "0"
-        pet_weight_str = request.form.get("pet_weight", "").strip() or "0"
-
-        if not owner_name or not owner_phone or not owner_email or not pet_name:
-            flash("Por favor completa todos los campos obligatorios.", "error")
-            return redirect(url_for("register"))
-
         try:
-            pet_age = int(pet_age_str)
-            pet_weight = float(pet_weight_str)
-        except ValueError:
-            flash("Revisa la edad y el peso de la mascota.", "error")
+            dueno, mascota = validar_paciente(request.form)
+        except ValueError as e:
+            flash(str(e), "error")
             return redirect(url_for("register"))
 
-        dueno_id = crear_dueno(owner_name, owner_phone, owner_email)
-        crear_mascota(pet_name, pet_type, pet_breed, pet_age, pet_weight, dueno_id)
+        # Dueño y mascota en una sola transacción: sin dueños huérfanos
+        with transaccion():
+            dueno_id = crear_dueno(*dueno)
+            crear_mascota(*mascota, dueno_id)
 
-        flash(f"Paciente {pet_name} registrado correctamente.", "success")
+        flash(f"Paciente {mascota[0]} registrado correctamente.", "success")
         return redirect(url_for("citas"))
 
     return render_template("register.html")
 
 
-@app.route("/appointment", methods=["GET", "POST"])
+@app.route("/importar", methods=["GET", "POST"])
 @login_required
-def appointment():
-    mascotas = listar_mascotas()
-    vets = listar_veterinarios()
+def importar():
+    resultado = None
+    if request.method == "POST":
+        archivo = request.files.get("archivo")
+        if not archivo or not archivo.filename:
+            flash("Selecciona un archivo CSV.", "error")
+            return redirect(url_for("importar"))
+
+        if (request.content_length or 0) > IMPORTACION_DIRECTA_MAX_BYTES:
+            destino = f"importacion-{uuid.uuid4().hex}.csv"
+            archivo.save(ruta_archivo(destino))
+            trabajo_id = encolar("importar_pacientes", archivo=destino, nombre=archivo.filename)
+            flash(f"El archivo se está importando en segundo plano (trabajo #{trabajo_id}).", "success")
+            return redirect(url_for("trabajos"))
+
+        # utf-8-sig: tolera el BOM que agrega Excel al guardar como CSV
+        texto = io.TextIOWrapper(archivo.stream, encoding="utf-8-sig", newline="")
+        try:
+            resultado = importar_pacientes_csv(texto)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            flash(f"No se pudo leer el archivo: {e}", "error")
+            return redirect(url_for("importar"))
+
+        flash(
+            f"Importación terminada: {resultado['importados']} pacientes, "
+            f"{len(resultado['rechazados'])} filas rechazadas.",
+            "success" if resultado["importados"] else "error"
+        )
+
+    return render_template(
+        "importar.html",
+        resultado=resultado,
+        columnas=CAMPOS_PACIENTE,
+        max_rechazos=MAX_RECHAZOS_VISIBLES
+    )
 
-    if not mascotas:
-        flash("Primero registra un paciente.", "error")
-        return redirect(url_for("register"))
-    if not vets:
-        flash("No hay veterinarios registrados.", "error")
-        return redirect(url_for("index"))
 
+@app.route("/appointment", methods=["GET", "POST"])
+@login_required
+def appointment():
     if request.method == "POST":
         mascota_id = request.form.get("mascota_id")
         vet_id = request.form.get("vet_id")
@@ -175,61 +307,123 @@ def appointment():
             flash("Formato de fecha u hora no válido.", "error")
             return redirect(url_for("appointment"))
 
-        if existe_cita_en_horario(vet_id, fecha_hora):
-            flash("El profesional seleccionado ya tiene una cita en esa fecha y hora.", "error")
-            return redirect(url_for("appointment"))
-
         urgencia = analizar_urgencia(sintomas)
-        crear_cita(mascota_id, vet_id, fecha_hora, tipo_servicio, sintomas, urgencia)
+        try:
+            crear_cita(mascota_id, vet_id, fecha_hora, tipo_servicio, sintomas, urgencia)
+        except HorarioOcupado:
+            flash("El profesional seleccionado ya tiene una cita que se cruza con ese horario.", "error")
+            return redirect(url_for("appointment"))
 
         flash(f"Cita creada para el {fecha_str} a las {hora_str}. Urgencia: {urgencia.upper()}.", "success")
         return redirect(url_for("citas"))
 
+    # Las listas solo hacen falta para pintar el formulario
+    mascotas, vets = datos_formulario_cita()
+    if not mascotas:
+        flash("Primero registra un paciente.", "error")
+        return redirect(url_for("register"))
+    if not vets:
+        flash("No hay veterinarios registrados.", "error")
+        return redirect(url_for("index"))
+
     return render_template("appointment.html", mascotas=mascotas, vets=vets)
 
 
 @app.route("/agenda")
 @login_required
 def agenda():
+    # Se lee antes que la lista: un cambio que llegue entre ambas consultas
+    # se vuelve a recibir por el stream, y aplicarlo dos veces no cambia nada
+    ultimo = ultimo_evento()
     citas = listar_citas_hoy()
-    total_mascotas = contar_mascotas()
-    total_citas_hoy = contar_citas_hoy()
-    urgencias = contar_citas_urgencia_hoy()
-    urg_altas = urgencias.get("alta", 0)
+    resumen = obtener_resumen_panel()
 
     return render_template(
         "agenda.html",
         citas=citas,
-        total_mascotas=total_mascotas,
-        total_citas_hoy=total_citas_hoy,
-        urg_altas=urg_altas
+        total_mascotas=resumen["total_mascotas"],
+        total_citas_hoy=resumen["total_citas_hoy"],
+        urg_altas=resumen["urg_alta"],
+        ultimo_evento=ultimo
     )
 
 
+@app.route("/agenda/eventos")
+@login_required
+def agenda_eventos():
+    """Cambios en las citas de hoy como Server-Sent Events (ver eventos.py)."""
+    desde = request.headers.get("Last-Event-ID") or request.args.get("desde")
+    try:
+        desde = int(desde)
+    except (TypeError, ValueError):
+        desde = ultimo_evento()
+    return Response(
+        stream_with_context(stream_agenda(desde)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+CITAS_POR_PAGINA = 100
+
+
+def _leer_fecha(valor: str | None, defecto: date | None) -> date | None:
+    try:
+        return date.fromisoformat(valor) if valor else defecto
+    except ValueError:
+        return defecto
+
+
+def _leer_cursor(valor: str | None):
+    # El cursor viaja como "fecha_hora|id" (clave de la última cita mostrada)
+    if not valor or "|" not in valor:
+        return None
+    fecha_hora, _, cita_id = valor.rpartition("|")
+    try:
+        return fecha_hora, int(cita_id)
+    except ValueError:
+        return None
+
+
 @app.route("/citas")
 @login_required
 def citas():
     urgencia_filtro = request.args.get("urg", "todas").lower()
-    citas = listar_citas_todas()
-
-    counts = {"alta": 0, "media": 0, "baja": 0}
-    for c in citas:
-        urg = (c["urgencia"] or "").lower()
-        if urg in counts:
-            counts[urg] += 1
-
-    if urgencia_filtro in ("alta", "media", "baja"):
-        citas_filtradas = [c for c in citas if (c["urgencia"] or "").lower() == urgencia_filtro]
+    if urgencia_filtro not in ("alta", "media", "baja"):
+        urgencia_filtro = "todas"
+
+    # Por defecto: desde el lunes de esta semana en adelante
+    hoy = date.today()
+    desde = _leer_fecha(request.args.get("desde"), hoy - timedelta(days=hoy.weekday()))
+    hasta = _leer_fecha(request.args.get("hasta"), None)
+    cursor = _leer_cursor(request.args.get("cursor"))
+
+    counts_sql = contar_citas_por_urgencia(desde, hasta)
+    counts = {u: counts_sql.get(u, 0) for u in ("alta", "media", "baja")}
+    if urgencia_filtro == "todas":
+        total_citas = sum(counts_sql.values())
     else:
-        citas_filtradas = citas
+        total_citas = counts[urgencia_filtro]
+
+    citas = listar_citas_ventana(
+        desde,
+        hasta,
+        urgencia=None if urgencia_filtro == "todas" else urgencia_filtro,
+        cursor=cursor,
+        limite=CITAS_POR_PAGINA
+    )
+    siguiente_cursor = None
+    if len(citas) > CITAS_POR_PAGINA:
+        citas = citas[:CITAS_POR_PAGINA]
+        ultima = citas[-1]
+        siguiente_cursor = f"{ultima['fecha_hora']}|{ultima['id']}"
 
-    total_citas = len(citas_filtradas)
     grupos = []
     current_date = None
     grupo_actual = None
     dias_semana = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
 
-    for c in citas_filtradas:
+    for c in citas:
         fecha_iso = c["fecha_hora"][:10]
         if fecha_iso != current_date:
             current_date = fecha_iso
@@ -245,7 +439,98 @@ def citas():
         grupos=grupos,
         total_citas=total_citas,
         counts=counts,
-        urgencia_actual=urgencia_filtro
+        urgencia_actual=urgencia_filtro,
+        desde=desde.isoformat(),
+        hasta=hasta.isoformat() if hasta else "",
+        es_continuacion=cursor is not None,
+        siguiente_cursor=siguiente_cursor
+    )
+
+
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+MESES = [
+    "enero", "febrero", "marzo", "abril", "mayo", "junio",
+    "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre",
+]
+
+
+@app.route("/calendario")
+@login_required
+def calendario():
+    """
+    Vista de semana (conteos por día y hora) o de mes (por día), de toda la
+    clínica o de un veterinario. Una sola consulta agrupada por ventana: el
+    costo depende de los días visibles, no del historial.
+    """
+    vista = request.args.get("vista", "semana")
+    if vista not in ("semana", "mes"):
+        vista = "semana"
+    hoy = date.today()
+    fecha = _leer_fecha(request.args.get("fecha"), hoy)
+    vets = listar_veterinarios()
+    vet_id = request.args.get("vet", type=int)
+    vet = next((v for v in vets if v["id"] == vet_id), None)
+    vet_id = vet["id"] if vet else None
+
+    if vista == "mes":
+        primero = fecha.replace(day=1)
+        siguiente = (primero + timedelta(days=32)).replace(day=1)
+        # La cuadrícula va de lunes a domingo y cubre el mes completo
+        inicio = primero - timedelta(days=primero.weekday())
+        fin = siguiente + timedelta(days=(7 - siguiente.weekday()) % 7)
+        anterior = (primero - timedelta(days=1)).replace(day=1)
+        titulo = f"{MESES[primero.month - 1].capitalize()} {primero.year}"
+    else:
+        inicio = fecha - timedelta(days=fecha.weekday())
+        fin = siguiente = inicio + timedelta(days=7)
+        anterior = inicio - timedelta(days=7)
+        domingo = fin - timedelta(days=1)
+        titulo = f"Semana del {inicio:%d/%m} al {domingo:%d/%m/%Y}"
+
+    conteos = contar_citas_calendario(inicio, fin, vet_id, por_hora=(vista == "semana"))
+    dias = [
+        {
+            "fecha": d.isoformat(),
+            "numero": d.day,
+            "nombre": DIAS_SEMANA[d.weekday()],
+            "hoy": d == hoy,
+            "fuera": vista == "mes" and d.month != fecha.month,
+        }
+        for d in (inicio + timedelta(days=i) for i in range((fin - inicio).days))
+    ]
+
+    horas = []
+    if vista == "semana":
+        # Horas de atención, más las que tengan citas fuera de ese horario
+        en_bloques = {
+            h for h0, h1 in BLOQUES_ATENCION
+            for h in range(h0.hour, h1.hour + (1 if h1.minute else 0))
+        }
+        horas = sorted(en_bloques | {int(h) for _, h in conteos})
+        totales = {}
+        for (dia, _), c in conteos.items():
+            totales[dia] = totales.get(dia, 0) + c["total"]
+        for d in dias:
+            d["total"] = totales.get(d["fecha"], 0)
+    else:
+        for d in dias:
+            d["conteo"] = conteos.get((d["fecha"],))
+
+    return render_template(
+        "calendario.html",
+        vista=vista,
+        titulo=titulo,
+        dias=dias,
+        semanas=[dias[i:i + 7] for i in range(0, len(dias), 7)],
+        horas=horas,
+        conteos=conteos,
+        total=sum(c["total"] for c in conteos.values()),
+        vets=vets,
+        vet=vet,
+        fecha=fecha.isoformat(),
+        anterior=anterior.isoformat(),
+        siguiente=siguiente.isoformat(),
+        hoy=hoy.isoformat()
     )
 
 
@@ -267,9 +552,6 @@ def cita_editar(cita_id: int):
         flash("La cita seleccionada no existe.", "error")
         return redirect(url_for("citas"))
 
-    mascotas = listar_mascotas()
-    vets = listar_veterinarios()
-
     if request.method == "POST":
         mascota_id = request.form.get("mascota_id")
         vet_id = request.form.get("vet_id")
@@ -287,13 +569,13 @@ def cita_editar(cita_id: int):
 
         fecha_hora = datetime.fromisoformat(f"{fecha_str}T{hora_str}")
 
-        if existe_cita_en_horario(vet_id, fecha_hora, excluir_id=cita_id):
+        urgencia = analizar_urgencia(sintomas)
+        try:
+            actualizar_cita(cita_id, mascota_id, vet_id, fecha_hora, tipo_servicio, sintomas, urgencia)
+        except HorarioOcupado:
             flash("El horario ya está ocupado.", "error")
             return redirect(url_for("cita_editar", cita_id=cita_id))
 
-        urgencia = analizar_urgencia(sintomas)
-        actualizar_cita(cita_id, mascota_id, vet_id, fecha_hora, tipo_servicio, sintomas, urgencia)
-
         flash("Cita actualizada correctamente.", "success")
         return redirect(url_for("cita_detalle", cita_id=cita_id))
 
@@ -301,6 +583,7 @@ def cita_editar(cita_id: int):
     fecha_cita = dt.date().isoformat()
     hora_cita = dt.time().strftime("%H:%M")
 
+    mascotas, vets = datos_formulario_cita()
     return render_template("cita_editar.html", cita=cita, mascotas=mascotas, vets=vets, fecha_cita=fecha_cita, hora_cita=hora_cita)
 
 
@@ -320,6 +603,226 @@ def pacientes():
     return render_template("pacientes.html", pacientes=pacientes, total=total)
 
 
+HISTORIAL_POR_PAGINA = 20
+
+
+def _pagina_historial(mascota_id: int, cursor):
+    """(citas, cursor de la siguiente página o None)."""
+    citas = historial_paciente(mascota_id, cursor=cursor, limite=HISTORIAL_POR_PAGINA)
+    siguiente_cursor = None
+    if len(citas) > HISTORIAL_POR_PAGINA:
+        citas = citas[:HISTORIAL_POR_PAGINA]
+        siguiente_cursor = f"{citas[-1]['fecha_hora']}|{citas[-1]['id']}"
+    return citas, siguiente_cursor
+
+
+@app.route("/paciente/<int:mascota_id>")
+@login_required
+def paciente_detalle(mascota_id: int):
+    paciente = obtener_paciente(mascota_id)
+    if not paciente:
+        flash("El paciente no existe.", "error")
+        return redirect(url_for("pacientes"))
+
+    cursor = _leer_cursor(request.args.get("cursor"))
+    citas, siguiente_cursor = _pagina_historial(mascota_id, cursor)
+    return render_template(
+        "paciente.html",
+        paciente=paciente,
+        resumen=resumen_paciente(mascota_id),
+        citas=citas,
+        es_continuacion=cursor is not None,
+        siguiente_cursor=siguiente_cursor
+    )
+
+
+# --- API ---
+
+def respuesta_condicional(f=None, *, extra=None):
+    """
+    Para vistas de solo lectura de la API. El ETag sale del contador de
+    version_datos, la URL completa y la fecha de hoy (que cambia "hoy" sin
+    que cambien los datos). Si el cliente ya tiene esa versión se responde
+    304 sin ejecutar la vista ni sus consultas.
+    `extra(**kwargs)` agrega al ETag lo que cambia con la hora sin que
+    cambien los datos (p. ej. la próxima cita de un paciente).
+    """
+    if f is None:
+        return lambda vista: respuesta_condicional(vista, extra=extra)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        base = f"{clinica_actual()}|{version_datos()}|{request.full_path}|{date.today().isoformat()}"
+        if extra is not None:
+            base += f"|{extra(**kwargs)}"
+        etag = hashlib.sha1(base.encode("utf-8")).hexdigest()[:20]
+
+        if request.if_none_match.contains(etag):
+            resp = make_response("", 304)
+        else:
+            resp = make_response(f(*args, **kwargs))
+        resp.set_etag(etag)
+        # El navegador guarda la respuesta pero debe revalidarla cada vez
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    return decorated_function
+
+
+def _filas_json(filas):
+    return [dict(fila) for fila in filas]
+
+
+@app.route("/api/citas/hoy")
+@login_required
+@respuesta_condicional
+def api_citas_hoy():
+    return jsonify(citas=_filas_json(listar_citas_hoy()))
+
+
+@app.route("/api/citas")
+@login_required
+@respuesta_condicional
+def api_citas():
+    """
+    Sin parámetros devuelve todas las citas (listar_citas_todas). Con
+    ?desde=AAAA-MM-DD (y opcionalmente hasta, urg, cursor) devuelve una
+    página como el calendario, con el cursor de la siguiente.
+    """
+    desde = _leer_fecha(request.args.get("desde"), None)
+    if desde is None:
+        return jsonify(citas=_filas_json(listar_citas_todas()))
+
+    urgencia = request.args.get("urg", "").lower()
+    citas = listar_citas_ventana(
+        desde,
+        _leer_fecha(request.args.get("hasta"), None),
+        urgencia=urgencia if urgencia in ("alta", "media", "baja") else None,
+        cursor=_leer_cursor(request.args.get("cursor")),
+        limite=CITAS_POR_PAGINA
+    )
+    siguiente_cursor = None
+    if len(citas) > CITAS_POR_PAGINA:
+        citas = citas[:CITAS_POR_PAGINA]
+        siguiente_cursor = f"{citas[-1]['fecha_hora']}|{citas[-1]['id']}"
+    return jsonify(citas=_filas_json(citas), siguiente_cursor=siguiente_cursor)
+
+
+@app.route("/api/pacientes")
+@login_required
+@respuesta_condicional
+def api_pacientes():
+    return jsonify(pacientes=_filas_json(listar_pacientes_detalle()))
+
+
+@app.route("/api/pacientes/<int:mascota_id>")
+@login_required
+@respuesta_condicional(extra=proxima_cita_paciente)
+def api_paciente(mascota_id: int):
+    """Como /paciente/<id>: datos, resumen y una página del historial (?cursor=)."""
+    paciente = obtener_paciente(mascota_id)
+    if not paciente:
+        return jsonify(error="El paciente no existe."), 404
+    citas, siguiente_cursor = _pagina_historial(mascota_id, _leer_cursor(request.args.get("cursor")))
+    return jsonify(
+        paciente=dict(paciente),
+        resumen=resumen_paciente(mascota_id),
+        citas=_filas_json(citas),
+        siguiente_cursor=siguiente_cursor
+    )
+
+
+@app.route("/api/veterinarios")
+@login_required
+@respuesta_condicional
+def api_veterinarios():
+    return jsonify(veterinarios=_filas_json(listar_veterinarios()))
+
+
+@app.route("/api/vets/<int:vet_id>/disponibilidad")
+@login_required
+def api_disponibilidad(vet_id: int):
+    """Horarios libres de un profesional: ?fecha=AAAA-MM-DD&servicio=...&excluir=<cita_id>"""
+    dia = _leer_fecha(request.args.get("fecha"), None)
+    if dia is None:
+        return jsonify(error="Indica la fecha con el formato AAAA-MM-DD."), 400
+    servicio = request.args.get("servicio", "Consulta")
+    excluir = request.args.get("excluir", type=int)
+
+    libres = calcular_disponibilidad(vet_id, dia, servicio, excluir_id=excluir)
+    return jsonify(
+        vet_id=vet_id,
+        fecha=dia.isoformat(),
+        servicio=servicio,
+        duracion_min=duracion_servicio(servicio),
+        libres=libres
+    )
+
+
+# --- EXPORTACIÓN (respuestas en streaming, memoria constante) ---
+
+def _respuesta_exportacion(nombre, filas, columnas, formato):
+    formatear, mimetype = FORMATOS_EXPORTACION[formato]
+    return Response(
+        stream_with_context(formatear(filas, columnas)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}.{formato}"'}
+    )
+
+
+def _exportar_en_fondo(tabla, formato, desde, hasta, urgencia=None):
+    # Con ?fondo=1 el archivo se genera como trabajo y se descarga desde /jobs
+    trabajo_id = encolar(
+        "exportar", tabla=tabla, formato=formato, urgencia=urgencia,
+        desde=desde.isoformat() if desde else None,
+        hasta=hasta.isoformat() if hasta else None,
+    )
+    flash(f"La exportación se está generando en segundo plano (trabajo #{trabajo_id}).", "success")
+    return redirect(url_for("trabajos"))
+
+
+@app.route("/export/citas")
+@login_required
+def export_citas():
+    formato = request.args.get("formato", "csv").lower()
+    if formato not in FORMATOS_EXPORTACION:
+        return "Formato no soportado (usa csv o ndjson).", 400
+    urgencia = request.args.get("urg", "").lower()
+    if urgencia not in ("", "alta", "media", "baja"):
+        return "Urgencia no válida (alta, media o baja).", 400
+
+    desde = _leer_fecha(request.args.get("desde"), None)
+    hasta = _leer_fecha(request.args.get("hasta"), None)
+    if request.args.get("fondo"):
+        return _exportar_en_fondo("citas", formato, desde, hasta, urgencia or None)
+
+    filas = iterar_citas_exportacion(desde=desde, hasta=hasta, urgencia=urgencia or None)
+    return _respuesta_exportacion("citas", filas, COLUMNAS_EXPORT_CITAS, formato)
+
+
+@app.route("/export/pacientes")
+@login_required
+def export_pacientes():
+    formato = request.args.get("formato", "csv").lower()
+    if formato not in FORMATOS_EXPORTACION:
+        return "Formato no soportado (usa csv o ndjson).", 400
+
+    desde = _leer_fecha(request.args.get("desde"), None)
+    hasta = _leer_fecha(request.args.get("hasta"), None)
+    if request.args.get("fondo"):
+        return _exportar_en_fondo("pacientes", formato, desde, hasta)
+
+    filas = iterar_pacientes_exportacion(desde=desde, hasta=hasta)
+    return _respuesta_exportacion("pacientes", filas, COLUMNAS_EXPORT_PACIENTES, formato)
+
+
+@app.route("/buscar")
+@login_required
+def buscar_view():
+    q = request.args.get("q", "").strip()
+    resultados = buscar(q) if q else None
+    return render_template("buscar.html", q=q, resultados=resultados)
+
+
 @app.route("/vets")
 @login_required
 def vets():
@@ -327,5 +830,266 @@ def vets():
     return render_template("vets.html", veterinarios=veterinarios)
 
 
+# --- REPORTES ---
+
+def _leer_mes(valor: str | None, defecto: str) -> str:
+    try:
+        return datetime.strptime(valor or "", "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        return defecto
+
+
+@app.route("/reportes")
+@login_required
+def reportes():
+    hoy = date.today()
+    # Por defecto: los últimos 12 meses, incluido el actual
+    anio, mes = divmod(hoy.year * 12 + hoy.month - 12, 12)
+    hasta = _leer_mes(request.args.get("hasta"), hoy.strftime("%Y-%m"))
+    desde = _leer_mes(request.args.get("desde"), f"{anio:04d}-{mes + 1:02d}")
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    # Ventana acotada: la página lee como mucho MAX_MESES_REPORTE meses
+    meses = meses_entre(desde, hasta)
+    if len(meses) > MAX_MESES_REPORTE:
+        desde = meses[-MAX_MESES_REPORTE]
+
+    return render_template(
+        "reportes.html",
+        reporte=reporte_mensual(desde, hasta),
+        desde=desde,
+        hasta=hasta,
+        max_meses=MAX_MESES_REPORTE
+    )
+
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+
+@app.route("/jobs")
+@login_required
+def trabajos():
+    lista = listar_trabajos()
+    return render_template(
+        "trabajos.html",
+        trabajos=lista,
+        hay_activos=any(t["activo"] for t in lista)
+    )
+
+
+@app.route("/api/jobs/<int:trabajo_id>")
+@login_required
+def api_trabajo(trabajo_id: int):
+    trabajo = obtener_trabajo(trabajo_id)
+    if not trabajo:
+        return jsonify(error="El trabajo no existe."), 404
+    return jsonify(trabajo=trabajo)
+
+
+@app.route("/jobs/reclasificar", methods=["POST"])
+@login_required
+def trabajo_reclasificar():
+    trabajo_id = encolar("reclasificar_urgencias")
+    flash(f"Recalculando urgencias en segundo plano (trabajo #{trabajo_id}).", "success")
+    return redirect(url_for("trabajos"))
+
+
+@app.route("/jobs/<int:trabajo_id>/cancelar", methods=["POST"])
+@login_required
+def trabajo_cancelar(trabajo_id: int):
+    if cancelar_trabajo(trabajo_id):
+        flash(f"Se pidió cancelar el trabajo #{trabajo_id}.", "success")
+    else:
+        flash("El trabajo ya había terminado.", "error")
+    return redirect(url_for("trabajos"))
+
+
+@app.route("/jobs/<int:trabajo_id>/descarga")
+@login_required
+def trabajo_descarga(trabajo_id: int):
+    trabajo = obtener_trabajo(trabajo_id)
+    archivo = (trabajo or {}).get("resultado") or {}
+    if trabajo is None or trabajo["tipo"] != "exportar" or not archivo.get("archivo"):
+        flash("Ese trabajo no tiene un archivo para descargar.", "error")
+        return redirect(url_for("trabajos"))
+
+    ruta = ruta_archivo(archivo["archivo"])
+    if not os.path.exists(ruta):
+        flash("El archivo ya no está disponible.", "error")
+        return redirect(url_for("trabajos"))
+    formato = trabajo["parametros"].get("formato", "csv")
+    return send_file(
+        ruta,
+        mimetype=FORMATOS_EXPORTACION[formato][1],
+        as_attachment=True,
+        download_name=f"{trabajo['parametros'].get('tabla', 'export')}.{formato}",
+    )
+
+
+# --- COMANDOS DE ADMINISTRACIÓN (flask --app app <comando>) ---
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Aplica las migraciones pendientes del esquema."""
+    init_db()
+    conn = abrir_conexion()
+    version = version_esquema(conn)
+    conn.close()
+    click.echo(f"Esquema en la versión {version} (última: {VERSION_ESQUEMA}).")
+
+
+@app.cli.command("crear-clinica")
+@click.argument("nombre")
+def crear_clinica_command(nombre):
+    """Crea la base de una clínica nueva en VETIFY_CLINICAS."""
+    if not multiclinica():
+        raise click.ClickException("Define VETIFY_CLINICAS con la carpeta de las bases de las clínicas.")
+    try:
+        ruta = crear_clinica(nombre)
+    except ClinicaDesconocida:
+        raise click.ClickException(
+            f"Nombre de clínica no válido: '{nombre}' (minúsculas, números, '-' y '_')."
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Clínica '{nombre}' creada en {ruta}.")
+
+
+@app.cli.command("migrar-clinicas")
+def migrar_clinicas_command():
+    """Aplica las migraciones pendientes en todas las clínicas de este nodo."""
+    versiones = migrar_clinicas()
+    for nombre, version in versiones.items():
+        click.echo(f"  {nombre}: versión {version}")
+    click.echo(f"{len(versiones)} clínicas (última versión: {VERSION_ESQUEMA}).")
+
+
+@app.cli.command("seed")
+def seed_command():
+    """Crea los veterinarios y el usuario admin iniciales si no existen."""
+    seed_veterinarios()
+    seed_admin()
+    click.echo("Datos iniciales verificados.")
+
+
+@app.cli.command("reclasificar-urgencias")
+@click.option("--lote", default=1000, show_default=True, help="Filas por bloque.")
+def reclasificar_urgencias_command(lote):
+    """Recalcula la urgencia de todas las citas con las reglas actuales."""
+    def progreso(revisadas, cambiadas):
+        click.echo(f"\r  {revisadas} revisadas, {cambiadas} actualizadas", nl=False)
+
+    r = reclasificar_urgencias(lote=lote, progreso=progreso)
+    click.echo()
+    click.echo(
+        f"Listo: {r['revisadas']} citas revisadas, {r['cambiadas']} actualizadas "
+        f"en {r['segundos']:.1f} s ({r['filas_por_segundo']:.0f} filas/s)."
+    )
+
+
+
+@app.cli.command("reconstruir-reportes")
+def reconstruir_reportes_command():
+    """Recalcula las tablas de resumen de /reportes desde citas y mascotas."""
+    filas = reconstruir_reportes()
+    click.echo(
+        f"Listo: {filas['resumen_citas_mes']} filas de citas y "
+        f"{filas['resumen_pacientes_mes']} de pacientes por mes."
+    )
+
+
+@app.cli.command("importar-pacientes")
+@click.argument("archivo", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--lote", default=5000, show_default=True, help="Pacientes por transacción.")
+@click.option("--rechazos", type=click.File("w", encoding="utf-8"),
+              help="CSV donde guardar las filas rechazadas (línea, motivo).")
+def importar_pacientes_command(archivo, lote, rechazos):
+    """Importa responsables y mascotas desde un CSV."""
+    def progreso(importados, rechazados):
+        click.echo(f"\r  {importados} importados, {rechazados} rechazados", nl=False)
+
+    try:
+        r = importar_pacientes_csv(archivo, lote=lote, progreso=progreso)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo()
+
+    if rechazos:
+        escritor = csv.writer(rechazos)
+        escritor.writerow(["linea", "motivo"])
+        escritor.writerows(r["rechazados"])
+    click.echo(
+        f"Listo: {r['importados']} pacientes ({r['duenos']} responsables) en "
+        f"{r['segundos']:.1f} s; {len(r['rechazados'])} filas rechazadas."
+    )
+
+
+
+@app.cli.command("exportar")
+@click.argument("tabla", type=click.Choice(["citas", "pacientes"]))
+@click.option("--formato", type=click.Choice(sorted(FORMATOS_EXPORTACION)), default="csv", show_default=True)
+@click.option("--desde", type=click.DateTime(["%Y-%m-%d"]), help="Fecha inicial (incluida).")
+@click.option("--hasta", type=click.DateTime(["%Y-%m-%d"]), help="Fecha final (incluida).")
+@click.option("--urg", type=click.Choice(["alta", "media", "baja"]), help="Solo citas con esta urgencia.")
+@click.option("--salida", type=click.File("w", encoding="utf-8"), default="-",
+              help="Archivo de destino (por defecto, la salida estándar).")
+def exportar_command(tabla, formato, desde, hasta, urg, salida):
+    """Exporta citas o pacientes en CSV o NDJSON."""
+    desde = desde.date() if desde else None
+    hasta = hasta.date() if hasta else None
+    if tabla == "citas":
+        filas = iterar_citas_exportacion(desde=desde, hasta=hasta, urgencia=urg)
+        columnas = COLUMNAS_EXPORT_CITAS
+    else:
+        filas = iterar_pacientes_exportacion(desde=desde, hasta=hasta)
+        columnas = COLUMNAS_EXPORT_PACIENTES
+
+    formatear, _ = FORMATOS_EXPORTACION[formato]
+    for trozo in formatear(filas, columnas):
+        salida.write(trozo)
+
+
+@app.cli.command("build-assets")
+@click.option("--sin-logos", is_flag=True, help="No regenerar los logos reducidos.")
+def build_assets_command(sin_logos):
+    """Genera los estáticos con hash, sus variantes .gz/.br y el manifiesto."""
+    if not sin_logos:
+        try:
+            for ruta in generar_logos(app.static_folder):
+                click.echo(f"  logo: {ruta}")
+        except RuntimeError as e:
+            click.echo(f"Se omiten los logos: {e}")
+
+    manifiesto = construir_assets(app.static_folder)
+    click.echo(
+        f"Listo: {len(manifiesto)} archivos en static/dist. "
+        "Reinicia la aplicación para que use el nuevo manifiesto."
+    )
+
+
+@app.cli.command("enviar-recordatorios")
+@click.option("--fecha", type=click.DateTime(["%Y-%m-%d"]), help="Día de las citas (por defecto, mañana).")
+@click.option("--conexiones", default=5, show_default=True, help="Conexiones SMTP simultáneas.")
+@click.option("--simular", is_flag=True, help="Armar los mensajes sin enviarlos.")
+def enviar_recordatorios_command(fecha, conexiones, simular):
+    """Envía por correo el recordatorio de las citas del día siguiente."""
+    r = enviar_recordatorios(dia=fecha.date() if fecha else None, conexiones=conexiones, simular=simular)
+    accion = "a enviar (simulación)" if simular else "por enviar"
+    click.echo(
+        f"{r['dia']}: {r['a_enviar']} recordatorios {accion}, {r['sin_correo']} citas sin correo válido."
+    )
+    if not simular:
+        click.echo(
+            f"Enviados {r['enviados']}, con error {r['errores']}, sin enviar {r['sin_enviar']} "
+            f"en {r['segundos']:.1f} s."
+        )
+    if r["errores"] or r["sin_enviar"]:
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # `python app.py` se relanza como `python -m flask run`: los procesos del
+    # pool de claves.py se crean con spawn y vuelven a importar el módulo
+    # principal, que así es el de flask y no este (con el Flask, los assets
+    # y preparar_bd que corren al importarlo).
+    import sys
+    os.execv(sys.executable, [sys.executable, "-m", "flask", "--app", __file__, "run", "--debug"])
\ No newline at end of file
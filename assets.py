@@ -0,0 +1,204 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from typing import Dict, List, Optional
+
+from flask import current_app, request, send_from_directory
+
+# Pillow y brotli son opcionales: sin Pillow no se regeneran los logos
+# reducidos y sin brotli solo se generan las variantes .gz.
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - depende del entorno
+    Image = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depende del entorno
+    brotli = None
+
+
+# Carpeta (dentro de static/) donde se escriben los archivos con hash.
+# No se versiona: se regenera con `flask --app app build-assets`.
+CARPETA_DIST = "dist"
+MANIFIESTO = "manifest.json"
+
+# Los archivos con hash nunca cambian de contenido, así que el navegador
+# puede guardarlos un año sin volver a preguntar.
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+
+# Solo vale la pena comprimir texto; los PNG ya vienen comprimidos.
+EXTENSIONES_COMPRIMIBLES = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+
+# Variantes reducidas de los logos: (origen, destino, alto en px, cuadrada).
+# Se generan al doble del alto con el que las muestra styles.css para que
+# se vean nítidas en pantallas de alta densidad; conservan el margen del
+# original para que el logo se vea igual que antes.
+VARIANTES_LOGO = (
+    ("img/Blanco.png", "img/logo-blanco-64.png", 64, False),     # topbar (32px)
+    ("img/Negro.png", "img/logo-negro-160.png", 160, False),     # inicio y login (80px / 60px)
+    ("img/Blanco.png", "img/favicon-32.png", 32, True),
+    ("img/Blanco.png", "img/favicon-180.png", 180, True),        # apple-touch-icon
+)
+
+
+# --------- Construcción ---------
+
+def generar_logos(static_dir: str) -> List[str]:
+    """
+    Genera las variantes de VARIANTES_LOGO a partir de los PNG originales.
+    Devuelve las rutas escritas. Requiere Pillow.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow no está instalado (pip install Pillow).")
+
+    escritas = []
+    for origen, destino, alto, cuadrada in VARIANTES_LOGO:
+        with Image.open(os.path.join(static_dir, origen)) as im:
+            im = im.convert("RGBA")
+            if cuadrada:
+                # En el favicon el margen transparente dejaría el logo diminuto
+                caja = im.getbbox()
+                if caja:
+                    im = im.crop(caja)
+                lado = max(im.size)
+                lienzo = Image.new("RGBA", (lado, lado), (0, 0, 0, 0))
+                lienzo.paste(im, ((lado - im.width) // 2, (lado - im.height) // 2))
+                im = lienzo.resize((alto, alto), Image.LANCZOS)
+            else:
+                ancho = round(im.width * alto / im.height)
+                im = im.resize((ancho, alto), Image.LANCZOS)
+
+            im.save(os.path.join(static_dir, destino), optimize=True)
+        escritas.append(destino)
+    return escritas
+
+
+def _nombre_con_hash(ruta: str, contenido: bytes) -> str:
+    base, ext = os.path.splitext(ruta)
+    huella = hashlib.sha1(contenido).hexdigest()[:10]
+    return f"{base}.{huella}{ext}"
+
+
+def _comprimir(ruta_destino: str, contenido: bytes) -> List[str]:
+    """Escribe las variantes .gz/.br junto al archivo si ocupan menos."""
+    variantes = [(".gz", gzip.compress(contenido, 9, mtime=0))]
+    if brotli is not None:
+        variantes.append((".br", brotli.compress(contenido, quality=11)))
+
+    escritas = []
+    for sufijo, datos in variantes:
+        if len(datos) < len(contenido):
+            with open(ruta_destino + sufijo, "wb") as f:
+                f.write(datos)
+            escritas.append(sufijo)
+    return escritas
+
+
+def construir_assets(static_dir: str) -> Dict[str, str]:
+    """
+    Copia cada archivo de static/ a static/dist/ con el hash del contenido en
+    el nombre, precomprime los de texto y escribe el manifiesto
+    {ruta original: ruta con hash}. La carpeta dist se rehace desde cero.
+    """
+    dist = os.path.join(static_dir, CARPETA_DIST)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+
+    manifiesto = {}
+    for raiz, carpetas, archivos in os.walk(static_dir):
+        if os.path.abspath(raiz) == os.path.abspath(static_dir):
+            carpetas[:] = [c for c in carpetas if c != CARPETA_DIST]
+        for nombre in sorted(archivos):
+            origen = os.path.join(raiz, nombre)
+            relativa = os.path.relpath(origen, static_dir).replace(os.sep, "/")
+            with open(origen, "rb") as f:
+                contenido = f.read()
+
+            con_hash = f"{CARPETA_DIST}/{_nombre_con_hash(relativa, contenido)}"
+            destino = os.path.join(static_dir, *con_hash.split("/"))
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            with open(destino, "wb") as f:
+                f.write(contenido)
+
+            if os.path.splitext(nombre)[1].lower() in EXTENSIONES_COMPRIMIBLES:
+                _comprimir(destino, contenido)
+            manifiesto[relativa] = con_hash
+
+    with open(os.path.join(dist, MANIFIESTO), "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2, sort_keys=True)
+    return manifiesto
+
+
+def cargar_manifiesto(static_dir: str) -> Dict[str, str]:
+    """Lee el manifiesto; si no se ha construido nada devuelve {}."""
+    try:
+        with open(os.path.join(static_dir, CARPETA_DIST, MANIFIESTO), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# --------- Integración con Flask ---------
+
+def _codificacion_aceptada(variantes: Dict[str, bool]) -> Optional[str]:
+    """Elige br o gzip según Accept-Encoding y las variantes que existen."""
+    for codificacion, sufijo in (("br", ".br"), ("gzip", ".gz")):
+        if variantes.get(sufijo) and request.accept_encodings[codificacion] > 0:
+            return codificacion
+    return None
+
+
+def registrar_assets(app) -> None:
+    """
+    Conecta el manifiesto con la app:
+      - url_for('static', filename=...) devuelve la ruta con hash si existe;
+      - los archivos con hash se sirven con Cache-Control inmutable y, si el
+        cliente lo acepta, en su variante .br/.gz precomprimida.
+    Sin manifiesto (o en modo debug) todo funciona como antes.
+    """
+    manifiesto = cargar_manifiesto(app.static_folder)
+    if not manifiesto:
+        return
+
+    # Qué variantes comprimidas existen, para no tocar el disco por petición
+    comprimidos = {}
+    for con_hash in manifiesto.values():
+        ruta = os.path.join(app.static_folder, *con_hash.split("/"))
+        comprimidos[con_hash] = {
+            sufijo: os.path.isfile(ruta + sufijo) for sufijo in (".br", ".gz")
+        }
+
+    @app.url_defaults
+    def _static_con_hash(endpoint, values):
+        # En debug se sirven los originales para ver los cambios sin reconstruir
+        if endpoint != "static" or current_app.debug:
+            return
+        filename = values.get("filename")
+        if filename in manifiesto:
+            values["filename"] = manifiesto[filename]
+
+    servir_original = app.view_functions["static"]
+
+    def servir_estatico(filename):
+        variantes = comprimidos.get(filename)
+        if variantes is None:
+            return servir_original(filename=filename)
+
+        codificacion = _codificacion_aceptada(variantes)
+        if codificacion is None:
+            respuesta = servir_original(filename=filename)
+        else:
+            sufijo = ".br" if codificacion == "br" else ".gz"
+            tipo = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            respuesta = send_from_directory(app.static_folder, filename + sufijo, mimetype=tipo)
+            respuesta.headers["Content-Encoding"] = codificacion
+
+        respuesta.headers["Cache-Control"] = CACHE_INMUTABLE
+        respuesta.vary.add("Accept-Encoding")
+        return respuesta
+
+    app.view_functions["static"] = servir_estatico
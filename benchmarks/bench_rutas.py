@@ -0,0 +1,336 @@
+"""
+Benchmark de carga por ruta: recorre las rutas de app.py y reporta latencia
+p50/p95/p99 y peticiones por segundo de cada una.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/generar_datos.py --citas 100000 --db bench_vetify.db
+    python benchmarks/bench_rutas.py --db bench_vetify.db --guardar base.json
+    ... cambios ...
+    python benchmarks/bench_rutas.py --db bench_vetify.db --comparar base.json
+
+Modos:
+    --modo cliente   (por defecto) test client de Flask, un hilo, sin red.
+    --modo servidor  servidor WSGI local con hilos y --hilos clientes HTTP
+                     concurrentes; incluye el coste de red y la contención.
+
+Con --comparar se sale con código 1 si el p95 de alguna ruta empeora más que
+--umbral (relativo) y más que --minimo-ms (absoluto, para ignorar ruido).
+"""
+import argparse
+import http.client
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import quote, urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# (nombre, método, url); las {claves} se rellenan con datos de la base
+RUTAS = [
+    ("login", "GET", "/login"),
+    ("index", "GET", "/"),
+    ("agenda", "GET", "/agenda"),
+    ("citas", "GET", "/citas"),
+    ("citas_urgencia", "GET", "/citas?urg=alta"),
+    ("citas_mes", "GET", "/citas?desde={hace_un_mes}"),
+    ("citas_siguiente_pagina", "GET", "/citas?desde={hace_un_mes}&cursor={cursor}"),
+    ("calendario_semana", "GET", "/calendario?vista=semana"),
+    ("calendario_mes", "GET", "/calendario?vista=mes"),
+    ("pacientes", "GET", "/pacientes"),
+    ("paciente_detalle", "GET", "/paciente/{paciente_id}"),
+    ("register", "GET", "/register"),
+    ("importar", "GET", "/importar"),
+    ("appointment", "GET", "/appointment"),
+    ("cita_detalle", "GET", "/cita/{cita_id}"),
+    ("cita_editar", "GET", "/cita/{cita_id}/editar"),
+    ("vets", "GET", "/vets"),
+    ("reportes", "GET", "/reportes"),
+    ("jobs", "GET", "/jobs"),
+    ("buscar", "GET", "/buscar?q=luna"),
+    ("buscar_prefijo", "GET", "/buscar?q=ga"),
+    ("api_citas_hoy", "GET", "/api/citas/hoy"),
+    ("api_citas", "GET", "/api/citas?desde={hace_un_mes}"),
+    ("api_pacientes", "GET", "/api/pacientes"),
+    ("api_paciente", "GET", "/api/pacientes/{paciente_id}"),
+    ("api_veterinarios", "GET", "/api/veterinarios"),
+    ("api_disponibilidad", "GET", "/api/vets/{vet_id}/disponibilidad?fecha={hoy}"),
+    ("export_citas", "GET", "/export/citas?desde={hace_una_semana}"),
+    ("export_pacientes", "GET", "/export/pacientes?desde={hace_un_mes}"),
+    ("metrics", "GET", "/metrics"),
+]
+
+# Solo con --escrituras: reservas en horarios libres de un futuro lejano
+RUTA_RESERVA = "appointment_post"
+
+
+def _datos_rutas(ruta_db: str) -> dict:
+    conn = sqlite3.connect(ruta_db)
+    hoy = date.today()
+    desde = (hoy - timedelta(days=30)).isoformat()
+    fila = conn.execute(
+        "SELECT fecha_hora, id FROM citas WHERE fecha_hora >= ? ORDER BY fecha_hora, id LIMIT 1 OFFSET 99;",
+        (desde,)
+    ).fetchone()
+    datos = {
+        "hoy": hoy.isoformat(),
+        "hace_un_mes": desde,
+        "hace_una_semana": (hoy - timedelta(days=7)).isoformat(),
+        "cursor": quote(f"{fila[0]}|{fila[1]}") if fila else "",
+        "cita_id": conn.execute("SELECT MAX(id) FROM citas;").fetchone()[0] or 1,
+        "vet_id": conn.execute("SELECT MIN(id) FROM veterinarios;").fetchone()[0] or 1,
+        "mascota_id": conn.execute("SELECT MIN(id) FROM mascotas;").fetchone()[0] or 1,
+        "paciente_id": conn.execute("SELECT MAX(id) FROM mascotas;").fetchone()[0] or 1,
+        "citas": conn.execute("SELECT COUNT(*) FROM citas;").fetchone()[0],
+        # Las reservas de corridas anteriores quedan en la base: se sigue después
+        "ultima_cita": conn.execute("SELECT MAX(fecha_hora) FROM citas;").fetchone()[0],
+    }
+    conn.close()
+    return datos
+
+
+def _formularios_reserva(datos: dict):
+    """Formularios de reserva que no chocan entre sí: cada uno en su hora."""
+    dia = datetime(2099, 1, 5, 7, 0)
+    if datos["ultima_cita"]:
+        ultima = datetime.fromisoformat(datos["ultima_cita"]).date() + timedelta(days=1)
+        dia = max(dia, datetime.combine(ultima, dia.time()))
+    while True:
+        for h in range(10):
+            inicio = dia + timedelta(minutes=30 * h)
+            yield {
+                "mascota_id": datos["mascota_id"], "vet_id": datos["vet_id"],
+                "tipo_servicio": "Consulta", "sintomas": "control de rutina",
+                "fecha_cita": inicio.date().isoformat(), "hora_cita": inicio.strftime("%H:%M"),
+            }
+        dia += timedelta(days=1)
+
+
+# --------- Clientes ---------
+
+class ClientePrueba:
+    """Test client de Flask con sesión iniciada."""
+
+    def __init__(self, app, usuario, clave):
+        self.cliente = app.test_client()
+        r = self.cliente.post("/login", data={"username": usuario, "password": clave})
+        if r.status_code != 302:
+            raise SystemExit("No se pudo iniciar sesión (¿existe el usuario admin?).")
+
+    def pedir(self, metodo, url, datos=None):
+        r = self.cliente.open(url, method=metodo, data=datos)
+        r.get_data()  # consumir también las respuestas en streaming
+        r.close()
+        return r.status_code
+
+
+class ClienteHttp:
+    """Conexión HTTP contra el servidor local, una por hilo."""
+
+    def __init__(self, puerto, cookie):
+        self.puerto = puerto
+        self.cookie = cookie
+        self.local = threading.local()
+
+    def _conexion(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection("127.0.0.1", self.puerto)
+        return conn
+
+    def pedir(self, metodo, url, datos=None):
+        cuerpo = urlencode(datos) if datos else None
+        cabeceras = {"Cookie": self.cookie}
+        if cuerpo:
+            cabeceras["Content-Type"] = "application/x-www-form-urlencoded"
+        conn = self._conexion()
+        try:
+            conn.request(metodo, url, body=cuerpo, headers=cabeceras)
+            r = conn.getresponse()
+            r.read()
+        except (http.client.HTTPException, ConnectionError):
+            # El servidor de desarrollo puede cerrar la conexión: se reabre
+            conn.close()
+            self.local.conn = None
+            return self.pedir(metodo, url, datos)
+        if r.getheader("Connection", "").lower() == "close" or r.version == 10:
+            conn.close()
+            self.local.conn = None
+        return r.status
+
+
+def _iniciar_servidor(app, usuario, clave):
+    from werkzeug.serving import make_server
+
+    servidor = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    puerto = servidor.server_port
+
+    conn = http.client.HTTPConnection("127.0.0.1", puerto)
+    conn.request("POST", "/login", body=urlencode({"username": usuario, "password": clave}),
+                 headers={"Content-Type": "application/x-www-form-urlencoded"})
+    r = conn.getresponse()
+    r.read()
+    cookie = r.getheader("Set-Cookie", "").split(";", 1)[0]
+    conn.close()
+    if r.status != 302 or not cookie:
+        raise SystemExit("No se pudo iniciar sesión (¿existe el usuario admin?).")
+    return servidor, ClienteHttp(puerto, cookie)
+
+
+# --------- Medición ---------
+
+def _percentiles(tiempos):
+    if len(tiempos) < 2:
+        t = tiempos[0] if tiempos else 0.0
+        return t, t, t
+    q = statistics.quantiles(tiempos, n=100, method="inclusive")
+    return q[49], q[94], q[98]
+
+
+def medir_ruta(cliente, metodo, url, peticiones, hilos, calentamiento, max_segundos, formularios=None):
+    for _ in range(calentamiento):
+        cliente.pedir(metodo, url, next(formularios) if formularios else None)
+
+    tiempos = []
+    errores = 0
+    lock = threading.Lock()
+    limite = time.perf_counter() + max_segundos
+
+    def una():
+        nonlocal errores
+        if time.perf_counter() > limite:
+            return
+        datos = None
+        if formularios:
+            with lock:
+                datos = next(formularios)
+        t0 = time.perf_counter()
+        estado = cliente.pedir(metodo, url, datos)
+        t = time.perf_counter() - t0
+        with lock:
+            tiempos.append(t)
+            if estado >= 400:
+                errores += 1
+
+    inicio = time.perf_counter()
+    if hilos == 1:
+        for _ in range(peticiones):
+            una()
+    else:
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            list(pool.map(lambda _: una(), range(peticiones)))
+    total = time.perf_counter() - inicio
+
+    p50, p95, p99 = _percentiles(tiempos)
+    return {
+        "n": len(tiempos),
+        "errores": errores,
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "rps": len(tiempos) / total if total else 0.0,
+    }
+
+
+def comparar(resultados, base, umbral, minimo_ms):
+    """Devuelve las rutas cuyo p95 empeoró más de lo permitido."""
+    regresiones = []
+    for nombre, r in resultados.items():
+        anterior = base.get("rutas", {}).get(nombre)
+        if not anterior:
+            continue
+        antes, ahora = anterior["p95_ms"], r["p95_ms"]
+        if ahora > antes * (1 + umbral) and ahora - antes > minimo_ms:
+            regresiones.append((nombre, antes, ahora))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="bench_vetify.db", help="base a usar (ver generar_datos.py)")
+    parser.add_argument("--modo", choices=["cliente", "servidor"], default="cliente")
+    parser.add_argument("--hilos", type=int, default=8, help="clientes concurrentes en modo servidor")
+    parser.add_argument("--peticiones", type=int, default=50, help="peticiones por ruta")
+    parser.add_argument("--calentamiento", type=int, default=3, help="peticiones previas sin medir")
+    parser.add_argument("--max-segundos", type=float, default=15.0, help="tiempo máximo por ruta")
+    parser.add_argument("--rutas", help="solo estas rutas (nombres separados por comas)")
+    parser.add_argument("--escrituras", action="store_true",
+                        help=f"incluir {RUTA_RESERVA} (crea citas en 2099 en la base)")
+    parser.add_argument("--usuario", default="admin")
+    parser.add_argument("--clave", default="admin123")
+    parser.add_argument("--guardar", help="guardar los resultados como línea base (JSON)")
+    parser.add_argument("--comparar", help="línea base (JSON) contra la que comparar el p95")
+    parser.add_argument("--umbral", type=float, default=0.20, help="empeoramiento relativo permitido")
+    parser.add_argument("--minimo-ms", type=float, default=1.0, help="empeoramiento absoluto ignorado")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"No existe {args.db}; créala con benchmarks/generar_datos.py.")
+    # db.py lee VETIFY_DB al importarse, antes de que app prepare la base
+    os.environ["VETIFY_DB"] = args.db
+    from app import app  # noqa: E402
+
+    datos = _datos_rutas(args.db)
+    rutas = [(n, m, u.format(**datos)) for n, m, u in RUTAS]
+    if args.escrituras:
+        rutas.append((RUTA_RESERVA, "POST", "/appointment"))
+    if args.rutas:
+        elegidas = set(args.rutas.split(","))
+        rutas = [r for r in rutas if r[0] in elegidas]
+
+    servidor = None
+    if args.modo == "servidor":
+        servidor, cliente = _iniciar_servidor(app, args.usuario, args.clave)
+        hilos = args.hilos
+    else:
+        cliente = ClientePrueba(app, args.usuario, args.clave)
+        hilos = 1
+
+    print(f"{args.db}: {datos['citas']} citas, modo {args.modo}, {hilos} hilo(s)")
+    print(f"{'ruta':<26}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    resultados = {}
+    for nombre, metodo, url in rutas:
+        formularios = _formularios_reserva(datos) if nombre == RUTA_RESERVA else None
+        r = medir_ruta(cliente, metodo, url, args.peticiones, hilos,
+                       args.calentamiento, args.max_segundos, formularios)
+        resultados[nombre] = r
+        aviso = f"  ({r['errores']} errores)" if r["errores"] else ""
+        print(f"{nombre:<26}{r['n']:>5}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['rps']:>10.1f}{aviso}")
+
+    if servidor is not None:
+        servidor.shutdown()
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump({
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "db": args.db,
+                "citas": datos["citas"],
+                "modo": args.modo,
+                "hilos": hilos,
+                "rutas": resultados,
+            }, f, indent=2)
+        print(f"Línea base guardada en {args.guardar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        if base.get("modo") != args.modo or base.get("citas") != datos["citas"]:
+            print("Aviso: la línea base se tomó con otro modo o con otra cantidad de citas.")
+        regresiones = comparar(resultados, base, args.umbral, args.minimo_ms)
+        for nombre, antes, ahora in regresiones:
+            print(f"REGRESIÓN {nombre}: p95 {antes:.2f} ms -> {ahora:.2f} ms")
+        if regresiones:
+            sys.exit(1)
+        print(f"Sin regresiones (umbral {args.umbral:.0%}, mínimo {args.minimo_ms} ms).")
+
+
+if __name__ == "__main__":
+    main()
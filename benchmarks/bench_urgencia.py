@@ -0,0 +1,116 @@
+"""
+Micro-benchmark de services.analizar_urgencia frente a la implementación
+anterior (búsquedas `in` una por una sobre listas de palabras).
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_urgencia.py [--notas 2000] [--largo 1500]
+
+Antes de medir comprueba que ambas versiones dan el mismo resultado en todas
+las notas generadas.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import analizar_urgencia, analizar_urgencia_lote  # noqa: E402
+
+
+def analizar_urgencia_anterior(sintomas: str) -> str:
+    texto = (sintomas or "").lower()
+    palabras_alta = [
+        "sangra", "sangrado", "hemorragia",
+        "no respira", "dificultad para respirar", "ahogando",
+        "convulsiona", "convulsión", "convulsiones",
+        "muy débil", "muy debil",
+        "no se mueve", "inconsciente"
+    ]
+    for p in palabras_alta:
+        if p in texto:
+            return "alta"
+
+    if "herida" in texto or "puntos" in texto or "sutura" in texto or "post operatorio" in texto or "post-operatorio" in texto:
+        if "sangra" in texto or "sangrado" in texto or "hemorragia" in texto:
+            return "alta"
+        if "abrió" in texto or "abrio" in texto or "abierta" in texto or "abierto" in texto or "se le abrió" in texto:
+            return "media"
+        return "media"
+
+    palabras_media = [
+        "no quiere jugar", "triste", "no bebe",
+        "apatía", "apatico", "apática",
+        "diarrea", "tos", "cojea", "cojera",
+        "dolor", "molestia", "no apoya la pata"
+    ]
+    for p in palabras_media:
+        if p in texto:
+            return "media"
+
+    return "baja"
+
+
+RELLENO = (
+    "el paciente llegó acompañado de su responsable, come poco desde ayer, "
+    "se observa el pelaje opaco y refiere que duerme más de lo normal. "
+    "Vacunas al día, desparasitado hace tres meses, sin viajes recientes. "
+).split()
+
+CLAVES = [
+    "sangrado", "Hemorragia", "no respira", "convulsión", "convulsiones",
+    "muy débil", "muy debil", "inconsciente", "herida", "puntos", "sutura",
+    "post-operatorio", "post operatorio", "se le abrió", "triste", "no bebe",
+    "apatía", "apática", "diarrea", "tos", "cojera", "dolor", "molestia",
+    "no apoya la pata",
+]
+
+
+def generar_notas(cantidad: int, largo: int, semilla: int = 7):
+    rnd = random.Random(semilla)
+    notas = []
+    for _ in range(cantidad):
+        palabras = []
+        while sum(len(p) + 1 for p in palabras) < largo:
+            palabras.append(rnd.choice(RELLENO))
+        # Un tercio sin palabras clave (peor caso: se recorre todo el texto)
+        if rnd.random() > 0.33:
+            palabras.insert(rnd.randrange(len(palabras)), rnd.choice(CLAVES))
+        notas.append(" ".join(palabras))
+    return notas
+
+
+def medir(nombre, funcion, repeticiones=3):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - t0)
+    print(f"{nombre:<28} {mejor * 1000:9.2f} ms")
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--notas", type=int, default=2000, help="cantidad de notas")
+    parser.add_argument("--largo", type=int, default=1500, help="caracteres por nota")
+    args = parser.parse_args()
+
+    notas = generar_notas(args.notas, args.largo)
+
+    anterior = [analizar_urgencia_anterior(n) for n in notas]
+    if [analizar_urgencia(n) for n in notas] != anterior:
+        sys.exit("ERROR: analizar_urgencia no coincide con la versión anterior")
+    if analizar_urgencia_lote(notas) != anterior:
+        sys.exit("ERROR: analizar_urgencia_lote no coincide con la versión anterior")
+
+    print(f"{args.notas} notas de ~{args.largo} caracteres")
+    t_ant = medir("anterior (in + listas)", lambda: [analizar_urgencia_anterior(n) for n in notas])
+    t_new = medir("analizar_urgencia", lambda: [analizar_urgencia(n) for n in notas])
+    t_lote = medir("analizar_urgencia_lote", lambda: analizar_urgencia_lote(notas))
+    print(f"aceleración: x{t_ant / t_new:.1f} (una a una), x{t_ant / t_lote:.1f} (lote)")
+
+
+if __name__ == "__main__":
+    main()
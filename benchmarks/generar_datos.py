@@ -0,0 +1,236 @@
+"""
+Genera una base de datos sintética con responsables, mascotas, veterinarios
+y años de citas, para medir la aplicación a escala de producción.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/generar_datos.py --citas 100000 [--anios 3] [--db bench_vetify.db]
+
+Después se puede levantar la aplicación o el benchmark sobre esa base:
+    VETIFY_DB=bench_vetify.db flask --app app run
+    python benchmarks/bench_rutas.py --db bench_vetify.db
+
+Las citas respetan los bloques de atención y no se solapan por veterinario;
+la duración y fecha_fin salen de DURACION_SERVICIO, como en crear_cita.
+La base se crea desde cero (se borra si existe).
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from services import BLOQUES_ATENCION, analizar_urgencia_lote, duracion_servicio  # noqa: E402
+
+NOMBRES = [
+    "Ana", "Luis", "María", "José", "Carmen", "Jorge", "Lucía", "Carlos", "Sofía",
+    "Miguel", "Elena", "Andrés", "Paula", "Diego", "Rosa", "Fernando", "Valeria",
+    "Ricardo", "Gabriela", "Roberto", "Daniela", "Héctor", "Marta", "Óscar",
+]
+APELLIDOS = [
+    "García", "Hernández", "López", "Martínez", "González", "Pérez", "Rodríguez",
+    "Sánchez", "Ramírez", "Flores", "Rivera", "Gómez", "Díaz", "Cruz", "Morales",
+    "Reyes", "Ortiz", "Castillo", "Mejía", "Aguilar",
+]
+NOMBRES_MASCOTA = [
+    "Luna", "Max", "Rocky", "Bella", "Toby", "Nala", "Simba", "Coco", "Lola",
+    "Kira", "Thor", "Milo", "Canela", "Bruno", "Pelusa", "Chispa", "Manchas",
+    "Oreo", "Kiwi", "Copito", "Zeus", "Maya", "Rex", "Mía",
+]
+# (tipo, razas, rango de edad, rango de peso)
+ESPECIES = [
+    ("Perro", ["Labrador", "Pastor alemán", "Chihuahua", "Poodle", "Mestizo", "Beagle"], (0, 15), (2.0, 40.0)),
+    ("Gato", ["Siamés", "Persa", "Mestizo", "Angora"], (0, 18), (2.0, 7.0)),
+    ("Ave", ["Perico", "Canario", "Loro"], (0, 20), (0.05, 1.0)),
+    ("Conejo", ["Enano", "Belier", "Mestizo"], (0, 10), (1.0, 5.0)),
+    ("Otro", ["Hámster", "Tortuga", "Hurón"], (0, 8), (0.1, 3.0)),
+]
+PESOS_ESPECIE = [55, 30, 7, 5, 3]
+
+ESPECIALIDADES = ["Perros", "Gatos", "Aves", "General", "Cirugía", "Exóticos"]
+
+# (servicio, peso relativo, síntomas típicos)
+SERVICIOS = [
+    ("Consulta", 40, ["vómitos desde ayer", "no quiere comer", "tos seca", "diarrea leve",
+                      "se rasca mucho", "cojea de la pata trasera", "decaído"]),
+    ("Vacunación", 20, ["vacuna anual", "refuerzo de vacuna", ""]),
+    ("Desparasitación", 12, ["desparasitación trimestral", ""]),
+    ("Control post-operatorio", 8, ["revisión de puntos", "la herida se ve bien",
+                                    "la herida se abrió un poco", "herida con sangrado"]),
+    ("Emergencia", 6, ["sangra mucho de una pata", "convulsiones repetidas",
+                       "dificultad para respirar", "no se mueve, está muy débil"]),
+    ("Urgencia", 4, ["vomita sangre", "no respira bien", "golpe fuerte, inconsciente"]),
+    ("Cirugía", 5, ["esterilización programada", "extracción de tumor", "limpieza dental"]),
+    ("Otro", 5, ["corte de uñas", "certificado de salud", "baño medicado"]),
+]
+
+# Citas medias por veterinario y día laborable (cabe de sobra en los bloques)
+CITAS_POR_VET_DIA = 8
+LOTE = 20000
+
+
+def _nombre_persona(rng):
+    return f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+
+
+def _dias_laborables(desde: date, hasta: date):
+    dia = desde
+    while dia <= hasta:
+        if dia.weekday() < 5:
+            yield dia
+        dia += timedelta(days=1)
+
+
+def _agenda_dia(rng, k, bloques, servicios, pesos):
+    """Hasta k citas (inicio en minutos, servicio, duración) sin solaparse."""
+    elegidas = rng.choices(servicios, weights=pesos, k=k)
+    resultado = []
+    i = 0
+    for inicio, fin in bloques:
+        t = inicio
+        while i < len(elegidas):
+            servicio, sintomas = elegidas[i]
+            duracion = duracion_servicio(servicio)
+            hueco = rng.choice((0, 0, 0, 30))  # algún hueco libre entre citas
+            if t + hueco + duracion > fin:
+                hueco = 0
+            if t + duracion > fin:
+                # Al final del bloque una cita larga se cambia por una consulta
+                servicio, sintomas = servicios[0]
+                duracion = duracion_servicio(servicio)
+                if t + duracion > fin:
+                    break
+            t += hueco
+            resultado.append((t, servicio, duracion, rng.choice(sintomas)))
+            t += duracion
+            i += 1
+    return resultado
+
+
+def generar(ruta: str, citas: int, anios: int, semilla: int) -> dict:
+    rng = random.Random(semilla)
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(ruta + sufijo):
+            os.remove(ruta + sufijo)
+    db.DB_NAME = ruta
+    db.init_db()
+    db.seed_admin()
+
+    hoy = date.today()
+    dias = list(_dias_laborables(hoy - timedelta(days=365 * anios), hoy + timedelta(days=30)))
+    n_vets = max(4, math.ceil(citas / (len(dias) * CITAS_POR_VET_DIA)))
+    n_mascotas = max(50, citas // 6)
+    n_duenos = max(30, n_mascotas * 2 // 3)
+
+    conn = db.abrir_conexion()
+    cur = conn.cursor()
+    inicio = time.perf_counter()
+
+    cur.execute("BEGIN;")
+    cur.executemany(
+        "INSERT INTO veterinarios (id, nombre, especialidad, telefono) VALUES (?, ?, ?, ?);",
+        [(i, f"{rng.choice(('Dr.', 'Dra.'))} {rng.choice(APELLIDOS)}",
+          ESPECIALIDADES[i % len(ESPECIALIDADES)], f"7777-{i:04d}")
+         for i in range(1, n_vets + 1)]
+    )
+    cur.executemany(
+        "INSERT INTO duenos (id, nombre, telefono, correo) VALUES (?, ?, ?, ?);",
+        [(i, _nombre_persona(rng), f"{rng.randint(6000, 7999)}-{rng.randint(0, 9999):04d}",
+          f"cliente{i}@correo.test")
+         for i in range(1, n_duenos + 1)]
+    )
+    registro_inicial = datetime.combine(dias[0], datetime.min.time())
+    mascotas = []
+    for i in range(1, n_mascotas + 1):
+        tipo, razas, (e0, e1), (p0, p1) = rng.choices(ESPECIES, weights=PESOS_ESPECIE)[0]
+        registro = registro_inicial + timedelta(minutes=rng.randint(0, 365 * anios * 24 * 60))
+        mascotas.append((
+            i, rng.choice(NOMBRES_MASCOTA), tipo, rng.choice(razas), rng.randint(e0, e1),
+            round(rng.uniform(p0, p1), 2), rng.randint(1, n_duenos),
+            registro.strftime("%Y-%m-%d %H:%M:%S"),
+        ))
+    cur.executemany(
+        """INSERT INTO mascotas (id, nombre, tipo, raza, edad, peso, dueno_id, fecha_registro)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?);""",
+        mascotas
+    )
+    conn.commit()
+    del mascotas
+
+    bloques = [(h0.hour * 60 + h0.minute, h1.hour * 60 + h1.minute) for h0, h1 in BLOQUES_ATENCION]
+    servicios = [(s, sintomas) for s, _, sintomas in SERVICIOS]
+    pesos = [p for _, p, _ in SERVICIOS]
+
+    # Se reparte el total entre (día, veterinario) para llegar a `citas`
+    casillas = len(dias) * n_vets
+    base, resto = divmod(citas, casillas)
+    extra = set(rng.sample(range(casillas), resto))
+
+    generadas = 0
+    pendientes = []
+
+    def volcar():
+        urgencias = analizar_urgencia_lote(f[4] for f in pendientes)
+        cur.execute("BEGIN;")
+        cur.executemany(
+            """INSERT INTO citas
+               (mascota_id, vet_id, fecha_hora, tipo_servicio, sintomas, urgencia, estado, duracion_min, fecha_fin)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);""",
+            [(*f[:5], u, *f[5:]) for f, u in zip(pendientes, urgencias)]
+        )
+        conn.commit()
+        pendientes.clear()
+
+    ahora = datetime.now()
+    casilla = 0
+    for dia in dias:
+        medianoche = datetime.combine(dia, datetime.min.time())
+        for vet_id in range(1, n_vets + 1):
+            k = base + (1 if casilla in extra else 0)
+            casilla += 1
+            for minuto, servicio, duracion, sintomas in _agenda_dia(rng, k, bloques, servicios, pesos):
+                fecha_hora = medianoche + timedelta(minutes=minuto)
+                pendientes.append((
+                    rng.randint(1, n_mascotas), vet_id, fecha_hora.isoformat(), servicio, sintomas,
+                    "pendiente" if fecha_hora > ahora else "completada",
+                    duracion, (fecha_hora + timedelta(minutes=duracion)).isoformat(),
+                ))
+            if len(pendientes) >= LOTE:
+                generadas += len(pendientes)
+                volcar()
+    if pendientes:
+        generadas += len(pendientes)
+        volcar()
+
+    conn.execute("PRAGMA optimize;")
+    conn.close()
+    return {
+        "veterinarios": n_vets,
+        "duenos": n_duenos,
+        "mascotas": n_mascotas,
+        "citas": generadas,
+        "segundos": time.perf_counter() - inicio,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--citas", type=int, default=10000, help="citas a generar, aproximadas (1k a 1M)")
+    parser.add_argument("--anios", type=int, default=3, help="años de historial hacia atrás")
+    parser.add_argument("--db", default="bench_vetify.db", help="archivo de la base a crear")
+    parser.add_argument("--semilla", type=int, default=42, help="semilla del generador")
+    args = parser.parse_args()
+
+    r = generar(args.db, args.citas, args.anios, args.semilla)
+    print(
+        f"{args.db}: {r['citas']} citas, {r['mascotas']} mascotas, {r['duenos']} responsables, "
+        f"{r['veterinarios']} veterinarios en {r['segundos']:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Tuple
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Hash y verificación de contraseñas en un pool de procesos acotado. El KDF
+# (scrypt por defecto) es caro a propósito y retiene el GIL mientras calcula:
+# hecho en el hilo de la petición, una ráfaga de inicios de sesión frena a
+# todas las demás páginas. En procesos aparte solo espera quien inicia sesión.
+#
+# Parámetros por variables de entorno:
+#   VETIFY_HASH_METODO    método de werkzeug, p. ej. scrypt:32768:8:1 o
+#                         pbkdf2:sha256:600000. Al cambiarlo, cada usuario
+#                         pasa al nuevo en su próximo inicio de sesión.
+#   VETIFY_HASH_PROCESOS  procesos del pool
+#   VETIFY_HASH_COLA      operaciones en curso o en espera como máximo
+
+METODO_HASH = os.environ.get("VETIFY_HASH_METODO", "scrypt:32768:8:1")
+LARGO_SAL = 16
+MAX_PROCESOS = int(os.environ.get("VETIFY_HASH_PROCESOS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+MAX_EN_COLA = int(os.environ.get("VETIFY_HASH_COLA", "32"))
+TIMEOUT_HASH = 15
+
+
+class ClavesSaturadas(Exception):
+    """Hay demasiadas operaciones de contraseña en espera; reintentar luego."""
+
+
+_ejecutor = None
+_ejecutor_pid = None
+_ejecutor_lock = threading.Lock()
+_cupo = threading.BoundedSemaphore(MAX_EN_COLA)
+
+
+def _pool() -> ProcessPoolExecutor:
+    # Como en trabajos.py: tras un fork cada proceso crea el suyo. Los
+    # procesos del pool se crean con spawn: no heredan hilos ni conexiones,
+    # pero cada uno vuelve a importar el módulo principal (como __mp_main__).
+    # Por eso la app corre con `flask run` o un servidor WSGI, nunca como
+    # script: `python app.py` se relanza como `python -m flask run`.
+    global _ejecutor, _ejecutor_pid
+    with _ejecutor_lock:
+        if _ejecutor is None or _ejecutor_pid != os.getpid():
+            _ejecutor = ProcessPoolExecutor(
+                max_workers=MAX_PROCESOS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _ejecutor_pid = os.getpid()
+        return _ejecutor
+
+
+# --------- Funciones que corren en el pool ---------
+
+@lru_cache(maxsize=4)
+def _prefijo(metodo: str) -> str:
+    """Método tal como queda guardado ('scrypt' -> 'scrypt:32768:8:1')."""
+    return generate_password_hash("", metodo, 1).split("$", 1)[0]
+
+
+def _hashear(clave: str, metodo: str) -> str:
+    return generate_password_hash(clave, metodo, LARGO_SAL)
+
+
+def _verificar(hash_guardado: str, clave: str, metodo: str) -> Tuple[bool, str | None]:
+    if not check_password_hash(hash_guardado, clave):
+        return False, None
+    if hash_guardado.split("$", 1)[0] == _prefijo(metodo):
+        return True, None
+    return True, generate_password_hash(clave, metodo, LARGO_SAL)
+
+
+def _en_pool(funcion, *args):
+    # El cupo se libera cuando la tarea termina en el pool, no cuando el
+    # llamador deja de esperarla: así MAX_EN_COLA acota de verdad lo pendiente.
+    if not _cupo.acquire(blocking=False):
+        raise ClavesSaturadas()
+    try:
+        futuro = _pool().submit(funcion, *args)
+    except BaseException:
+        _cupo.release()
+        raise
+    futuro.add_done_callback(lambda _: _cupo.release())
+    try:
+        return futuro.result(timeout=TIMEOUT_HASH)
+    except TimeoutError:
+        # El pool no da abasto: para el llamador es lo mismo que la cola llena
+        raise ClavesSaturadas()
+
+
+# --------- API ---------
+
+def generar_hash(clave: str) -> str:
+    """Hash de la contraseña con METODO_HASH. Lanza ClavesSaturadas."""
+    return _en_pool(_hashear, clave, METODO_HASH)
+
+
+def verificar_clave(hash_guardado: str, clave: str) -> Tuple[bool, str | None]:
+    """
+    (coincide, hash_nuevo). hash_nuevo no es None cuando la contraseña es
+    correcta pero se guardó con otro método: el llamador debe reemplazarlo.
+    Lanza ClavesSaturadas.
+    """
+    return _en_pool(_verificar, hash_guardado, clave, METODO_HASH)
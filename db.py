@@ -1,18 +1,324 @@
+import os
+import re
 import sqlite3
-from werkzeug.security import generate_password_hash # Necesario para crear el admin seguro
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from claves import generar_hash  # Hash en el pool de procesos (ver claves.py)
 
-DB_NAME = "vetify_web.db"
+# VETIFY_DB permite apuntar a otra base (p. ej. la de benchmarks/generar_datos.py)
+DB_NAME = os.environ.get("VETIFY_DB", "vetify_web.db")
 
-def get_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Ajustes que se aplican una sola vez al abrir cada conexión.
+# WAL permite lecturas concurrentes mientras otro hilo escribe, y con
+# synchronous=NORMAL solo se hace fsync en los checkpoints.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA cache_size = -16000;",      # ~16 MB de caché de páginas
+    "PRAGMA mmap_size = 134217728;",    # 128 MB mapeados en memoria
+    "PRAGMA busy_timeout = 5000;",      # esperar 5 s si la BD está bloqueada
+    "PRAGMA temp_store = MEMORY;",
+)
+
+# Tamaño de la caché de sentencias preparadas de sqlite3 (por conexión).
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+# --------- Clínicas ---------
+# Cada clínica tiene su propia base de datos. Sin VETIFY_CLINICAS todo usa
+# DB_NAME, como con una sola clínica. Con VETIFY_CLINICAS=<carpeta>, la base
+# de la clínica "norte" es <carpeta>/norte.db: la clínica de cada petición
+# sale de la sesión (ver app.py) y la de los comandos de VETIFY_CLINICA.
+# VETIFY_CLINICAS_NODO=norte,sur limita las clínicas que atiende este
+# servidor, para repartirlas entre varios nodos detrás de un proxy.
+
+CARPETA_CLINICAS = os.environ.get("VETIFY_CLINICAS") or None
+CLINICAS_DEL_NODO = frozenset(
+    c.strip() for c in os.environ.get("VETIFY_CLINICAS_NODO", "").split(",") if c.strip()
+)
+CLINICA_POR_DEFECTO = os.environ.get("VETIFY_CLINICA", "")
+
+# Conexiones abiertas por hilo, una por clínica; al pasarse se cierra la
+# usada hace más tiempo.
+MAX_CONEXIONES_POR_HILO = int(os.environ.get("VETIFY_CONEXIONES_POR_HILO", "8"))
+
+_NOMBRE_CLINICA = re.compile(r"^[a-z0-9][a-z0-9_-]{0,39}$")
+
+
+class ClinicaDesconocida(Exception):
+    """La clínica no existe o no la atiende este nodo."""
+
+
+def multiclinica() -> bool:
+    return CARPETA_CLINICAS is not None
+
+
+def clinica_actual() -> str:
+    return getattr(_local, "clinica", None) or CLINICA_POR_DEFECTO
+
+
+def fijar_clinica(nombre: str | None) -> None:
+    """Clínica de las conexiones de este hilo (la fija cada petición)."""
+    _local.clinica = nombre or None
+
+
+@contextmanager
+def usar_clinica(nombre: str):
+    anterior = getattr(_local, "clinica", None)
+    _local.clinica = nombre
+    try:
+        yield
+    finally:
+        _local.clinica = anterior
+
+
+def ruta_bd(clinica: str | None = None, crear: bool = False) -> str:
+    """Archivo de la base de la clínica (por defecto, la actual)."""
+    if not multiclinica():
+        return DB_NAME
+    clinica = clinica_actual() if clinica is None else clinica
+    if not _NOMBRE_CLINICA.match(clinica) or (CLINICAS_DEL_NODO and clinica not in CLINICAS_DEL_NODO):
+        raise ClinicaDesconocida(clinica)
+    ruta = os.path.join(CARPETA_CLINICAS, f"{clinica}.db")
+    # Nunca se crea una base por un nombre mal escrito en el login
+    if not crear and not os.path.exists(ruta):
+        raise ClinicaDesconocida(clinica)
+    return ruta
+
+
+def existe_clinica(nombre: str) -> bool:
+    try:
+        ruta_bd(nombre)
+    except ClinicaDesconocida:
+        return False
+    return True
+
+
+def listar_clinicas() -> list:
+    """Clínicas de la carpeta que atiende este nodo."""
+    if not multiclinica() or not os.path.isdir(CARPETA_CLINICAS):
+        return []
+    nombres = (f[:-3] for f in os.listdir(CARPETA_CLINICAS) if f.endswith(".db"))
+    return sorted(n for n in nombres if existe_clinica(n))
+
+
+# --------- Instrumentación ---------
+# Las conexiones de get_connection miden cada execute/executemany y avisan a
+# la función instalada con instalar_observador_sql(sql, segundos). Sin
+# observador el coste es una comprobación por sentencia.
+# Se mide hasta la primera fila: el resto se lee al hacer fetch. En las
+# consultas con ORDER BY o agregados casi todo el trabajo ocurre antes.
+
+_observador_sql = None
+
+
+def instalar_observador_sql(observador) -> None:
+    """observador(sql, segundos), o None para dejar de medir."""
+    global _observador_sql
+    _observador_sql = observador
+
+
+class CursorMedido(sqlite3.Cursor):
+    def execute(self, sql, parametros=()):
+        observador = _observador_sql
+        if observador is None:
+            return super().execute(sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            observador(sql, time.perf_counter() - inicio)
+
+    def executemany(self, sql, parametros):
+        observador = _observador_sql
+        if observador is None:
+            return super().executemany(sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            observador(sql, time.perf_counter() - inicio)
+
+
+class ConexionMedida(sqlite3.Connection):
+    # conn.execute() no pasa por cursor(), así que se redirigen los dos
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+
+def abrir_conexion(medida: bool = False, clinica: str | None = None):
+    """
+    Abre una conexión nueva con los PRAGMAs de rendimiento aplicados, a la
+    base de `clinica` (por defecto, la actual).
+    Con medida=True sus sentencias pasan por el observador SQL.
+    Quien la abre es responsable de cerrarla.
+    """
+    conn = sqlite3.connect(
+        ruta_bd(clinica),
+        cached_statements=CACHED_STATEMENTS,
+        factory=ConexionMedida if medida else sqlite3.Connection,
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
+
+def get_connection():
+    """
+    Devuelve la conexión persistente del hilo actual a la base de la clínica
+    actual, abriéndola la primera vez. Se reutiliza entre peticiones para no
+    pagar la apertura ni perder la caché de páginas y de sentencias
+    preparadas. No se debe cerrar.
+    """
+    clinica = clinica_actual()
+    conexiones = getattr(_local, "conexiones", None)
+    if conexiones is None:
+        conexiones = _local.conexiones = OrderedDict()
+    conn = conexiones.get(clinica)
+    if conn is not None:
+        conexiones.move_to_end(clinica)
+        return conn
+
+    if multiclinica():
+        _asegurar_esquema(clinica)
+    conn = abrir_conexion(medida=True)
+    conexiones[clinica] = conn
+    while len(conexiones) > MAX_CONEXIONES_POR_HILO:
+        _, vieja = conexiones.popitem(last=False)
+        vieja.close()
+    return conn
+
+
+def liberar_conexion():
+    """
+    Deshace cualquier transacción que haya quedado abierta en las conexiones
+    del hilo (p. ej. tras una excepción a mitad de una escritura). Las
+    conexiones siguen abiertas para la siguiente petición.
+    """
+    for conn in getattr(_local, "conexiones", {}).values():
+        if conn.in_transaction:
+            conn.rollback()
+    _transacciones().clear()
+
+
+# Clínicas cuyo esquema ya se comprobó en este proceso. Con una sola
+# clínica lo hace el arranque de la app (preparar_bd); con varias, la
+# primera conexión a cada una, así una clínica nueva o recién restaurada
+# se migra sola sin tocar a las demás.
+_clinicas_listas = set()
+_clinicas_lock = threading.Lock()
+
+
+def _asegurar_esquema(clinica: str) -> None:
+    if clinica in _clinicas_listas:
+        return
+    with _clinicas_lock:
+        if clinica not in _clinicas_listas:
+            with usar_clinica(clinica):
+                preparar_bd()
+            _clinicas_listas.add(clinica)
+
+
+# --------- Transacciones ---------
+# Unidad de trabajo: las funciones de services escriben dentro de
+# `with transaccion():`. Si el llamador ya abrió una (p. ej. una ruta que
+# crea el dueño y la mascota), se suman a ella con un SAVEPOINT en lugar de
+# confirmar por su cuenta: toda la petición usa la misma conexión y paga un
+# solo COMMIT. Lo que deba pasar después de confirmar (invalidar cachés,
+# avisar a la agenda) se registra con al_confirmar.
+
+class _Transaccion:
+    __slots__ = ("conn", "al_confirmar", "nivel")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.al_confirmar = []
+        self.nivel = 0
+
+
+def _transacciones() -> dict:
+    activas = getattr(_local, "transacciones", None)
+    if activas is None:
+        activas = _local.transacciones = {}
+    return activas
+
+
+@contextmanager
+def transaccion():
+    """
+    Abre la unidad de trabajo de la clínica actual (BEGIN IMMEDIATE) o se
+    anida en la que ya está abierta en este hilo. Devuelve la conexión.
+    Si el bloque lanza, se deshace solo lo hecho dentro de él; la
+    transacción de fuera sigue y decide si confirma.
+    """
+    activas = _transacciones()
+    clinica = clinica_actual()
+    tx = activas.get(clinica)
+
+    if tx is not None:
+        tx.nivel += 1
+        punto = f"sp{tx.nivel}"
+        pendientes = len(tx.al_confirmar)
+        tx.conn.execute(f"SAVEPOINT {punto};")
+        try:
+            yield tx.conn
+            tx.conn.execute(f"RELEASE {punto};")
+        except BaseException:
+            tx.conn.execute(f"ROLLBACK TO {punto};")
+            tx.conn.execute(f"RELEASE {punto};")
+            del tx.al_confirmar[pendientes:]
+            raise
+        finally:
+            tx.nivel -= 1
+        return
+
     conn = get_connection()
-    cur = conn.cursor()
+    tx = activas[clinica] = _Transaccion(conn)
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        yield conn
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        del activas[clinica]
+    for funcion in tx.al_confirmar:
+        funcion()
+
+
+def al_confirmar(funcion) -> None:
+    """
+    Ejecuta `funcion` cuando se confirme la transacción abierta de la
+    clínica actual (una sola vez aunque se registre varias), o en el acto
+    si no hay ninguna.
+    """
+    tx = _transacciones().get(clinica_actual())
+    if tx is None:
+        funcion()
+    elif funcion not in tx.al_confirmar:
+        tx.al_confirmar.append(funcion)
+
+
+# --------- Migraciones ---------
+# Cada migración lleva un número; PRAGMA user_version guarda la última
+# aplicada. Para cambiar el esquema se añade una función nueva al final de
+# MIGRACIONES, nunca se edita una ya publicada.
 
-    # Tabla Usuarios (NUEVA)
+def _migracion_1_esquema_base(cur):
+    # Tabla Usuarios
     cur.execute("""
     CREATE TABLE IF NOT EXISTS usuarios (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -72,29 +378,389 @@ def init_db():
         FOREIGN KEY (vet_id) REFERENCES veterinarios(id)
     );
     """)
-    
-    conn.commit()
 
-    # --- BLOQUE DE MIGRACIÓN DE MASCOTAS (IGUAL QUE ANTES) ---
-    try:
-        cur.execute("PRAGMA table_info(mascotas)")
-        columnas = [col[1] for col in cur.fetchall()]
+    # Bases creadas antes de existir fecha_registro (antes lo hacía fix_db.py)
+    cur.execute("PRAGMA table_info(mascotas)")
+    columnas = [col[1] for col in cur.fetchall()]
+    if "fecha_registro" not in columnas:
+        cur.execute("ALTER TABLE mascotas ADD COLUMN fecha_registro TEXT")
+        cur.execute("UPDATE mascotas SET fecha_registro = datetime('now', 'localtime') WHERE fecha_registro IS NULL")
+
+
+def _migracion_2_indices(cur):
+    # Choque de horario por profesional y agenda del día
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_citas_vet_fecha ON citas (vet_id, fecha_hora);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_citas_fecha ON citas (fecha_hora);")
+    # JOINs citas -> mascotas -> duenos
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_citas_mascota ON citas (mascota_id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_mascotas_dueno ON mascotas (dueno_id);")
 
-        if "fecha_registro" not in columnas:
-            print(" Actualizando estructura de BD (Mascotas)...")
-            cur.execute("ALTER TABLE mascotas ADD COLUMN fecha_registro TEXT")
-            cur.execute("UPDATE mascotas SET fecha_registro = datetime('now', 'localtime') WHERE fecha_registro IS NULL")
+
+def _migracion_3_indice_urgencia(cur):
+    # Calendario filtrado por urgencia dentro de una ventana de fechas
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_citas_urgencia_fecha ON citas (urgencia, fecha_hora);")
+
+
+def _migracion_4_duracion_citas(cur):
+    # Cada cita ocupa un intervalo [fecha_hora, fecha_fin) según su servicio.
+    # Los valores son los de services.DURACION_SERVICIO al crear la migración.
+    cur.execute("ALTER TABLE citas ADD COLUMN duracion_min INTEGER NOT NULL DEFAULT 30;")
+    cur.execute("ALTER TABLE citas ADD COLUMN fecha_fin TEXT;")
+    cur.execute("""
+        UPDATE citas
+        SET duracion_min = CASE tipo_servicio
+                WHEN 'Vacunación' THEN 15
+                WHEN 'Desparasitación' THEN 15
+                WHEN 'Emergencia' THEN 60
+                WHEN 'Urgencia' THEN 60
+                WHEN 'Cirugía' THEN 120
+                ELSE 30
+            END;
+    """)
+    cur.execute("""
+        UPDATE citas
+        SET fecha_fin = strftime('%Y-%m-%dT%H:%M:%S', fecha_hora, '+' || duracion_min || ' minutes');
+    """)
+    # Índice cubriente para la búsqueda de solapamientos por profesional
+    cur.execute("DROP INDEX IF EXISTS idx_citas_vet_fecha;")
+    cur.execute("CREATE INDEX idx_citas_vet_fecha ON citas (vet_id, fecha_hora, fecha_fin);")
+
+
+# Índices de texto completo (FTS5) con contenido externo: guardan solo el
+# índice invertido y leen el texto de la tabla original. Los triggers los
+# mantienen sincronizados con cada INSERT, UPDATE y DELETE.
+_TABLAS_FTS = [
+    ("mascotas_fts", "mascotas", ["nombre", "raza"]),
+    ("duenos_fts", "duenos", ["nombre", "telefono", "correo"]),
+    ("citas_fts", "citas", ["sintomas"]),
+]
+
+
+def _migracion_5_busqueda_fts(cur):
+    for fts, tabla, columnas in _TABLAS_FTS:
+        lista = ", ".join(columnas)
+        nuevos = ", ".join(f"new.{c}" for c in columnas)
+        viejos = ", ".join(f"old.{c}" for c in columnas)
+        cur.execute(f"""
+            CREATE VIRTUAL TABLE {fts} USING fts5(
+                {lista},
+                content='{tabla}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            );
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER {fts}_ai AFTER INSERT ON {tabla} BEGIN
+                INSERT INTO {fts} (rowid, {lista}) VALUES (new.id, {nuevos});
+            END;
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER {fts}_ad AFTER DELETE ON {tabla} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {lista}) VALUES ('delete', old.id, {viejos});
+            END;
+        """)
+        # Solo si cambia alguna columna indexada (p. ej. no al reclasificar urgencias)
+        cur.execute(f"""
+            CREATE TRIGGER {fts}_au AFTER UPDATE OF {lista} ON {tabla} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {lista}) VALUES ('delete', old.id, {viejos});
+                INSERT INTO {fts} (rowid, {lista}) VALUES (new.id, {nuevos});
+            END;
+        """)
+        cur.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild');")
+
+
+# Tablas cuyos cambios invalidan las respuestas de la API (ETag)
+_TABLAS_VERSIONADAS = ["citas", "mascotas", "duenos", "veterinarios"]
+
+
+def _migracion_6_version_datos(cur):
+    # Contador global de cambios: cada INSERT/UPDATE/DELETE en las tablas de
+    # datos lo incrementa. Leerlo es una consulta de una fila, por eso sirve
+    # para responder 304 sin ejecutar las consultas con JOIN.
+    cur.execute("""
+        CREATE TABLE version_datos (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+    """)
+    cur.execute("INSERT INTO version_datos (id, version) VALUES (1, 0);")
+    for tabla in _TABLAS_VERSIONADAS:
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER version_{tabla}_{evento.lower()} AFTER {evento} ON {tabla} BEGIN
+                    UPDATE version_datos SET version = version + 1 WHERE id = 1;
+                END;
+            """)
+
+
+def _migracion_7_trabajos(cur):
+    # Trabajos en segundo plano (ver trabajos.py). No está en
+    # _TABLAS_VERSIONADAS: su progreso no debe invalidar los ETag de la API.
+    cur.execute("""
+        CREATE TABLE trabajos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            parametros TEXT NOT NULL DEFAULT '{}',
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            progreso INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            mensaje TEXT,
+            resultado TEXT,
+            cancelar INTEGER NOT NULL DEFAULT 0,
+            propietario INTEGER,
+            creado TEXT NOT NULL,
+            iniciado TEXT,
+            terminado TEXT
+        );
+    """)
+    cur.execute("CREATE INDEX idx_trabajos_estado ON trabajos (estado, id);")
+
+
+def _migracion_8_recordatorios(cur):
+    # Recordatorios enviados (ver recordatorios.py). La clave incluye la
+    # fecha de la cita: si se reprograma, corresponde un recordatorio nuevo.
+    # Tabla aparte para no tocar citas (ni su contador de versión) al enviar.
+    cur.execute("""
+        CREATE TABLE recordatorios (
+            cita_id INTEGER NOT NULL,
+            fecha_hora TEXT NOT NULL,
+            correo TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            intentos INTEGER NOT NULL DEFAULT 1,
+            error TEXT,
+            actualizado TEXT NOT NULL,
+            PRIMARY KEY (cita_id, fecha_hora),
+            FOREIGN KEY (cita_id) REFERENCES citas(id)
+        ) WITHOUT ROWID;
+    """)
+
+
+# Resúmenes mensuales para /reportes. Los triggers suman o restan 1 en la
+# casilla del mes al insertar, borrar o cambiar una fila, así los reportes
+# leen unas pocas filas por mes sin recorrer citas ni mascotas.
+_RELLENO_REPORTES = [
+    ("resumen_citas_mes", """
+        INSERT INTO resumen_citas_mes (mes, vet_id, tipo_servicio, urgencia, total)
+        SELECT substr(fecha_hora, 1, 7), vet_id, tipo_servicio, COALESCE(urgencia, ''), COUNT(*)
+        FROM citas
+        GROUP BY 1, 2, 3, 4;
+    """),
+    ("resumen_pacientes_mes", """
+        INSERT INTO resumen_pacientes_mes (mes, tipo, total)
+        SELECT COALESCE(substr(fecha_registro, 1, 7), ''), tipo, COUNT(*)
+        FROM mascotas
+        GROUP BY 1, 2;
+    """),
+]
+
+
+def rellenar_reportes(cur) -> None:
+    """Recalcula los resúmenes desde cero (dentro de la transacción del llamador)."""
+    for tabla, sql in _RELLENO_REPORTES:
+        cur.execute(f"DELETE FROM {tabla};")
+        cur.execute(sql)
+
+
+def _migracion_9_reportes(cur):
+    cur.execute("""
+        CREATE TABLE resumen_citas_mes (
+            mes TEXT NOT NULL,
+            vet_id INTEGER NOT NULL,
+            tipo_servicio TEXT NOT NULL,
+            urgencia TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (mes, vet_id, tipo_servicio, urgencia)
+        ) WITHOUT ROWID;
+    """)
+    cur.execute("""
+        CREATE TABLE resumen_pacientes_mes (
+            mes TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (mes, tipo)
+        ) WITHOUT ROWID;
+    """)
+
+    def sumar_cita(fila, delta):
+        return f"""
+            INSERT INTO resumen_citas_mes (mes, vet_id, tipo_servicio, urgencia, total)
+            VALUES (substr({fila}.fecha_hora, 1, 7), {fila}.vet_id, {fila}.tipo_servicio,
+                    COALESCE({fila}.urgencia, ''), {delta})
+            ON CONFLICT (mes, vet_id, tipo_servicio, urgencia)
+            DO UPDATE SET total = total + ({delta});
+        """
+
+    def sumar_paciente(fila, delta):
+        return f"""
+            INSERT INTO resumen_pacientes_mes (mes, tipo, total)
+            VALUES (COALESCE(substr({fila}.fecha_registro, 1, 7), ''), {fila}.tipo, {delta})
+            ON CONFLICT (mes, tipo) DO UPDATE SET total = total + ({delta});
+        """
+
+    cur.execute(f"CREATE TRIGGER reportes_citas_ai AFTER INSERT ON citas BEGIN {sumar_cita('new', 1)} END;")
+    cur.execute(f"CREATE TRIGGER reportes_citas_ad AFTER DELETE ON citas BEGIN {sumar_cita('old', -1)} END;")
+    # Solo cuando cambia una columna agrupada (no al cambiar estado o síntomas)
+    cur.execute(f"""
+        CREATE TRIGGER reportes_citas_au
+        AFTER UPDATE OF fecha_hora, vet_id, tipo_servicio, urgencia ON citas
+        WHEN substr(old.fecha_hora, 1, 7) IS NOT substr(new.fecha_hora, 1, 7)
+          OR old.vet_id IS NOT new.vet_id
+          OR old.tipo_servicio IS NOT new.tipo_servicio
+          OR old.urgencia IS NOT new.urgencia
+        BEGIN {sumar_cita('old', -1)} {sumar_cita('new', 1)} END;
+    """)
+    cur.execute(f"CREATE TRIGGER reportes_mascotas_ai AFTER INSERT ON mascotas BEGIN {sumar_paciente('new', 1)} END;")
+    cur.execute(f"CREATE TRIGGER reportes_mascotas_ad AFTER DELETE ON mascotas BEGIN {sumar_paciente('old', -1)} END;")
+    cur.execute(f"""
+        CREATE TRIGGER reportes_mascotas_au AFTER UPDATE OF fecha_registro, tipo ON mascotas
+        WHEN substr(old.fecha_registro, 1, 7) IS NOT substr(new.fecha_registro, 1, 7)
+          OR old.tipo IS NOT new.tipo
+        BEGIN {sumar_paciente('old', -1)} {sumar_paciente('new', 1)} END;
+    """)
+    rellenar_reportes(cur)
+
+
+def _migracion_10_eventos_citas(cur):
+    # Cambios en la agenda del día que /agenda/eventos envía a las pantallas
+    # de recepción (ver eventos.py). Los escriben los servicios de citas en la
+    # misma transacción que el cambio; se purgan pasados unos días.
+    cur.execute("""
+        CREATE TABLE eventos_citas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dia TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            cita_id INTEGER,
+            datos TEXT,
+            creado TEXT NOT NULL
+        );
+    """)
+    cur.execute("CREATE INDEX idx_eventos_citas_dia ON eventos_citas (dia, id);")
+
+
+def _migracion_11_historial_paciente(cur):
+    # Historial de un paciente (/paciente/<id>): la página recorre el índice
+    # de la mascota de la cita más nueva hacia atrás, y los conteos por
+    # urgencia y servicio se resuelven solo con el índice. Reemplaza a
+    # idx_citas_mascota, que es su prefijo (JOINs y claves foráneas).
+    cur.execute("DROP INDEX IF EXISTS idx_citas_mascota;")
+    cur.execute("""
+        CREATE INDEX idx_citas_mascota_fecha
+        ON citas (mascota_id, fecha_hora, urgencia, tipo_servicio);
+    """)
+
+
+MIGRACIONES = [
+    _migracion_1_esquema_base,
+    _migracion_2_indices,
+    _migracion_3_indice_urgencia,
+    _migracion_4_duracion_citas,
+    _migracion_5_busqueda_fts,
+    _migracion_6_version_datos,
+    _migracion_7_trabajos,
+    _migracion_8_recordatorios,
+    _migracion_9_reportes,
+    _migracion_10_eventos_citas,
+    _migracion_11_historial_paciente,
+]
+
+VERSION_ESQUEMA = len(MIGRACIONES)
+
+
+def version_esquema(conn) -> int:
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def migrar(conn) -> int:
+    """
+    Aplica en orden las migraciones pendientes, cada una en su propia
+    transacción junto con el nuevo user_version. Devuelve la versión final.
+    """
+    actual = version_esquema(conn)
+    for numero, migracion in enumerate(MIGRACIONES, start=1):
+        if numero <= actual:
+            continue
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE;")
+        try:
+            # Otro proceso pudo migrar mientras esperábamos el bloqueo
+            actual = version_esquema(conn)
+            if numero <= actual:
+                conn.commit()
+                continue
+            print(f" Aplicando migración {numero}: {migracion.__name__}...")
+            migracion(cur)
+            cur.execute(f"PRAGMA user_version = {numero};")
             conn.commit()
-            print(" Columna 'fecha_registro' agregada.")
-    except Exception as e:
-        print(f"Nota sobre migración: {e}")
-    # -------------------------------------
+        except Exception:
+            conn.rollback()
+            raise
+        actual = numero
+    return actual
 
-    conn.close()
+
+# Las tareas de arranque usan una conexión propia que cierran al terminar:
+# así ningún proceso hereda una conexión abierta al crear workers con fork.
+
+def init_db():
+    conn = abrir_conexion()
+    try:
+        migrar(conn)
+        conn.execute("PRAGMA optimize;")
+    finally:
+        conn.close()
+
+
+def esquema_al_dia() -> bool:
+    """Chequeo barato para el arranque: un PRAGMA, sin tocar ninguna tabla."""
+    conn = abrir_conexion()
+    try:
+        return version_esquema(conn) >= VERSION_ESQUEMA
+    finally:
+        conn.close()
+
+
+def preparar_bd() -> bool:
+    """
+    Se llama al arrancar cada proceso. Si el esquema ya está en la última
+    versión no hace nada más; si no (BD nueva o desactualizada), migra y crea
+    los datos iniciales. Devuelve True si tuvo que hacer algo.
+    """
+    if esquema_al_dia():
+        return False
+    init_db()
+    seed_veterinarios()
+    seed_admin()
+    return True
+
+
+def crear_clinica(nombre: str) -> str:
+    """Crea la base de una clínica nueva, migrada y con los datos iniciales."""
+    ruta = ruta_bd(nombre, crear=True)
+    if os.path.exists(ruta):
+        raise ValueError(f"La clínica '{nombre}' ya existe.")
+    os.makedirs(CARPETA_CLINICAS, exist_ok=True)
+    sqlite3.connect(ruta).close()
+    with usar_clinica(nombre):
+        preparar_bd()
+    return ruta
+
+
+def migrar_clinicas() -> dict:
+    """Aplica las migraciones pendientes en cada clínica del nodo: {clínica: versión}."""
+    versiones = {}
+    for nombre in listar_clinicas():
+        with usar_clinica(nombre):
+            init_db()
+            conn = abrir_conexion()
+            try:
+                versiones[nombre] = version_esquema(conn)
+            finally:
+                conn.close()
+    return versiones
 
 
 def seed_veterinarios():
-    conn = get_connection()
+    conn = abrir_conexion()
     cur = conn.cursor()
 
     cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='veterinarios';")
@@ -117,7 +783,7 @@ def seed_veterinarios():
 
 # --- NUEVA FUNCIÓN: Crear Admin por defecto ---
 def seed_admin():
-    conn = get_connection()
+    conn = abrir_conexion()
     cur = conn.cursor()
     
     # Verificar si ya existe algún usuario
@@ -127,7 +793,7 @@ def seed_admin():
     if c == 0:
         print(" Creando usuario administrador por defecto...")
         # Creamos usuario 'admin' con contraseña 'admin123' (encriptada)
-        password_hash = generate_password_hash("admin123")
+        password_hash = generar_hash("admin123")
         cur.execute(
             "INSERT INTO usuarios (username, password, rol) VALUES (?, ?, ?);",
             ("admin", password_hash, "admin")
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List
+
+from db import get_connection
+
+# Cambios en las citas de hoy para las pantallas de la agenda, por
+# Server-Sent Events. Los servicios de citas guardan cada cambio en
+# eventos_citas dentro de su transacción y, tras el commit, avisan a los
+# streams de este proceso; los de otros procesos lo ven en su próximo
+# sondeo, que es una búsqueda en el índice (dia, id).
+#
+# Tipos: creada, actualizada, eliminada (datos = fila de la agenda o {id})
+# y recargar (cambió la agenda entera, p. ej. al reclasificar urgencias).
+
+# Cada cuánto mira la tabla un stream al que nadie de su proceso avisó
+INTERVALO_SONDEO = 1.0
+# Comentario vacío para que los proxies no corten una conexión sin tráfico
+INTERVALO_LATIDO = 15.0
+# Cada stream ocupa un hilo: se cierra a este tiempo y el navegador se
+# vuelve a conectar solo, retomando desde Last-Event-ID
+DURACION_MAX_STREAM = 30 * 60
+REINTENTO_MS = 3000
+
+MAX_EVENTOS_POR_LECTURA = 200
+DIAS_RETENCION = 2
+PURGAR_CADA = 500
+
+_aviso = threading.Condition()
+_secuencia = 0
+
+
+# --------- Registro (desde los servicios) ---------
+
+def registrar_evento(cur, tipo: str, cita_id: int | None, dia: str, datos: Dict | None = None) -> None:
+    """
+    Guarda el evento dentro de la transacción del llamador. Solo interesan
+    los cambios de hoy: los de otros días se ignoran. Tras el commit hay que
+    llamar a notificar().
+    """
+    hoy = date.today()
+    if dia != hoy.isoformat():
+        return
+    cur.execute(
+        "INSERT INTO eventos_citas (dia, tipo, cita_id, datos, creado) VALUES (?, ?, ?, ?, ?);",
+        (dia, tipo, cita_id, json.dumps(datos, ensure_ascii=False) if datos else None,
+         datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+    if cur.lastrowid % PURGAR_CADA == 0:
+        limite = (hoy - timedelta(days=DIAS_RETENCION)).isoformat()
+        cur.execute("DELETE FROM eventos_citas WHERE dia < ?;", (limite,))
+
+
+def notificar() -> None:
+    """Despierta a los streams de este proceso."""
+    global _secuencia
+    with _aviso:
+        _secuencia += 1
+        _aviso.notify_all()
+
+
+# --------- Lectura ---------
+
+def ultimo_evento(dia: date | None = None) -> int:
+    """Id del último evento del día; una página renderizada parte de aquí."""
+    dia = (dia or date.today()).isoformat()
+    fila = get_connection().execute(
+        "SELECT MAX(id) FROM eventos_citas WHERE dia = ?;", (dia,)
+    ).fetchone()
+    return fila[0] or 0
+
+
+def leer_eventos(dia: str, desde_id: int) -> List[tuple]:
+    """(id, tipo, datos en JSON) posteriores a desde_id, en orden."""
+    filas = get_connection().execute(
+        """SELECT id, tipo, COALESCE(datos, '{}') FROM eventos_citas
+           WHERE dia = ? AND id > ?
+           ORDER BY id
+           LIMIT ?;""",
+        (dia, desde_id, MAX_EVENTOS_POR_LECTURA)
+    ).fetchall()
+    return [tuple(f) for f in filas]
+
+
+def stream_agenda(desde_id: int) -> Iterator[str]:
+    """Eventos de hoy en formato text/event-stream, a partir de desde_id."""
+    dia = date.today().isoformat()
+    ultimo = desde_id
+    inicio = latido = time.monotonic()
+    yield f"retry: {REINTENTO_MS}\n\n"
+
+    while time.monotonic() - inicio < DURACION_MAX_STREAM:
+        if date.today().isoformat() != dia:
+            # Cambió el día: la pantalla debe cargar la agenda nueva
+            yield "event: recargar\ndata: {}\n\n"
+            return
+
+        visto = _secuencia
+        eventos = leer_eventos(dia, ultimo)
+        for evento_id, tipo, datos in eventos:
+            ultimo = evento_id
+            yield f"id: {evento_id}\nevent: {tipo}\ndata: {datos}\n\n"
+        if eventos:
+            latido = time.monotonic()
+            if len(eventos) == MAX_EVENTOS_POR_LECTURA:
+                continue
+        elif time.monotonic() - latido >= INTERVALO_LATIDO:
+            latido = time.monotonic()
+            yield ": latido\n\n"
+
+        with _aviso:
+            _aviso.wait_for(lambda: _secuencia != visto, timeout=INTERVALO_SONDEO)
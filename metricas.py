@@ -0,0 +1,174 @@
+import hmac
+import os
+import threading
+import time
+from typing import Dict, List
+
+from flask import Response, g, request, session
+
+from db import instalar_observador_sql
+
+# Límites (en segundos) de los buckets del histograma de latencia
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# /metrics exige sesión iniciada o, para Prometheus, este token en
+# "Authorization: Bearer <token>"
+TOKEN_METRICAS = os.environ.get("VETIFY_METRICS_TOKEN") or None
+
+# Sentencias que se guardan por petición para el log de peticiones lentas
+MAX_SQL_POR_PETICION = 200
+SQL_EN_LOG = 5
+
+
+class _Estadistica:
+    """Acumulado de un endpoint: histograma de latencia y totales de SQL."""
+    __slots__ = ("buckets", "cuenta", "segundos", "consultas", "segundos_sql")
+
+    def __init__(self):
+        self.buckets = [0] * len(LIMITES_LATENCIA)
+        self.cuenta = 0
+        self.segundos = 0.0
+        self.consultas = 0
+        self.segundos_sql = 0.0
+
+
+# Las métricas son del proceso: con varios workers cada uno expone las suyas
+# y Prometheus las suma por instancia.
+_estadisticas: Dict[str, _Estadistica] = {}
+_lock = threading.Lock()
+_peticion = threading.local()
+
+
+def _observar_sql(sql: str, segundos: float) -> None:
+    # Fuera de una petición (CLI, streaming ya terminado) no hay dónde sumar
+    actual = getattr(_peticion, "actual", None)
+    if actual is None:
+        return
+    actual["consultas"] += 1
+    actual["segundos_sql"] += segundos
+    if len(actual["sql"]) < MAX_SQL_POR_PETICION:
+        actual["sql"].append((segundos, sql))
+
+
+def _registrar(endpoint: str, segundos: float, consultas: int, segundos_sql: float) -> None:
+    with _lock:
+        est = _estadisticas.get(endpoint)
+        if est is None:
+            est = _estadisticas[endpoint] = _Estadistica()
+        for i, limite in enumerate(LIMITES_LATENCIA):
+            if segundos <= limite:
+                est.buckets[i] += 1
+                break
+        est.cuenta += 1
+        est.segundos += segundos
+        est.consultas += consultas
+        est.segundos_sql += segundos_sql
+
+
+def _etiqueta(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def exportar_prometheus() -> str:
+    """Métricas en el formato de texto de Prometheus."""
+    with _lock:
+        copia = {
+            ep: (list(e.buckets), e.cuenta, e.segundos, e.consultas, e.segundos_sql)
+            for ep, e in _estadisticas.items()
+        }
+
+    lineas: List[str] = [
+        "# HELP vetify_request_duration_seconds Tiempo de respuesta por endpoint.",
+        "# TYPE vetify_request_duration_seconds histogram",
+    ]
+    for ep, (buckets, cuenta, segundos, _, _) in sorted(copia.items()):
+        etq = _etiqueta(ep)
+        acumulado = 0
+        for limite, n in zip(LIMITES_LATENCIA, buckets):
+            acumulado += n
+            lineas.append(f'vetify_request_duration_seconds_bucket{{endpoint="{etq}",le="{limite}"}} {acumulado}')
+        lineas.append(f'vetify_request_duration_seconds_bucket{{endpoint="{etq}",le="+Inf"}} {cuenta}')
+        lineas.append(f'vetify_request_duration_seconds_sum{{endpoint="{etq}"}} {segundos:.6f}')
+        lineas.append(f'vetify_request_duration_seconds_count{{endpoint="{etq}"}} {cuenta}')
+
+    lineas += [
+        "# HELP vetify_sql_queries_total Sentencias SQL ejecutadas por endpoint.",
+        "# TYPE vetify_sql_queries_total counter",
+    ]
+    for ep, (_, _, _, consultas, _) in sorted(copia.items()):
+        lineas.append(f'vetify_sql_queries_total{{endpoint="{_etiqueta(ep)}"}} {consultas}')
+
+    lineas += [
+        "# HELP vetify_sql_seconds_total Tiempo en SQL por endpoint.",
+        "# TYPE vetify_sql_seconds_total counter",
+    ]
+    for ep, (_, _, _, _, segundos_sql) in sorted(copia.items()):
+        lineas.append(f'vetify_sql_seconds_total{{endpoint="{_etiqueta(ep)}"}} {segundos_sql:.6f}')
+
+    return "\n".join(lineas) + "\n"
+
+
+def registrar_metricas(app) -> None:
+    """
+    Mide cada petición (latencia, sentencias SQL y tiempo en SQL por
+    endpoint) y publica /metrics. Si VETIFY_SLOW_MS está definido, las
+    peticiones que lo superan se registran en el log con sus SQL más lentas.
+    En las respuestas en streaming se mide hasta enviar las cabeceras; las
+    peticiones que terminan en una excepción se miden al cerrarse.
+    """
+    lento_ms = os.environ.get("VETIFY_SLOW_MS")
+    umbral_lento = float(lento_ms) / 1000 if lento_ms else None
+
+    instalar_observador_sql(_observar_sql)
+
+    @app.before_request
+    def _inicio_peticion():
+        _peticion.actual = {"consultas": 0, "segundos_sql": 0.0, "sql": []}
+        g.inicio_peticion = time.perf_counter()
+
+    def _medir():
+        actual = getattr(_peticion, "actual", None)
+        inicio = g.pop("inicio_peticion", None)
+        _peticion.actual = None
+        if actual is None or inicio is None:
+            return
+
+        segundos = time.perf_counter() - inicio
+        endpoint = request.endpoint or "sin_ruta"
+        _registrar(endpoint, segundos, actual["consultas"], actual["segundos_sql"])
+
+        if umbral_lento is not None and segundos >= umbral_lento:
+            peores = sorted(actual["sql"], reverse=True)[:SQL_EN_LOG]
+            detalle = "".join(
+                f"\n    {s * 1000:7.1f} ms  {' '.join(sql.split())}" for s, sql in peores
+            )
+            app.logger.warning(
+                "Petición lenta: %s %s (%s) %.0f ms, %d consultas, %.0f ms en SQL%s",
+                request.method, request.full_path.rstrip("?"), endpoint, segundos * 1000,
+                actual["consultas"], actual["segundos_sql"] * 1000, detalle,
+            )
+
+    @app.after_request
+    def _fin_peticion(respuesta):
+        _medir()
+        return respuesta
+
+    @app.teardown_request
+    def _cierre_peticion(exception):
+        # Solo queda algo por medir si after_request no llegó a correr
+        # (la vista o un hook lanzó una excepción)
+        _medir()
+
+    @app.route("/metrics")
+    def metrics():
+        if not _autorizado_metricas():
+            return Response("No autorizado.\n", 401, {"WWW-Authenticate": "Bearer"}, mimetype="text/plain")
+        return Response(exportar_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+def _autorizado_metricas() -> bool:
+    if TOKEN_METRICAS:
+        esquema, _, token = (request.headers.get("Authorization") or "").partition(" ")
+        if esquema.lower() == "bearer" and hmac.compare_digest(token.strip(), TOKEN_METRICAS):
+            return True
+    return "user_id" in session
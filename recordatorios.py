@@ -0,0 +1,287 @@
+import asyncio
+import os
+import smtplib
+import time
+from datetime import date, datetime, timedelta
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import parseaddr
+from typing import Dict, List, NamedTuple, Tuple
+
+from db import clinica_actual, get_connection, transaccion, usar_clinica
+
+# aiosmtplib es opcional: sin él cada conexión SMTP usa smtplib en un hilo
+# (asyncio.to_thread), con el mismo límite de conexiones simultáneas.
+try:
+    import aiosmtplib
+except ImportError:  # pragma: no cover - depende del entorno
+    aiosmtplib = None
+
+
+# Configuración SMTP por variables de entorno. Para probar en local:
+#   python -m aiosmtpd -n -l localhost:8025
+#   VETIFY_SMTP_PUERTO=8025 flask --app app enviar-recordatorios
+SMTP_HOST = os.environ.get("VETIFY_SMTP_HOST", "localhost")
+SMTP_PUERTO = int(os.environ.get("VETIFY_SMTP_PUERTO", "25"))
+SMTP_USUARIO = os.environ.get("VETIFY_SMTP_USUARIO") or None
+SMTP_CLAVE = os.environ.get("VETIFY_SMTP_CLAVE") or None
+SMTP_STARTTLS = os.environ.get("VETIFY_SMTP_STARTTLS") == "1"
+REMITENTE = os.environ.get("VETIFY_REMITENTE", "Vetify <no-responder@vetify.local>")
+
+# Dirección del sobre SMTP (sin el nombre visible)
+_REMITENTE_SOBRE = parseaddr(REMITENTE)[1]
+
+# Conexiones SMTP abiertas a la vez; cada una envía varios mensajes seguidos
+CONEXIONES_SMTP = 5
+TIMEOUT_SMTP = 30
+MAX_FALLOS_CONEXION = 3
+
+# Resultados que se acumulan antes de guardarlos en la tabla
+LOTE_REGISTRO = 100
+
+ASUNTO = "Recordatorio: cita de {mascota} el {fecha}"
+PLANTILLA = """Hola {dueno}:
+
+Te recordamos la cita de {mascota} en Vetify:
+
+    Servicio:     {servicio}
+    Fecha:        {fecha}
+    Hora:         {hora}
+    Profesional:  {vet}
+
+Si no puedes asistir, llámanos para reprogramarla.
+
+Vetify
+"""
+
+
+class Recordatorio(NamedTuple):
+    cita_id: int
+    fecha_hora: str
+    correo: str
+    mensaje: bytes
+
+
+# --------- Selección y armado ---------
+
+def citas_para_recordar(dia: date) -> List:
+    """
+    Citas pendientes del día con su responsable, salvo las que ya tienen un
+    recordatorio enviado para esa misma fecha y hora. Una sola consulta por
+    rango sobre idx_citas_fecha.
+    """
+    inicio = dia.isoformat()
+    fin = (dia + timedelta(days=1)).isoformat()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.id, c.fecha_hora, c.tipo_servicio,
+               m.nombre AS mascota,
+               d.nombre AS dueno, d.correo,
+               v.nombre AS vet
+        FROM citas c
+        JOIN mascotas m ON c.mascota_id = m.id
+        JOIN duenos d ON m.dueno_id = d.id
+        JOIN veterinarios v ON c.vet_id = v.id
+        WHERE c.fecha_hora >= ? AND c.fecha_hora < ?
+          AND c.estado = 'pendiente'
+          AND NOT EXISTS (
+              SELECT 1 FROM recordatorios r
+              WHERE r.cita_id = c.id AND r.fecha_hora = c.fecha_hora AND r.estado = 'enviado'
+          )
+        ORDER BY c.fecha_hora;
+    """, (inicio, fin))
+    return cur.fetchall()
+
+
+def armar_recordatorios(filas) -> Tuple[List[Recordatorio], int]:
+    """
+    Arma los correos ya serializados; devuelve (recordatorios, filas sin
+    correo válido). MIMEText con la política compat32 es varias veces más
+    rápido que EmailMessage, que volvía a analizar cada cabecera.
+    """
+    recordatorios = []
+    sin_correo = 0
+    for f in filas:
+        correo = (f["correo"] or "").strip()
+        if "@" not in correo:
+            sin_correo += 1
+            continue
+        cuando = datetime.fromisoformat(f["fecha_hora"])
+        datos = {
+            "dueno": f["dueno"],
+            "mascota": f["mascota"],
+            "servicio": f["tipo_servicio"],
+            "vet": f["vet"],
+            "fecha": cuando.strftime("%d/%m/%Y"),
+            "hora": cuando.strftime("%H:%M"),
+        }
+        msg = MIMEText(PLANTILLA.format_map(datos), "plain", "utf-8")
+        msg["From"] = REMITENTE
+        msg["To"] = correo
+        msg["Subject"] = Header(ASUNTO.format_map(datos), "utf-8")
+        recordatorios.append(Recordatorio(f["id"], f["fecha_hora"], correo, msg.as_bytes()))
+    return recordatorios, sin_correo
+
+
+def _registrar(resultados: List[Tuple[int, str, str, str | None]]) -> None:
+    """Guarda (cita_id, fecha_hora, correo, error) en recordatorios."""
+    ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaccion() as conn:
+        conn.executemany(
+            """INSERT INTO recordatorios (cita_id, fecha_hora, correo, estado, error, actualizado)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (cita_id, fecha_hora) DO UPDATE SET
+                   correo = excluded.correo,
+                   estado = excluded.estado,
+                   error = excluded.error,
+                   intentos = intentos + 1,
+                   actualizado = excluded.actualizado;""",
+            [(cita_id, fecha_hora, correo, "error" if error else "enviado", error, ahora)
+             for cita_id, fecha_hora, correo, error in resultados]
+        )
+
+
+def _registrar_en(clinica: str, resultados) -> None:
+    # Corre en un hilo aparte (asyncio.to_thread): la clínica es de cada hilo
+    with usar_clinica(clinica):
+        _registrar(resultados)
+
+
+# --------- Envío ---------
+
+class _SmtpEnHilo:
+    """Misma interfaz que aiosmtplib.SMTP, con smtplib en un hilo aparte."""
+
+    def __init__(self):
+        self.smtp = None
+
+    async def connect(self):
+        def conectar():
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PUERTO, timeout=TIMEOUT_SMTP)
+            if SMTP_STARTTLS:
+                smtp.starttls()
+            if SMTP_USUARIO:
+                smtp.login(SMTP_USUARIO, SMTP_CLAVE or "")
+            return smtp
+        self.smtp = await asyncio.to_thread(conectar)
+
+    async def sendmail(self, remitente, destinatarios, mensaje):
+        await asyncio.to_thread(self.smtp.sendmail, remitente, destinatarios, mensaje)
+
+    async def quit(self):
+        await asyncio.to_thread(self.smtp.quit)
+
+
+async def _conectar():
+    if aiosmtplib is None:
+        cliente = _SmtpEnHilo()
+    else:
+        cliente = aiosmtplib.SMTP(
+            hostname=SMTP_HOST, port=SMTP_PUERTO, timeout=TIMEOUT_SMTP,
+            username=SMTP_USUARIO, password=SMTP_CLAVE,
+            start_tls=SMTP_STARTTLS, use_tls=False,
+        )
+    await cliente.connect()
+    return cliente
+
+
+async def _cerrar(cliente) -> None:
+    try:
+        await cliente.quit()
+    except Exception:
+        pass
+
+
+async def _enviar_todos(recordatorios: List[Recordatorio], conexiones: int) -> Dict[str, int]:
+    """
+    Reparte los mensajes entre `conexiones` tareas, cada una con su propia
+    conexión SMTP que reutiliza mientras queden mensajes. Si una conexión
+    falla se descarta y la siguiente entrega abre otra; tras
+    MAX_FALLOS_CONEXION intentos de conexión fallidos seguidos la tarea se
+    detiene y sus mensajes quedan sin enviar (se retoman en otra corrida).
+    """
+    cola: asyncio.Queue = asyncio.Queue()
+    for r in recordatorios:
+        cola.put_nowait(r)
+    pendientes: List[Tuple[int, str, str, str | None]] = []
+    cuenta = {"enviados": 0, "errores": 0}
+    clinica = clinica_actual()
+
+    async def registrar_pendientes():
+        # La escritura en SQLite va a un hilo para no frenar a las demás
+        # conexiones SMTP mientras espera el bloqueo o el disco
+        lote = pendientes[:]
+        pendientes.clear()
+        await asyncio.to_thread(_registrar_en, clinica, lote)
+
+    async def trabajador():
+        cliente = None
+        fallos_conexion = 0
+        while True:
+            try:
+                r = cola.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if cliente is None:
+                try:
+                    cliente = await _conectar()
+                    fallos_conexion = 0
+                except Exception:
+                    fallos_conexion += 1
+                    cola.put_nowait(r)
+                    if fallos_conexion >= MAX_FALLOS_CONEXION:
+                        break
+                    continue
+            try:
+                await cliente.sendmail(_REMITENTE_SOBRE, [r.correo], r.mensaje)
+                error = None
+            except Exception as e:
+                error = f"{e.__class__.__name__}: {e}"[:500]
+                if cliente is not None:
+                    await _cerrar(cliente)
+                    cliente = None
+            cuenta["errores" if error else "enviados"] += 1
+            pendientes.append((r.cita_id, r.fecha_hora, r.correo, error))
+            # El bucle de eventos es de un solo hilo: nadie más toca la lista
+            if len(pendientes) >= LOTE_REGISTRO:
+                await registrar_pendientes()
+        if cliente is not None:
+            await _cerrar(cliente)
+
+    try:
+        await asyncio.gather(*(trabajador() for _ in range(max(1, min(conexiones, len(recordatorios))))))
+    finally:
+        # También si se interrumpe: lo ya enviado queda registrado
+        if pendientes:
+            await registrar_pendientes()
+    cuenta["sin_enviar"] = cola.qsize()
+    return cuenta
+
+
+def enviar_recordatorios(
+    dia: date | None = None,
+    conexiones: int = CONEXIONES_SMTP,
+    simular: bool = False
+) -> Dict:
+    """
+    Envía el recordatorio de cada cita pendiente de `dia` (por defecto,
+    mañana). Se puede repetir sin duplicar: las citas con recordatorio
+    enviado se excluyen, y las que fallaron o quedaron sin enviar (servidor
+    SMTP caído) se reintentan.
+    Con simular=True solo arma los mensajes, sin enviar ni registrar nada.
+    """
+    inicio = time.perf_counter()
+    dia = dia or date.today() + timedelta(days=1)
+    recordatorios, sin_correo = armar_recordatorios(citas_para_recordar(dia))
+
+    cuenta = {"enviados": 0, "errores": 0, "sin_enviar": 0}
+    if recordatorios and not simular:
+        cuenta = asyncio.run(_enviar_todos(recordatorios, conexiones))
+    return {
+        "dia": dia.isoformat(),
+        "a_enviar": len(recordatorios),
+        "sin_correo": sin_correo,
+        **cuenta,
+        "segundos": time.perf_counter() - inicio,
+    }
@@ -1,30 +1,41 @@
-from datetime import datetime
-from typing import Dict
-from db import get_connection
+import csv
+import io
+import json
+import re
+import threading
+import time
+from datetime import date, datetime, time as hora, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Sequence, TextIO, Tuple
+from claves import generar_hash
+from db import al_confirmar, abrir_conexion, clinica_actual, get_connection, rellenar_reportes, transaccion
+from eventos import notificar as notificar_eventos, registrar_evento
 
 
-# --------- Dueños ---------
+def _fin_inclusivo(hasta: date) -> str:
+    """Cota exclusiva para incluir el día `hasta` completo (fecha_hora < ...)."""
+    return (hasta + timedelta(days=1)).isoformat()
 
-def crear_dueno(nombre: str, telefono: str, correo: str) -> int:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO duenos (nombre, telefono, correo) VALUES (?, ?, ?);",
-        (nombre, telefono, correo)
-    )
-    conn.commit()
-    dueno_id = cur.lastrowid
-    conn.close()
-    return dueno_id
+
+def _rango_dia(dia: date) -> Tuple[str, str]:
+    """
+    Límites [inicio, fin) de un día como texto ISO. Comparar fecha_hora contra
+    un rango permite usar los índices, cosa que date(fecha_hora) = ? impide.
+    """
+    return dia.isoformat(), (dia + timedelta(days=1)).isoformat()
 
 
-def contar_duenos() -> int:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM duenos;")
-    c = cur.fetchone()["c"]
-    conn.close()
-    return int(c or 0)
+# --------- Dueños ---------
+
+def crear_dueno(nombre: str, telefono: str, correo: str) -> int:
+    with transaccion() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO duenos (nombre, telefono, correo) VALUES (?, ?, ?);",
+            (nombre, telefono, correo)
+        )
+        al_confirmar(invalidar_resumen)
+        al_confirmar(invalidar_referencias)
+    return cur.lastrowid
 
 
 # --------- Mascotas ---------
@@ -37,22 +48,20 @@ def crear_mascota(
     peso: float,
     dueno_id: int
 ) -> int:
-    conn = get_connection()
-    cur = conn.cursor()
-    
     # MODIFICADO: Calculamos la fecha en Python y la enviamos explícitamente
     # Esto asegura que se guarde la fecha aunque la BD no tenga el DEFAULT configurado tras la migración.
     fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    cur.execute(
-        """INSERT INTO mascotas (nombre, tipo, raza, edad, peso, dueno_id, fecha_registro)
-           VALUES (?, ?, ?, ?, ?, ?, ?);""",
-        (nombre, tipo, raza, edad, peso, dueno_id, fecha_actual)
-    )
-    conn.commit()
-    mascota_id = cur.lastrowid
-    conn.close()
-    return mascota_id
+
+    with transaccion() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """INSERT INTO mascotas (nombre, tipo, raza, edad, peso, dueno_id, fecha_registro)
+               VALUES (?, ?, ?, ?, ?, ?, ?);""",
+            (nombre, tipo, raza, edad, peso, dueno_id, fecha_actual)
+        )
+        al_confirmar(invalidar_resumen)
+        al_confirmar(invalidar_referencias)
+    return cur.lastrowid
 
 
 def listar_mascotas():
@@ -65,7 +74,6 @@ def listar_mascotas():
         ORDER BY m.nombre;
     """)
     filas = cur.fetchall()
-    conn.close()
     return filas
 
 
@@ -92,17 +100,266 @@ def listar_pacientes_detalle():
         ORDER BY m.nombre;
     """)
     filas = cur.fetchall()
-    conn.close()
     return filas
 
 
-def contar_mascotas() -> int:
+def obtener_paciente(mascota_id: int):
+    """La mascota con los datos de su responsable, o None."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT m.id,
+               m.nombre,
+               m.tipo,
+               m.raza,
+               m.edad,
+               m.peso,
+               m.fecha_registro,
+               d.id       AS dueno_id,
+               d.nombre   AS dueno,
+               d.telefono AS dueno_telefono,
+               d.correo   AS dueno_correo
+        FROM mascotas m
+        JOIN duenos d ON m.dueno_id = d.id
+        WHERE m.id = ?;
+    """, (mascota_id,))
+    return cur.fetchone()
+
+
+def historial_paciente(
+    mascota_id: int,
+    cursor: Tuple[str, int] | None = None,
+    limite: int = 20
+):
+    """
+    Citas de la mascota de la más nueva a la más antigua, por páginas con
+    cursor (fecha_hora, id) como listar_citas_ventana pero hacia atrás.
+    Recorre idx_citas_mascota_fecha: cada página lee solo sus filas, aunque
+    el paciente tenga cientos de visitas.
+    Devuelve hasta `limite` + 1 filas; la fila extra indica que hay más.
+    """
+    condiciones = ["c.mascota_id = ?"]
+    params: list = [mascota_id]
+    if cursor is not None:
+        condiciones.append("(c.fecha_hora, c.id) < (?, ?)")
+        params.extend(cursor)
+    params.append(limite + 1)
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT c.id,
+               c.fecha_hora,
+               c.tipo_servicio,
+               c.urgencia,
+               c.sintomas,
+               c.estado,
+               v.nombre AS vet
+        FROM citas c
+        JOIN veterinarios v ON c.vet_id = v.id
+        WHERE {" AND ".join(condiciones)}
+        ORDER BY c.fecha_hora DESC, c.id DESC
+        LIMIT ?;
+    """, params)
+    return cur.fetchall()
+
+
+def resumen_paciente(mascota_id: int) -> Dict:
+    """
+    Totales del historial: citas por urgencia y por servicio, última visita
+    y próxima cita. Una sola consulta que solo lee idx_citas_mascota_fecha.
+    """
+    ahora = datetime.now().isoformat(timespec="seconds")
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM mascotas;")
-    c = cur.fetchone()["c"]
-    conn.close()
-    return int(c or 0)
+    cur.execute("""
+        SELECT COALESCE(urgencia, '') AS urgencia,
+               tipo_servicio,
+               COUNT(*) AS c,
+               MAX(CASE WHEN fecha_hora < ? THEN fecha_hora END) AS ultima,
+               MIN(CASE WHEN fecha_hora >= ? THEN fecha_hora END) AS proxima
+        FROM citas
+        WHERE mascota_id = ?
+        GROUP BY 1, 2;
+    """, (ahora, ahora, mascota_id))
+
+    resumen = {
+        "total": 0,
+        "por_urgencia": {u: 0 for u in ("alta", "media", "baja")},
+        "por_servicio": {},
+        "ultima_visita": None,
+        "proxima_cita": None,
+    }
+    for f in cur.fetchall():
+        resumen["total"] += f["c"]
+        if f["urgencia"] in resumen["por_urgencia"]:
+            resumen["por_urgencia"][f["urgencia"]] += f["c"]
+        servicios = resumen["por_servicio"]
+        servicios[f["tipo_servicio"]] = servicios.get(f["tipo_servicio"], 0) + f["c"]
+        if f["ultima"] and (resumen["ultima_visita"] or "") < f["ultima"]:
+            resumen["ultima_visita"] = f["ultima"]
+        if f["proxima"] and (resumen["proxima_cita"] is None or f["proxima"] < resumen["proxima_cita"]):
+            resumen["proxima_cita"] = f["proxima"]
+    resumen["por_servicio"] = dict(sorted(resumen["por_servicio"].items(), key=lambda kv: -kv[1]))
+    return resumen
+
+
+def proxima_cita_paciente(mascota_id: int) -> str | None:
+    """
+    Fecha y hora de la próxima cita del paciente. Es el momento en que
+    resumen_paciente cambia sin que cambien los datos (la cita pasa a ser
+    la última visita).
+    """
+    ahora = datetime.now().isoformat(timespec="seconds")
+    conn = get_connection()
+    fila = conn.execute(
+        "SELECT MIN(fecha_hora) FROM citas WHERE mascota_id = ? AND fecha_hora >= ?;",
+        (mascota_id, ahora)
+    ).fetchone()
+    return fila[0]
+
+
+# --------- Registro e importación de pacientes ---------
+
+# Campos del formulario /register; también son las columnas del CSV de importación
+CAMPOS_PACIENTE = [
+    "owner_name", "owner_phone", "owner_email",
+    "pet_name", "pet_type", "pet_breed", "pet_age", "pet_weight",
+]
+
+
+def validar_paciente(datos: Mapping[str, str]):
+    """
+    Valida y limpia los datos de un responsable y su mascota, con las mismas
+    reglas que el formulario de registro.
+    Devuelve (dueno, mascota) como tuplas listas para insertar:
+    (nombre, telefono, correo) y (nombre, tipo, raza, edad, peso).
+    Lanza ValueError con el mensaje para el usuario si algo no es válido.
+    """
+    def campo(nombre):
+        return (datos.get(nombre) or "").strip()
+
+    owner_name = campo("owner_name")
+    owner_phone = campo("owner_phone")
+    owner_email = campo("owner_email")
+    pet_name = campo("pet_name")
+    pet_type = campo("pet_type") or "Otro"
+    pet_breed = campo("pet_breed")
+
+    if not owner_name or not owner_phone or not owner_email or not pet_name:
+        raise ValueError("Por favor completa todos los campos obligatorios.")
+
+    try:
+        pet_age = int(campo("pet_age") or "0")
+        pet_weight = float(campo("pet_weight") or "0")
+    except ValueError:
+        raise ValueError("Revisa la edad y el peso de la mascota.")
+
+    return (owner_name, owner_phone, owner_email), (pet_name, pet_type, pet_breed, pet_age, pet_weight)
+
+
+def _siguiente_id(cur, tabla: str) -> int:
+    # Con AUTOINCREMENT el próximo id sale de sqlite_sequence; al insertar ids
+    # explícitos mayores, SQLite la actualiza solo.
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = ?;", (tabla,))
+    fila = cur.fetchone()
+    cur.execute(f"SELECT MAX(id) FROM {tabla};")
+    maximo = cur.fetchone()[0]
+    return max(fila[0] if fila else 0, maximo or 0) + 1
+
+
+def _insertar_pacientes(filas, ids_duenos: Dict[tuple, int]) -> int:
+    """
+    Inserta un bloque de (dueno, mascota) en una sola transacción. Los ids se
+    reservan con el bloqueo de escritura tomado (BEGIN IMMEDIATE de
+    transaccion) para poder usar executemany en ambas tablas.
+    `ids_duenos` son los responsables ya creados por la importación
+    (dueno -> id): uno repetido, en este bloque o en uno anterior, se crea
+    una sola vez. Los de este bloque se agregan al confirmarlo.
+    Devuelve la cantidad de responsables creados.
+    """
+    nuevos: Dict[tuple, int] = {}
+    with transaccion() as conn:
+        cur = conn.cursor()
+        proximo_dueno = _siguiente_id(cur, "duenos")
+        duenos = []
+        mascotas = []
+        fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for dueno, mascota in filas:
+            dueno_id = ids_duenos.get(dueno) or nuevos.get(dueno)
+            if dueno_id is None:
+                dueno_id = nuevos[dueno] = proximo_dueno
+                proximo_dueno += 1
+                duenos.append((dueno_id, *dueno))
+            mascotas.append((*mascota, dueno_id, fecha_actual))
+
+        cur.executemany(
+            "INSERT INTO duenos (id, nombre, telefono, correo) VALUES (?, ?, ?, ?);",
+            duenos
+        )
+        cur.executemany(
+            """INSERT INTO mascotas (nombre, tipo, raza, edad, peso, dueno_id, fecha_registro)
+               VALUES (?, ?, ?, ?, ?, ?, ?);""",
+            mascotas
+        )
+        al_confirmar(invalidar_resumen)
+        al_confirmar(invalidar_referencias)
+    ids_duenos.update(nuevos)
+    return len(duenos)
+
+
+def importar_pacientes_csv(
+    archivo: TextIO,
+    lote: int = 5000,
+    progreso: Callable[[int, int], None] | None = None
+) -> Dict:
+    """
+    Importa responsables y mascotas desde un CSV con las columnas de
+    CAMPOS_PACIENTE (cabecera obligatoria). El archivo se lee fila a fila y se
+    inserta por bloques de `lote` pacientes, cada uno en una transacción.
+
+    Las filas inválidas no detienen la importación: se devuelven en
+    "rechazados" como (número de línea, motivo).
+    `progreso(importados, rechazados)` se llama tras cada bloque.
+    """
+    inicio = time.perf_counter()
+    lector = csv.DictReader(archivo)
+    faltan = [c for c in ("owner_name", "owner_phone", "owner_email", "pet_name")
+              if c not in (lector.fieldnames or [])]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltan)}.")
+
+    importados = duenos_creados = 0
+    rechazados: List[Tuple[int, str]] = []
+    pendientes = []
+    # Responsables creados en toda la importación: el resultado no depende de `lote`
+    ids_duenos: Dict[tuple, int] = {}
+
+    def volcar():
+        nonlocal importados, duenos_creados
+        duenos_creados += _insertar_pacientes(pendientes, ids_duenos)
+        importados += len(pendientes)
+        pendientes.clear()
+        if progreso:
+            progreso(importados, len(rechazados))
+
+    for fila in lector:
+        try:
+            pendientes.append(validar_paciente(fila))
+        except ValueError as e:
+            rechazados.append((lector.line_num, str(e)))
+            continue
+        if len(pendientes) >= lote:
+            volcar()
+    if pendientes:
+        volcar()
+
+    return {
+        "importados": importados,
+        "duenos": duenos_creados,
+        "rechazados": rechazados,
+        "segundos": time.perf_counter() - inicio,
+    }
 
 
 # --------- Veterinarios ---------
@@ -116,12 +373,150 @@ def listar_veterinarios():
         ORDER BY nombre;
     """)
     filas = cur.fetchall()
-    conn.close()
     return filas
 
 
+# --------- Datos de referencia de los formularios de citas ---------
+# Las listas de mascotas y veterinarios de los selectores cambian muy poco y
+# se comparten entre hilos. Las escrituras de este proceso las invalidan con
+# un contador de generación; las altas hechas por otros procesos se detectan
+# con el MAX(id) de cada tabla, que se resuelve con una búsqueda en el índice.
+# (La aplicación no renombra ni borra mascotas, dueños ni veterinarios.)
+# Con varias clínicas se guarda una entrada por clínica.
+
+_referencias_generacion = 0
+_referencias_lock = threading.Lock()
+_referencias: Dict[str, tuple] = {}    # clínica -> (clave, mascotas, veterinarios)
+
+
+def invalidar_referencias() -> None:
+    global _referencias_generacion
+    with _referencias_lock:
+        _referencias_generacion += 1
+
+
+def datos_formulario_cita() -> Tuple[tuple, tuple]:
+    """
+    (mascotas, veterinarios) para los formularios de nueva cita y edición,
+    con las mismas columnas que listar_mascotas() y listar_veterinarios().
+    """
+    clinica = clinica_actual()
+    conn = get_connection()
+    huella = tuple(conn.execute("""
+        SELECT (SELECT MAX(id) FROM mascotas),
+               (SELECT MAX(id) FROM duenos),
+               (SELECT MAX(id) FROM veterinarios);
+    """).fetchone())
+    clave = (_referencias_generacion, huella)
+
+    entrada = _referencias.get(clinica)
+    if entrada is not None and entrada[0] == clave:
+        return entrada[1], entrada[2]
+
+    mascotas = tuple(listar_mascotas())
+    vets = tuple(listar_veterinarios())
+    # Igual que en el resumen: se guarda con la clave leída antes de consultar
+    _referencias[clinica] = (clave, mascotas, vets)
+    return mascotas, vets
+
+
 # --------- Citas ---------
 
+# Minutos que ocupa cada tipo de servicio; el resto usa DURACION_POR_DEFECTO
+DURACION_SERVICIO = {
+    "Consulta": 30,
+    "Control post-operatorio": 30,
+    "Vacunación": 15,
+    "Desparasitación": 15,
+    "Emergencia": 60,
+    "Urgencia": 60,
+    "Cirugía": 120,
+    "Otro": 30,
+}
+DURACION_POR_DEFECTO = 30
+DURACION_MAXIMA = max(DURACION_SERVICIO.values())
+
+# Horario de atención (inicio, fin) y separación entre horarios ofrecidos
+BLOQUES_ATENCION = [(hora(7, 0), hora(12, 0)), (hora(13, 0), hora(17, 0))]
+PASO_HORARIOS_MIN = 30
+
+
+class HorarioOcupado(Exception):
+    """El profesional ya tiene una cita que se solapa con el horario pedido."""
+
+
+def duracion_servicio(tipo_servicio: str) -> int:
+    return DURACION_SERVICIO.get(tipo_servicio, DURACION_POR_DEFECTO)
+
+
+def _hay_solapamiento(cur, vet_id: int, inicio: datetime, fin: datetime, excluir_id: int | None) -> bool:
+    """
+    Dos citas se solapan si una empieza antes de que termine la otra. Acotar
+    fecha_hora por abajo con la duración máxima deja la condición como un
+    rango sobre idx_citas_vet_fecha (vet_id, fecha_hora, fecha_fin).
+    """
+    cur.execute("""
+        SELECT 1
+        FROM citas
+        WHERE vet_id = ?
+          AND fecha_hora < ?
+          AND fecha_hora > ?
+          AND fecha_fin > ?
+          AND id != ?
+        LIMIT 1;
+    """, (
+        vet_id,
+        fin.isoformat(),
+        (inicio - timedelta(minutes=DURACION_MAXIMA)).isoformat(),
+        inicio.isoformat(),
+        excluir_id or 0,
+    ))
+    return cur.fetchone() is not None
+
+
+# Columnas de la agenda del día; los eventos de /agenda/eventos llevan la
+# misma fila para que la pantalla la pinte sin pedir nada más.
+_SELECT_AGENDA = """
+    SELECT c.id,
+           c.fecha_hora,
+           c.tipo_servicio,
+           c.urgencia,
+           c.sintomas,
+           m.nombre AS mascota,
+           d.nombre AS dueno,
+           v.nombre AS vet
+    FROM citas c
+    JOIN mascotas m ON c.mascota_id = m.id
+    JOIN duenos d   ON m.dueno_id = d.id
+    JOIN veterinarios v ON c.vet_id = v.id
+"""
+
+
+def _registrar_cambio_agenda(cur, cita_id: int, antes=None) -> None:
+    """
+    Eventos de la agenda de hoy por un cambio en la cita, dentro de la
+    transacción del cambio. `antes` es la fila (fecha_hora, urgencia) previa
+    a una edición o borrado. Mover una cita de o hacia otro día cuenta como
+    alta o baja en la agenda de hoy.
+    """
+    hoy = date.today().isoformat()
+    cur.execute(_SELECT_AGENDA + " WHERE c.id = ?;", (cita_id,))
+    despues = cur.fetchone()
+    dia_antes = antes["fecha_hora"][:10] if antes else None
+    dia_despues = despues["fecha_hora"][:10] if despues else None
+
+    if dia_despues == hoy:
+        datos = dict(despues)
+        if dia_antes == hoy:
+            if antes["urgencia"] != despues["urgencia"]:
+                datos["urgencia_anterior"] = antes["urgencia"]
+            registrar_evento(cur, "actualizada", cita_id, hoy, datos)
+        else:
+            registrar_evento(cur, "creada", cita_id, hoy, datos)
+    elif dia_antes == hoy:
+        registrar_evento(cur, "eliminada", cita_id, hoy, {"id": cita_id})
+
+
 def crear_cita(
     mascota_id: int,
     vet_id: int,
@@ -130,22 +525,45 @@ def crear_cita(
     sintomas: str,
     urgencia: str
 ) -> int:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """INSERT INTO citas 
-           (mascota_id, vet_id, fecha_hora, tipo_servicio, sintomas, urgencia, estado)
-           VALUES (?, ?, ?, ?, ?, ?, 'pendiente');""",
-        (mascota_id, vet_id, fecha_hora.isoformat(), tipo_servicio, sintomas, urgencia)
-    )
-    conn.commit()
-    cita_id = cur.lastrowid
-    conn.close()
+    """
+    Crea la cita si el profesional está libre durante toda su duración.
+    La comprobación y el INSERT van en la misma transacción (BEGIN IMMEDIATE),
+    así dos reservas simultáneas no pueden ocupar el mismo horario.
+    Lanza HorarioOcupado si hay solapamiento.
+    """
+    duracion = duracion_servicio(tipo_servicio)
+    fecha_fin = fecha_hora + timedelta(minutes=duracion)
+    with transaccion() as conn:
+        cur = conn.cursor()
+        if _hay_solapamiento(cur, vet_id, fecha_hora, fecha_fin, None):
+            raise HorarioOcupado()
+        cur.execute(
+            """INSERT INTO citas 
+               (mascota_id, vet_id, fecha_hora, tipo_servicio, sintomas, urgencia, estado, duracion_min, fecha_fin)
+               VALUES (?, ?, ?, ?, ?, ?, 'pendiente', ?, ?);""",
+            (mascota_id, vet_id, fecha_hora.isoformat(), tipo_servicio, sintomas, urgencia,
+             duracion, fecha_fin.isoformat())
+        )
+        cita_id = cur.lastrowid
+        _registrar_cambio_agenda(cur, cita_id)
+        al_confirmar(invalidar_resumen)
+        al_confirmar(notificar_eventos)
     return cita_id
 
 
 def listar_citas_hoy():
-    hoy = datetime.now().date().isoformat()
+    inicio, fin = _rango_dia(datetime.now().date())
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(_SELECT_AGENDA + """
+        WHERE c.fecha_hora >= ? AND c.fecha_hora < ?
+        ORDER BY c.fecha_hora;
+    """, (inicio, fin))
+    filas = cur.fetchall()
+    return filas
+
+
+def listar_citas_todas():
     conn = get_connection()
     cur = conn.cursor()
     cur.execute("""
@@ -154,25 +572,53 @@ def listar_citas_hoy():
                c.tipo_servicio,
                c.urgencia,
                c.sintomas,
-               m.nombre AS mascota,
-               d.nombre AS dueno,
-               v.nombre AS vet
+               c.estado,
+               m.nombre      AS mascota,
+               m.tipo        AS tipo_mascota,
+               d.nombre      AS dueno,
+               v.nombre      AS vet,
+               c.mascota_id  AS mascota_id,
+               c.vet_id      AS vet_id
         FROM citas c
         JOIN mascotas m ON c.mascota_id = m.id
         JOIN duenos d   ON m.dueno_id = d.id
         JOIN veterinarios v ON c.vet_id = v.id
-        WHERE date(c.fecha_hora) = ?
         ORDER BY c.fecha_hora;
-    """, (hoy,))
+    """)
     filas = cur.fetchall()
-    conn.close()
     return filas
 
 
-def listar_citas_todas():
+def listar_citas_ventana(
+    desde: date,
+    hasta: date | None = None,
+    urgencia: str | None = None,
+    cursor: Tuple[str, int] | None = None,
+    limite: int = 100
+):
+    """
+    Una página de citas a partir del día `desde` (y hasta el día `hasta`
+    incluido, si se indica), ordenadas por (fecha_hora, id). `cursor` es la clave de la última
+    fila de la página anterior: se sigue desde ahí sin OFFSET, así cada página
+    cuesta lo mismo sin importar cuánto historial haya.
+    Devuelve hasta `limite` + 1 filas; la fila extra indica que hay más.
+    """
+    condiciones = ["c.fecha_hora >= ?"]
+    params: list = [desde.isoformat()]
+    if hasta is not None:
+        condiciones.append("c.fecha_hora < ?")
+        params.append(_fin_inclusivo(hasta))
+    if urgencia:
+        condiciones.append("c.urgencia = ?")
+        params.append(urgencia)
+    if cursor is not None:
+        condiciones.append("(c.fecha_hora, c.id) > (?, ?)")
+        params.extend(cursor)
+    params.append(limite + 1)
+
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("""
+    cur.execute(f"""
         SELECT c.id,
                c.fecha_hora,
                c.tipo_servicio,
@@ -189,13 +635,75 @@ def listar_citas_todas():
         JOIN mascotas m ON c.mascota_id = m.id
         JOIN duenos d   ON m.dueno_id = d.id
         JOIN veterinarios v ON c.vet_id = v.id
-        ORDER BY c.fecha_hora;
-    """)
+        WHERE {" AND ".join(condiciones)}
+        ORDER BY c.fecha_hora, c.id
+        LIMIT ?;
+    """, params)
     filas = cur.fetchall()
-    conn.close()
     return filas
 
 
+def contar_citas_por_urgencia(desde: date, hasta: date | None = None) -> Dict[str, int]:
+    """Cantidad de citas por nivel de urgencia entre `desde` y `hasta` (incluido)."""
+    condiciones = ["fecha_hora >= ?"]
+    params: list = [desde.isoformat()]
+    if hasta is not None:
+        condiciones.append("fecha_hora < ?")
+        params.append(_fin_inclusivo(hasta))
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT COALESCE(urgencia, ''), COUNT(*) AS c
+        FROM citas
+        WHERE {" AND ".join(condiciones)}
+        GROUP BY urgencia;
+    """, params)
+    filas = cur.fetchall()
+    return {row[0] or "": int(row[1]) for row in filas}
+
+
+def contar_citas_calendario(
+    desde: date,
+    hasta: date,
+    vet_id: int | None = None,
+    por_hora: bool = False
+) -> Dict[tuple, Dict[str, int]]:
+    """
+    Conteos para las vistas de calendario, agrupados en SQL por día
+    ('AAAA-MM-DD') o, con por_hora, por (día, 'HH'): total, alta, media,
+    baja. Una sola consulta de rango sobre idx_citas_fecha (o
+    idx_citas_vet_fecha con vet_id); fecha_hora es ISO, así que el prefijo
+    de texto ya es el día y la hora sin convertir cada fila en Python.
+    """
+    grupo = "substr(fecha_hora, 1, 10)"
+    if por_hora:
+        grupo += ", substr(fecha_hora, 12, 2)"
+    condiciones = ["fecha_hora >= ?", "fecha_hora < ?"]
+    params: list = [desde.isoformat(), hasta.isoformat()]
+    if vet_id is not None:
+        condiciones.insert(0, "vet_id = ?")
+        params.insert(0, vet_id)
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {grupo},
+               COUNT(*),
+               SUM(urgencia = 'alta'),
+               SUM(urgencia = 'media'),
+               SUM(urgencia = 'baja')
+        FROM citas
+        WHERE {" AND ".join(condiciones)}
+        GROUP BY {grupo};
+    """, params)
+    n = 2 if por_hora else 1
+    return {
+        tuple(f[:n]): {"total": f[n], "alta": f[n + 1], "media": f[n + 2], "baja": f[n + 3]}
+        for f in cur.fetchall()
+    }
+
+
 def obtener_cita_por_id(cita_id: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -206,6 +714,7 @@ def obtener_cita_por_id(cita_id: int):
                c.urgencia,
                c.sintomas,
                c.estado,
+               c.mascota_id,
                m.nombre AS mascota,
                m.tipo   AS tipo_mascota,
                d.nombre AS dueno,
@@ -221,7 +730,6 @@ def obtener_cita_por_id(cita_id: int):
         WHERE c.id = ?;
     """, (cita_id,))
     fila = cur.fetchone()
-    conn.close()
     return fila
 
 
@@ -241,7 +749,6 @@ def obtener_cita_cruda(cita_id: int):
         WHERE id = ?;
     """, (cita_id,))
     fila = cur.fetchone()
-    conn.close()
     return fila
 
 
@@ -254,110 +761,621 @@ def actualizar_cita(
     sintomas: str,
     urgencia: str
 ) -> None:
+    """Como crear_cita: lanza HorarioOcupado si el nuevo horario se solapa."""
+    duracion = duracion_servicio(tipo_servicio)
+    fecha_fin = fecha_hora + timedelta(minutes=duracion)
+    with transaccion() as conn:
+        cur = conn.cursor()
+        if _hay_solapamiento(cur, vet_id, fecha_hora, fecha_fin, cita_id):
+            raise HorarioOcupado()
+        antes = cur.execute(
+            "SELECT fecha_hora, urgencia FROM citas WHERE id = ?;", (cita_id,)
+        ).fetchone()
+        cur.execute("""
+            UPDATE citas
+            SET mascota_id = ?,
+                vet_id = ?,
+                fecha_hora = ?,
+                tipo_servicio = ?,
+                sintomas = ?,
+                urgencia = ?,
+                duracion_min = ?,
+                fecha_fin = ?
+            WHERE id = ?;
+        """, (mascota_id, vet_id, fecha_hora.isoformat(), tipo_servicio, sintomas, urgencia,
+              duracion, fecha_fin.isoformat(), cita_id))
+        _registrar_cambio_agenda(cur, cita_id, antes)
+        al_confirmar(invalidar_resumen)
+        al_confirmar(notificar_eventos)
+
+
+def eliminar_cita(cita_id: int) -> None:
+    with transaccion() as conn:
+        cur = conn.cursor()
+        antes = cur.execute(
+            "SELECT fecha_hora, urgencia FROM citas WHERE id = ?;", (cita_id,)
+        ).fetchone()
+        cur.execute("DELETE FROM citas WHERE id = ?;", (cita_id,))
+        _registrar_cambio_agenda(cur, cita_id, antes)
+        al_confirmar(invalidar_resumen)
+        al_confirmar(notificar_eventos)
+
+
+def calcular_disponibilidad(
+    vet_id: int,
+    dia: date,
+    tipo_servicio: str | None = None,
+    excluir_id: int | None = None
+) -> List[str]:
+    """
+    Horarios ("HH:MM") en los que el profesional puede atender el servicio ese
+    día, dentro de BLOQUES_ATENCION y cada PASO_HORARIOS_MIN minutos.
+    Las citas del día se leen con una sola consulta de rango.
+    """
+    duracion = timedelta(minutes=duracion_servicio(tipo_servicio or ""))
+    inicio_dia = datetime.combine(dia, hora(0, 0))
     conn = get_connection()
     cur = conn.cursor()
     cur.execute("""
-        UPDATE citas
-        SET mascota_id = ?,
-            vet_id = ?,
-            fecha_hora = ?,
-            tipo_servicio = ?,
-            sintomas = ?,
-            urgencia = ?
-        WHERE id = ?;
-    """, (mascota_id, vet_id, fecha_hora.isoformat(), tipo_servicio, sintomas, urgencia, cita_id))
-    conn.commit()
-    conn.close()
+        SELECT fecha_hora, fecha_fin
+        FROM citas
+        WHERE vet_id = ?
+          AND fecha_hora > ?
+          AND fecha_hora < ?
+          AND id != ?
+        ORDER BY fecha_hora;
+    """, (
+        vet_id,
+        (inicio_dia - timedelta(minutes=DURACION_MAXIMA)).isoformat(),
+        (inicio_dia + timedelta(days=1)).isoformat(),
+        excluir_id or 0,
+    ))
+    ocupados = []
+    for f in cur.fetchall():
+        o_ini = datetime.fromisoformat(f["fecha_hora"])
+        o_fin = datetime.fromisoformat(f["fecha_fin"]) if f["fecha_fin"] else o_ini + timedelta(minutes=DURACION_POR_DEFECTO)
+        ocupados.append((o_ini, o_fin))
 
+    ahora = datetime.now()
+    paso = timedelta(minutes=PASO_HORARIOS_MIN)
+    libres = []
+    for apertura, cierre in BLOQUES_ATENCION:
+        inicio = datetime.combine(dia, apertura)
+        limite = datetime.combine(dia, cierre)
+        while inicio + duracion <= limite:
+            fin = inicio + duracion
+            if inicio >= ahora and not any(o_ini < fin and o_fin > inicio for o_ini, o_fin in ocupados):
+                libres.append(inicio.strftime("%H:%M"))
+            inicio += paso
+    return libres
+
+
+# --------- Exportación ---------
+# Las exportaciones recorren la consulta con fetchmany en una conexión propia
+# y van entregando el resultado por trozos: la memoria no depende del tamaño
+# de la tabla. La conexión se cierra al agotar o abandonar el generador.
+
+COLUMNAS_EXPORT_CITAS = [
+    "id", "fecha_hora", "tipo_servicio", "urgencia", "estado", "sintomas",
+    "mascota_id", "mascota", "tipo_mascota", "dueno", "dueno_telefono",
+    "dueno_correo", "vet_id", "vet",
+]
+
+COLUMNAS_EXPORT_PACIENTES = [
+    "id", "nombre", "tipo", "raza", "edad", "peso", "fecha_registro",
+    "dueno_id", "dueno", "dueno_telefono", "dueno_correo",
+]
+
+
+def _iterar_consulta(sql: str, params: Sequence, lote: int) -> Iterator[tuple]:
+    # La clínica se resuelve ahora y no al recorrer el generador: Flask lo
+    # recorre al enviar la respuesta, cuando la petición ya pudo cerrarse.
+    return _recorrer_consulta(clinica_actual(), sql, params, lote)
+
+
+def _recorrer_consulta(clinica: str, sql: str, params: Sequence, lote: int) -> Iterator[tuple]:
+    conn = abrir_conexion(clinica=clinica)
+    conn.row_factory = None  # tuplas: más livianas que sqlite3.Row
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            filas = cur.fetchmany(lote)
+            if not filas:
+                break
+            yield from filas
+    finally:
+        conn.close()
+
+
+def iterar_citas_exportacion(
+    desde: date | None = None,
+    hasta: date | None = None,
+    urgencia: str | None = None,
+    lote: int = 1000
+) -> Iterator[tuple]:
+    """Citas en el orden de COLUMNAS_EXPORT_CITAS, filtradas por fecha (ambos días incluidos) y urgencia."""
+    condiciones = []
+    params: list = []
+    if desde is not None:
+        condiciones.append("c.fecha_hora >= ?")
+        params.append(desde.isoformat())
+    if hasta is not None:
+        condiciones.append("c.fecha_hora < ?")
+        params.append(_fin_inclusivo(hasta))
+    if urgencia:
+        condiciones.append("c.urgencia = ?")
+        params.append(urgencia)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    return _iterar_consulta(f"""
+        SELECT c.id, c.fecha_hora, c.tipo_servicio, c.urgencia, c.estado, c.sintomas,
+               c.mascota_id, m.nombre, m.tipo, d.nombre, d.telefono, d.correo,
+               c.vet_id, v.nombre
+        FROM citas c
+        JOIN mascotas m ON c.mascota_id = m.id
+        JOIN duenos d   ON m.dueno_id = d.id
+        JOIN veterinarios v ON c.vet_id = v.id
+        {where}
+        ORDER BY c.fecha_hora, c.id;
+    """, params, lote)
+
+
+def iterar_pacientes_exportacion(
+    desde: date | None = None,
+    hasta: date | None = None,
+    lote: int = 1000
+) -> Iterator[tuple]:
+    """Pacientes en el orden de COLUMNAS_EXPORT_PACIENTES, filtrados por fecha de registro (ambos días incluidos)."""
+    condiciones = []
+    params: list = []
+    if desde is not None:
+        condiciones.append("m.fecha_registro >= ?")
+        params.append(desde.isoformat())
+    if hasta is not None:
+        condiciones.append("m.fecha_registro < ?")
+        params.append(_fin_inclusivo(hasta))
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    return _iterar_consulta(f"""
+        SELECT m.id, m.nombre, m.tipo, m.raza, m.edad, m.peso, m.fecha_registro,
+               m.dueno_id, d.nombre, d.telefono, d.correo
+        FROM mascotas m
+        JOIN duenos d ON m.dueno_id = d.id
+        {where}
+        ORDER BY m.id;
+    """, params, lote)
+
+
+def formatear_csv(filas: Iterable[tuple], columnas: List[str], por_trozo: int = 500) -> Iterator[str]:
+    """Texto CSV (con cabecera) en trozos de `por_trozo` filas."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(columnas)
+    pendientes = 0
+    for fila in filas:
+        escritor.writerow(fila)
+        pendientes += 1
+        if pendientes >= por_trozo:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue()
+
+
+def formatear_ndjson(filas: Iterable[tuple], columnas: List[str], por_trozo: int = 500) -> Iterator[str]:
+    """Un objeto JSON por línea, en trozos de `por_trozo` filas."""
+    trozo = []
+    for fila in filas:
+        trozo.append(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False))
+        if len(trozo) >= por_trozo:
+            yield "\n".join(trozo) + "\n"
+            trozo = []
+    if trozo:
+        yield "\n".join(trozo) + "\n"
+
+
+# Formato de exportación -> (formateador, tipo MIME). Lo usan las descargas
+# directas, los trabajos en segundo plano y el comando `exportar`.
+FORMATOS_EXPORTACION = {
+    "csv": (formatear_csv, "text/csv"),
+    "ndjson": (formatear_ndjson, "application/x-ndjson"),
+}
+
+
+# --------- Búsqueda ---------
+
+def _consulta_fts(texto: str) -> str | None:
+    """
+    Convierte lo que escribe el usuario en una consulta FTS5 segura: cada
+    palabra entre comillas y como prefijo ("lun"* encuentra "Luna"), todas
+    obligatorias. Devuelve None si no queda ninguna palabra.
+    """
+    palabras = re.findall(r"\w+", texto or "")
+    if not palabras:
+        return None
+    return " ".join(f'"{p}"*' for p in palabras[:8])
+
+
+# Cuántas coincidencias (las más recientes) se ordenan por relevancia. Calcular
+# bm25 para todas cuesta en proporción a cuántas hay: una palabra común como
+# "diarrea" puede aparecer en decenas de miles de citas.
+CANDIDATOS_BUSQUEDA = 500
+
+
+def _candidatos_fts(tabla_fts: str) -> str:
+    return f"""
+        SELECT rowid, rank
+        FROM (
+            SELECT rowid, rank FROM {tabla_fts}
+            WHERE {tabla_fts} MATCH ?
+            ORDER BY rowid DESC
+            LIMIT {CANDIDATOS_BUSQUEDA}
+        )
+        ORDER BY rank, rowid DESC
+        LIMIT ?
+    """
+
+
+def buscar(texto: str, limite: int = 20) -> Dict[str, list]:
+    """
+    Busca en pacientes (nombre, raza), responsables (nombre, teléfono, correo)
+    y síntomas de citas. Cada grupo trae hasta `limite` resultados ordenados
+    por relevancia (bm25) entre las CANDIDATOS_BUSQUEDA coincidencias más
+    recientes, así el costo no crece con el tamaño de la base.
+    """
+    consulta = _consulta_fts(texto)
+    if consulta is None:
+        return {"pacientes": [], "duenos": [], "citas": []}
 
-def eliminar_cita(cita_id: int) -> None:
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("DELETE FROM citas WHERE id = ?;", (cita_id,))
-    conn.commit()
-    conn.close()
+    cur.execute(f"""
+        SELECT m.id, m.nombre, m.tipo, m.raza, d.nombre AS dueno
+        FROM ({_candidatos_fts("mascotas_fts")}) f
+        JOIN mascotas m ON m.id = f.rowid
+        JOIN duenos d   ON d.id = m.dueno_id
+        ORDER BY f.rank, f.rowid DESC;
+    """, (consulta, limite))
+    pacientes = cur.fetchall()
 
+    cur.execute(f"""
+        SELECT d.id, d.nombre, d.telefono, d.correo,
+               (SELECT group_concat(m.nombre, ', ') FROM mascotas m WHERE m.dueno_id = d.id) AS mascotas
+        FROM ({_candidatos_fts("duenos_fts")}) f
+        JOIN duenos d ON d.id = f.rowid
+        ORDER BY f.rank, f.rowid DESC;
+    """, (consulta, limite))
+    duenos = cur.fetchall()
 
-def contar_citas_hoy() -> int:
-    hoy = datetime.now().date().isoformat()
+    cur.execute(f"""
+        SELECT c.id, c.fecha_hora, c.urgencia, c.sintomas, m.nombre AS mascota
+        FROM ({_candidatos_fts("citas_fts")}) f
+        JOIN citas c    ON c.id = f.rowid
+        JOIN mascotas m ON m.id = c.mascota_id
+        ORDER BY f.rank, f.rowid DESC;
+    """, (consulta, limite))
+    citas = cur.fetchall()
+
+    return {"pacientes": pacientes, "duenos": duenos, "citas": citas}
+
+
+# --------- Versión de los datos ---------
+
+def version_datos() -> int:
+    """
+    Contador que sube con cada cambio en citas, mascotas, dueños o
+    veterinarios (lo mantienen triggers). Es igual en todos los procesos.
+    """
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM citas WHERE date(fecha_hora) = ?;", (hoy,))
-    c = cur.fetchone()["c"]
-    conn.close()
-    return int(c or 0)
+    cur.execute("SELECT version FROM version_datos WHERE id = 1;")
+    fila = cur.fetchone()
+    return int(fila["version"]) if fila else 0
+
+
+# --------- Resumen del panel ---------
+# Los contadores del inicio y de la agenda se guardan en memoria y solo se
+# recalculan cuando cambian los datos. Las escrituras de este proceso
+# invalidan la caché con un contador de generación; las de otros procesos se
+# detectan con PRAGMA data_version, que no lee ninguna tabla.
+
+_resumen_generacion = 0
+_resumen_lock = threading.Lock()
+_resumen_local = threading.local()
 
 
-def contar_citas_urgencia_hoy() -> Dict[str, int]:
-    hoy = datetime.now().date().isoformat()
+def invalidar_resumen() -> None:
+    global _resumen_generacion
+    with _resumen_lock:
+        _resumen_generacion += 1
+
+
+def obtener_resumen_panel() -> Dict[str, int]:
+    """
+    Todos los contadores del panel en una sola consulta:
+    total_mascotas, total_duenos, total_citas_hoy y citas de hoy por urgencia
+    (urg_alta, urg_media, urg_baja).
+    """
+    hoy = datetime.now().date()
     conn = get_connection()
+    # data_version es por conexión, por eso la caché también es por hilo
+    version = conn.execute("PRAGMA data_version;").fetchone()[0]
+    clave = (hoy.isoformat(), version, _resumen_generacion)
+
+    # Una entrada por clínica: cada una tiene su propia conexión y data_version
+    entradas = getattr(_resumen_local, "entradas", None)
+    if entradas is None:
+        entradas = _resumen_local.entradas = {}
+    clinica = clinica_actual()
+    entrada = entradas.get(clinica)
+    if entrada is not None and entrada[0] == clave:
+        return entrada[1]
+
+    inicio, fin = _rango_dia(hoy)
     cur = conn.cursor()
     cur.execute("""
-        SELECT COALESCE(urgencia, ''), COUNT(*) AS c
+        SELECT (SELECT COUNT(*) FROM mascotas) AS total_mascotas,
+               (SELECT COUNT(*) FROM duenos)   AS total_duenos,
+               COUNT(*)                                       AS total_citas_hoy,
+               COALESCE(SUM(urgencia = 'alta'), 0)            AS urg_alta,
+               COALESCE(SUM(urgencia = 'media'), 0)           AS urg_media,
+               COALESCE(SUM(urgencia = 'baja'), 0)            AS urg_baja
         FROM citas
-        WHERE date(fecha_hora) = ?
-        GROUP BY urgencia;
-    """, (hoy,))
-    filas = cur.fetchall()
-    conn.close()
-    return {row[0] or "": int(row[1]) for row in filas}
+        WHERE fecha_hora >= ? AND fecha_hora < ?;
+    """, (inicio, fin))
+    resumen = {k: int(v or 0) for k, v in dict(cur.fetchone()).items()}
 
+    # Se guarda con la clave leída antes de consultar: si hubo una escritura
+    # entretanto, la próxima llamada verá otra clave y recalculará.
+    entradas[clinica] = (clave, resumen)
+    return resumen
 
-def existe_cita_en_horario(vet_id: int, fecha_hora: datetime, excluir_id: int | None = None) -> bool:
+
+# --------- Reportes ---------
+# Se leen solo de resumen_citas_mes y resumen_pacientes_mes, que mantienen
+# triggers (ver db._migracion_9_reportes): el costo depende de los meses
+# pedidos, no de cuántas citas o pacientes haya en la historia.
+
+MAX_MESES_REPORTE = 36
+NIVELES_URGENCIA = ("alta", "media", "baja")
+
+
+def meses_entre(desde: str, hasta: str) -> List[str]:
+    """Meses 'AAAA-MM' de desde a hasta, ambos incluidos."""
+    anio, mes = int(desde[:4]), int(desde[5:7])
+    resultado = []
+    while f"{anio:04d}-{mes:02d}" <= hasta:
+        resultado.append(f"{anio:04d}-{mes:02d}")
+        anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    return resultado
+
+
+def reporte_mensual(desde: str, hasta: str) -> Dict:
+    """
+    Citas y pacientes nuevos por mes entre dos meses 'AAAA-MM' (incluidos):
+    totales con su reparto por urgencia, y citas por veterinario y por
+    servicio. Cada desglose es {clave: {mes: total}}.
+    """
+    meses = meses_entre(desde, hasta)
     conn = get_connection()
     cur = conn.cursor()
-    if excluir_id is None:
-        cur.execute("""
-            SELECT COUNT(*) AS c
-            FROM citas
-            WHERE vet_id = ? AND fecha_hora = ?;
-        """, (vet_id, fecha_hora.isoformat()))
-    else:
-        cur.execute("""
-            SELECT COUNT(*) AS c
-            FROM citas
-            WHERE vet_id = ? AND fecha_hora = ? AND id != ?;
-        """, (vet_id, fecha_hora.isoformat(), excluir_id))
-    c = cur.fetchone()["c"]
-    conn.close()
-    return bool(c and c > 0)
+
+    cur.execute("""
+        SELECT r.mes, r.vet_id, v.nombre, r.tipo_servicio, r.urgencia, r.total
+        FROM resumen_citas_mes r
+        LEFT JOIN veterinarios v ON v.id = r.vet_id
+        WHERE r.mes >= ? AND r.mes <= ? AND r.total > 0;
+    """, (desde, hasta))
+    por_mes = {m: {"total": 0, **{u: 0 for u in NIVELES_URGENCIA}} for m in meses}
+    por_vet: Dict[str, Dict[str, int]] = {}
+    por_servicio: Dict[str, Dict[str, int]] = {}
+    for f in cur.fetchall():
+        mes, total = f["mes"], f["total"]
+        fila_mes = por_mes[mes]
+        fila_mes["total"] += total
+        if f["urgencia"] in fila_mes:
+            fila_mes[f["urgencia"]] += total
+        vet = f["nombre"] or f"#{f['vet_id']}"
+        por_vet.setdefault(vet, {}).setdefault(mes, 0)
+        por_vet[vet][mes] += total
+        por_servicio.setdefault(f["tipo_servicio"], {}).setdefault(mes, 0)
+        por_servicio[f["tipo_servicio"]][mes] += total
+
+    cur.execute("""
+        SELECT mes, tipo, total
+        FROM resumen_pacientes_mes
+        WHERE mes >= ? AND mes <= ? AND total > 0;
+    """, (desde, hasta))
+    pacientes = {m: 0 for m in meses}
+    pacientes_por_tipo: Dict[str, Dict[str, int]] = {}
+    for f in cur.fetchall():
+        pacientes[f["mes"]] += f["total"]
+        pacientes_por_tipo.setdefault(f["tipo"], {})[f["mes"]] = f["total"]
+
+    def ordenar(desglose):
+        return dict(sorted(desglose.items(), key=lambda kv: -sum(kv[1].values())))
+
+    return {
+        "meses": meses,
+        "citas": por_mes,
+        "por_vet": ordenar(por_vet),
+        "por_servicio": ordenar(por_servicio),
+        "pacientes": pacientes,
+        "pacientes_por_tipo": ordenar(pacientes_por_tipo),
+    }
+
+
+def reconstruir_reportes() -> Dict[str, int]:
+    """
+    Recalcula los resúmenes desde citas y mascotas (relleno inicial o si se
+    cargaron datos saltándose los triggers). Es un recorrido completo: es
+    para el comando de administración, no para las peticiones.
+    """
+    conn = abrir_conexion()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE;")
+        try:
+            rellenar_reportes(cur)
+            filas = {
+                tabla: cur.execute(f"SELECT COUNT(*) FROM {tabla};").fetchone()[0]
+                for tabla in ("resumen_citas_mes", "resumen_pacientes_mes")
+            }
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return filas
+    finally:
+        conn.close()
 
 
 # --------- Lógica de urgencia ---------
+# Las palabras clave se escriben como se leen (con tildes). Al importar el
+# módulo se normalizan una sola vez y se descartan las que ya contienen a otra
+# del mismo nivel ("sangrado" ya está cubierta por "sangra"). El texto se
+# normaliza igual antes de buscar: minúsculas, sin tildes, guiones como
+# espacios y espacios repetidos colapsados. Así "convulsión", "convulsion" y
+# "post-operatorio"/"post  operatorio" no necesitan listarse por separado.
+#
+# La búsqueda son comparaciones `in` sobre el texto ya normalizado: en CPython
+# cada una es un recorrido en C, más rápido que una alternancia de `re` con
+# estas pocas palabras (ver benchmarks/bench_urgencia.py).
 
-def analizar_urgencia(sintomas: str) -> str:
-    texto = (sintomas or "").lower()
-    palabras_alta = [
-        "sangra", "sangrado", "hemorragia",
-        "no respira", "dificultad para respirar", "ahogando",
-        "convulsiona", "convulsión", "convulsiones",
-        "muy débil", "muy debil",
-        "no se mueve", "inconsciente" 
-    ]
-    for p in palabras_alta:
-        if p in texto:
-            return "alta"
+PALABRAS_ALTA = [
+    "sangra", "sangrado", "hemorragia",
+    "no respira", "dificultad para respirar", "ahogando",
+    "convulsiona", "convulsión", "convulsiones",
+    "muy débil",
+    "no se mueve", "inconsciente",
+]
+
+# Heridas y postoperatorios: media (si sangran ya cuentan como alta arriba)
+PALABRAS_HERIDA = [
+    "herida", "puntos", "sutura", "post operatorio", "post-operatorio",
+]
+
+PALABRAS_MEDIA = [
+    "no quiere jugar", "triste", "no bebe",
+    "apatía", "apático", "apática",
+    "diarrea", "tos", "cojea", "cojera",
+    "dolor", "molestia", "no apoya la pata",
+]
+
+# Tabla latin-1 -> ASCII para tildes, y separadores -> espacio
+_TABLA_NORMALIZAR = bytes.maketrans(
+    "àáâãäåèéêëìíîïòóôõöùúûüñç-\t\n\r\x0b\x0c".encode("latin-1"),
+    b"aaaaaaeeeeiiiiooooouuuunc      "
+)
+
+
+def _normalizar(texto: str) -> str:
+    # bytes.translate es mucho más rápido que str.translate. Los caracteres
+    # fuera de latin-1 quedan como "?", que ninguna clave contiene.
+    datos = texto.lower().encode("latin-1", "replace").translate(_TABLA_NORMALIZAR)
+    texto = datos.decode("latin-1")
+    while "  " in texto:
+        texto = texto.replace("  ", " ")
+    return texto
 
-    if "herida" in texto or "puntos" in texto or "sutura" in texto or "post operatorio" in texto or "post-operatorio" in texto:
-        if "sangra" in texto or "sangrado" in texto or "hemorragia" in texto:
+
+def _preparar_claves(palabras) -> Tuple[str, ...]:
+    claves = sorted({_normalizar(p).strip() for p in palabras}, key=lambda c: (len(c), c))
+    minimas: List[str] = []
+    for clave in claves:
+        if not any(m in clave for m in minimas):
+            minimas.append(clave)
+    return tuple(minimas)
+
+
+_CLAVES_ALTA = _preparar_claves(PALABRAS_ALTA)
+_CLAVES_MEDIA = _preparar_claves(PALABRAS_HERIDA + PALABRAS_MEDIA)
+
+
+def _clasificar(texto: str) -> str:
+    for clave in _CLAVES_ALTA:
+        if clave in texto:
             return "alta"
-        if "abrió" in texto or "abrio" in texto or "abierta" in texto or "abierto" in texto or "se le abrió" in texto:
+    for clave in _CLAVES_MEDIA:
+        if clave in texto:
             return "media"
-        return "media"
-
-    palabras_media = [
-        "no quiere jugar", "triste", "no bebe",
-        "apatía", "apatico", "apática",
-        "diarrea", "tos", "cojea", "cojera",
-        "dolor", "molestia", "no apoya la pata"
-    ]
-    for p in palabras_media:
-        if p in texto:
-            return "media"
-
     return "baja"
 
 
+def analizar_urgencia(sintomas: str) -> str:
+    return _clasificar(_normalizar(sintomas or ""))
+
+
+def analizar_urgencia_lote(lista_sintomas: Iterable[str]) -> List[str]:
+    """Clasifica varios textos de síntomas en un solo recorrido de la lista."""
+    normalizar = _normalizar
+    clasificar = _clasificar
+    return [clasificar(normalizar(s or "")) for s in lista_sintomas]
+
+
+def reclasificar_urgencias(
+    lote: int = 1000,
+    progreso: Callable[[int, int], None] | None = None
+) -> Dict[str, float]:
+    """
+    Vuelve a calcular la urgencia de todas las citas con las reglas actuales.
+
+    Lee la tabla por bloques de `lote` filas con una consulta por bloque
+    (id > último visto, memoria acotada): ninguna lectura queda abierta
+    entre bloques, así los checkpoints del WAL pueden avanzar aunque la tabla
+    sea enorme. Escribe solo las filas que cambian, con executemany y un
+    commit por bloque, para no retener el bloqueo de escritura más que unos
+    milisegundos cada vez. Si los síntomas de una cita cambian mientras
+    tanto, esa fila no se toca (ya la clasificó quien la editó) ni se cuenta
+    como cambiada.
+
+    `progreso(revisadas, cambiadas)` se llama tras cada bloque.
+    """
+    inicio = time.perf_counter()
+    revisadas = cambiadas = 0
+    ultimo_id = 0
+
+    conn = get_connection()
+    while True:
+        filas = conn.execute(
+            "SELECT id, sintomas, urgencia FROM citas WHERE id > ? ORDER BY id LIMIT ?;",
+            (ultimo_id, lote)
+        ).fetchall()
+        if not filas:
+            break
+        ultimo_id = filas[-1]["id"]
+        nuevas = analizar_urgencia_lote(f["sintomas"] for f in filas)
+        cambios = [
+            (nueva, f["id"], f["sintomas"])
+            for f, nueva in zip(filas, nuevas)
+            if nueva != f["urgencia"]
+        ]
+        if cambios:
+            with transaccion() as escritor:
+                cambiadas += escritor.executemany(
+                    "UPDATE citas SET urgencia = ? WHERE id = ? AND sintomas IS ?;",
+                    cambios
+                ).rowcount
+        revisadas += len(filas)
+        if progreso:
+            progreso(revisadas, cambiadas)
+
+    if cambiadas:
+        with transaccion() as escritor:
+            # Las pantallas de la agenda vuelven a cargar la lista completa
+            registrar_evento(escritor.cursor(), "recargar", None, date.today().isoformat())
+            al_confirmar(invalidar_resumen)
+            al_confirmar(notificar_eventos)
+    segundos = time.perf_counter() - inicio
+    return {
+        "revisadas": revisadas,
+        "cambiadas": cambiadas,
+        "segundos": segundos,
+        "filas_por_segundo": revisadas / segundos if segundos else 0.0,
+    }
+
+
 # ... (imports existentes)
 # Añade este import si no lo tienes, aunque solo usaremos SQL aquí
 from db import get_connection 
@@ -375,23 +1393,27 @@ def obtener_usuario_por_username(username: str):
     cur = conn.cursor()
     cur.execute("SELECT * FROM usuarios WHERE username = ?", (username,))
     user = cur.fetchone()
-    conn.close()
     return user
 
-def crear_usuario(username, password_hash, rol="secretaria"):
+def crear_usuario(username, password, rol="secretaria"):
     """
     Función útil por si en el futuro quieres crear más usuarios desde la web.
+    Recibe la contraseña en claro; el hash se calcula en el pool de claves.py
+    (puede lanzar ClavesSaturadas).
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    password_hash = generar_hash(password)
     try:
-        cur.execute(
-            "INSERT INTO usuarios (username, password, rol) VALUES (?, ?, ?)",
-            (username, password_hash, rol)
-        )
-        conn.commit()
+        with transaccion() as conn:
+            conn.execute(
+                "INSERT INTO usuarios (username, password, rol) VALUES (?, ?, ?)",
+                (username, password_hash, rol)
+            )
         return True
-    except:
+    except Exception:
         return False
-    finally:
-        conn.close()
\ No newline at end of file
+
+
+def actualizar_hash_usuario(usuario_id: int, password_hash: str) -> None:
+    """Reemplaza el hash guardado (rehash al iniciar sesión)."""
+    with transaccion() as conn:
+        conn.execute("UPDATE usuarios SET password = ? WHERE id = ?;", (password_hash, usuario_id))
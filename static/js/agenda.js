@@ -0,0 +1,110 @@
+// Aplica en la agenda del día los cambios que llegan por /agenda/eventos
+// (Server-Sent Events), sin recargar la página. La tabla indica la URL del
+// stream en data-eventos y la del detalle (con cita_id 0) en data-detalle.
+// EventSource se reconecta solo y retoma desde el último evento recibido.
+(function () {
+    var tabla = document.querySelector("table[data-eventos]");
+    if (!tabla || !window.EventSource) {
+        return;
+    }
+
+    var cuerpo = tabla.querySelector("tbody");
+    var vacia = document.querySelector(".agenda-vacia");
+    var contadorCitas = document.querySelector("[data-contador=citas]");
+    var contadorAltas = document.querySelector("[data-contador=altas]");
+    var ETIQUETAS = { alta: "ALTA", media: "MEDIA", baja: "BAJA" };
+
+    function celda(fila, texto, clase) {
+        var td = fila.insertCell();
+        if (clase) {
+            td.className = clase;
+        }
+        if (texto !== undefined) {
+            td.textContent = texto;
+        }
+        return td;
+    }
+
+    function crearFila(c) {
+        var urg = (c.urgencia || "").toLowerCase();
+        var fila = document.createElement("tr");
+        fila.className = "urg-" + urg;
+        fila.dataset.id = c.id;
+        fila.dataset.fecha = c.fecha_hora;
+
+        celda(fila, c.fecha_hora.slice(11, 16));
+        celda(fila, c.mascota);
+        celda(fila, c.dueno);
+        celda(fila, c.tipo_servicio);
+
+        var etiqueta = document.createElement("span");
+        etiqueta.className = "urg-tag" + (ETIQUETAS[urg] ? " urg-" + urg : "");
+        etiqueta.textContent = ETIQUETAS[urg] || "N/A";
+        celda(fila, undefined, "urg-cell").appendChild(etiqueta);
+
+        var sintomas = celda(fila, undefined, "symptoms-cell");
+        if (c.sintomas) {
+            sintomas.textContent = c.sintomas.length > 70 ? c.sintomas.slice(0, 70) + "…" : c.sintomas;
+        } else {
+            var sin = document.createElement("span");
+            sin.className = "symptoms-empty";
+            sin.textContent = "Sin descripción";
+            sintomas.appendChild(sin);
+        }
+
+        var enlace = document.createElement("a");
+        enlace.className = "details-link";
+        enlace.href = tabla.dataset.detalle.replace(/\/0$/, "/" + c.id);
+        enlace.textContent = "Ver detalle";
+        celda(fila).appendChild(enlace);
+        return fila;
+    }
+
+    function quitar(id) {
+        var fila = cuerpo.querySelector("tr[data-id='" + id + "']");
+        if (fila) {
+            fila.remove();
+        }
+    }
+
+    // Inserta o reemplaza la fila manteniendo el orden por hora
+    function poner(c) {
+        quitar(c.id);
+        var nueva = crearFila(c);
+        var siguiente = Array.prototype.find.call(cuerpo.rows, function (f) {
+            return f.dataset.fecha > c.fecha_hora;
+        });
+        cuerpo.insertBefore(nueva, siguiente || null);
+        nueva.classList.add("agenda-cambio");
+    }
+
+    function actualizarContadores() {
+        var total = cuerpo.rows.length;
+        if (contadorCitas) {
+            contadorCitas.textContent = total;
+        }
+        if (contadorAltas) {
+            contadorAltas.textContent = cuerpo.querySelectorAll("tr.urg-alta").length;
+        }
+        tabla.hidden = total === 0;
+        if (vacia) {
+            vacia.hidden = total !== 0;
+        }
+    }
+
+    function manejar(aplicar) {
+        return function (evento) {
+            aplicar(JSON.parse(evento.data));
+            actualizarContadores();
+        };
+    }
+
+    var fuente = new EventSource(tabla.dataset.eventos);
+    fuente.addEventListener("creada", manejar(poner));
+    fuente.addEventListener("actualizada", manejar(poner));
+    fuente.addEventListener("eliminada", manejar(function (c) { quitar(c.id); }));
+    fuente.addEventListener("recargar", function () {
+        fuente.close();
+        window.location.reload();
+    });
+})();
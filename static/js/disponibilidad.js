@@ -0,0 +1,57 @@
+// Marca como no disponibles los horarios ocupados del profesional elegido.
+// El formulario indica la URL de la API en data-disponibilidad (con vet_id 0)
+// y, al editar, la cita a ignorar en data-excluir.
+(function () {
+    var form = document.querySelector("form[data-disponibilidad]");
+    if (!form) {
+        return;
+    }
+
+    var vet = form.querySelector("[name=vet_id]");
+    var fecha = form.querySelector("[name=fecha_cita]");
+    var servicio = form.querySelector("[name=tipo_servicio]");
+    var horas = form.querySelectorAll("[name=hora_cita] option[value]:not([value=''])");
+    var aviso = form.querySelector(".disponibilidad-aviso");
+    var pedido = 0;
+
+    function actualizar() {
+        if (!vet.value || !fecha.value) {
+            return;
+        }
+        var url = form.dataset.disponibilidad.replace("/0/", "/" + vet.value + "/") +
+            "?fecha=" + encodeURIComponent(fecha.value) +
+            "&servicio=" + encodeURIComponent(servicio.value);
+        if (form.dataset.excluir) {
+            url += "&excluir=" + encodeURIComponent(form.dataset.excluir);
+        }
+
+        var numero = ++pedido;
+        fetch(url, { credentials: "same-origin" })
+            .then(function (r) { return r.ok ? r.json() : null; })
+            .then(function (datos) {
+                if (!datos || numero !== pedido) {
+                    return;
+                }
+                var libres = new Set(datos.libres);
+                horas.forEach(function (opcion) {
+                    var libre = libres.has(opcion.value);
+                    opcion.disabled = !libre;
+                    opcion.textContent = opcion.value + (libre ? "" : " · ocupado");
+                    if (!libre && opcion.selected) {
+                        opcion.selected = false;
+                    }
+                });
+                if (aviso) {
+                    aviso.textContent = datos.libres.length
+                        ? datos.libres.length + " horarios libres (" + datos.duracion_min + " min por cita)."
+                        : "No hay horarios libres ese día para este servicio.";
+                }
+            })
+            .catch(function () { /* sin conexión: el servidor valida igual */ });
+    }
+
+    [vet, fecha, servicio].forEach(function (campo) {
+        campo.addEventListener("change", actualizar);
+    });
+    actualizar();
+})();
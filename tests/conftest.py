@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# La configuración de clínicas se lee al importar db, así que se fija antes de
+# que cualquier prueba lo importe. Cada prueba trabaja en su propia clínica;
+# VETIFY_CLINICA=sur hace visible una fuga hacia la clínica por defecto.
+os.environ["VETIFY_CLINICAS"] = tempfile.mkdtemp(prefix="vetify-clinicas-")
+os.environ["VETIFY_CLINICA"] = "sur"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def nueva_clinica() -> str:
+    """Crea una clínica vacía (migrada, con veterinarios y admin)."""
+    from db import crear_clinica
+
+    nombre = f"prueba-{uuid.uuid4().hex[:12]}"
+    crear_clinica(nombre)
+    return nombre
+
+
+@pytest.fixture
+def clinica():
+    """Clínica nueva fijada en el hilo durante la prueba."""
+    from db import usar_clinica
+
+    nombre = nueva_clinica()
+    with usar_clinica(nombre):
+        yield nombre
@@ -0,0 +1,29 @@
+# Las clínicas van en la carpeta temporal de conftest.py, con VETIFY_CLINICA=sur
+from app import app
+from db import crear_clinica, usar_clinica
+from services import crear_dueno, crear_mascota
+
+
+def _preparar_clinicas():
+    for nombre, mascota in (("norte", "PET_NORTE"), ("sur", "PET_SUR")):
+        crear_clinica(nombre)
+        with usar_clinica(nombre):
+            dueno_id = crear_dueno(f"Dueño {nombre}", "7777-0000", f"{nombre}@vetify.local")
+            crear_mascota(mascota, "Perro", "", 3, 10.0, dueno_id)
+
+
+def test_exportacion_usa_la_clinica_de_la_sesion():
+    _preparar_clinicas()
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion["user_id"] = 1
+        sesion["username"] = "admin"
+        sesion["rol"] = "admin"
+        sesion["clinica"] = "norte"
+
+    respuesta = cliente.get("/export/pacientes")
+    texto = respuesta.get_data(as_text=True)
+
+    assert respuesta.status_code == 200
+    assert "PET_NORTE" in texto
+    assert "PET_SUR" not in texto
@@ -0,0 +1,34 @@
+import io
+
+from conftest import nueva_clinica
+from db import get_connection, usar_clinica
+from services import importar_pacientes_csv
+
+# Ana aparece en filas que caen en bloques distintos con lote=1
+CSV_REPETIDO = """owner_name,owner_phone,owner_email,pet_name,pet_type,pet_breed,pet_age,pet_weight
+Ana Gómez,7777-1111,ana@vetify.local,Luna,Perro,,3,12
+Ana Gómez,7777-1111,ana@vetify.local,Sol,Gato,,2,4
+Luis Paz,7777-2222,luis@vetify.local,Kiwi,Ave,,1,0.2
+Ana Gómez,7777-1111,ana@vetify.local,Nube,Gato,,5,5
+"""
+
+
+def _importar(lote: int):
+    with usar_clinica(nueva_clinica()):
+        r = importar_pacientes_csv(io.StringIO(CSV_REPETIDO), lote=lote)
+        conn = get_connection()
+        duenos = conn.execute("SELECT COUNT(*) FROM duenos;").fetchone()[0]
+        pacientes = [tuple(f) for f in conn.execute("""
+            SELECT d.nombre, m.nombre
+            FROM mascotas m JOIN duenos d ON m.dueno_id = d.id
+            ORDER BY m.nombre;
+        """)]
+    return r["importados"], r["duenos"], duenos, pacientes
+
+
+def test_resultado_no_depende_del_lote():
+    por_fila = _importar(lote=1)
+    por_bloque = _importar(lote=5000)
+
+    assert por_fila == por_bloque
+    assert por_fila[:3] == (4, 2, 2)
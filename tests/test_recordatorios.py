@@ -0,0 +1,73 @@
+import socket
+from datetime import date, datetime
+
+import pytest
+
+import recordatorios
+from services import crear_cita, crear_dueno, crear_mascota
+
+aiosmtpd = pytest.importorskip("aiosmtpd.controller")
+
+DIA = date(2031, 3, 4)
+CORREOS = ["ana@vetify.local", "luis@vetify.local", "eva@vetify.local"]
+
+
+class Buzon:
+    """Servidor SMTP de prueba: anota las entregas y rechaza una vez a `rechazar`."""
+
+    def __init__(self, rechazar):
+        self.entregas = []
+        self.rechazar = set(rechazar)
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.rechazar:
+            self.rechazar.discard(address)
+            return "550 Buzón no disponible"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.entregas.extend(envelope.rcpt_tos)
+        return "250 OK"
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def buzon(monkeypatch):
+    buzon = Buzon(rechazar=["luis@vetify.local"])
+    servidor = aiosmtpd.Controller(buzon, hostname="127.0.0.1", port=_puerto_libre())
+    servidor.start()
+    monkeypatch.setattr(recordatorios, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(recordatorios, "SMTP_PUERTO", servidor.port)
+    monkeypatch.setattr(recordatorios, "SMTP_STARTTLS", False)
+    yield buzon
+    servidor.stop()
+
+
+@pytest.fixture
+def citas_del_dia(clinica):
+    for hora, correo in enumerate(CORREOS, start=9):
+        dueno_id = crear_dueno(correo.split("@")[0].title(), "7777-0000", correo)
+        mascota_id = crear_mascota(f"Mascota {hora}", "Perro", "", 3, 10.0, dueno_id)
+        crear_cita(mascota_id, 1, datetime.combine(DIA, datetime.min.time()).replace(hour=hora),
+                   "Consulta", "", "baja")
+
+
+def test_reenvio_sin_duplicados_y_reintento_de_fallidos(buzon, citas_del_dia):
+    primera = recordatorios.enviar_recordatorios(dia=DIA, conexiones=2)
+    assert (primera["a_enviar"], primera["enviados"], primera["errores"]) == (3, 2, 1)
+    assert sorted(buzon.entregas) == ["ana@vetify.local", "eva@vetify.local"]
+
+    # Solo vuelve a intentar la que falló; las enviadas no se repiten
+    segunda = recordatorios.enviar_recordatorios(dia=DIA, conexiones=2)
+    assert (segunda["a_enviar"], segunda["enviados"], segunda["errores"]) == (1, 1, 0)
+    assert sorted(buzon.entregas) == sorted(CORREOS)
+
+    tercera = recordatorios.enviar_recordatorios(dia=DIA, conexiones=2)
+    assert tercera["a_enviar"] == 0
+    assert len(buzon.entregas) == len(CORREOS)
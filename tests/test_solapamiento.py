@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+from services import HorarioOcupado, actualizar_cita, crear_cita, crear_dueno, crear_mascota
+
+VET = 1
+DIA = datetime(2031, 3, 3)
+
+
+@pytest.fixture
+def mascota_id(clinica):
+    dueno_id = crear_dueno("Ana Gómez", "7777-1111", "ana@vetify.local")
+    return crear_mascota("Luna", "Perro", "", 3, 12.0, dueno_id)
+
+
+@pytest.fixture
+def cirugia(mascota_id):
+    """Cirugía de 10:00 a 12:00 (120 minutos)."""
+    return crear_cita(mascota_id, VET, DIA.replace(hour=10), "Cirugía", "", "media")
+
+
+def test_consulta_que_se_cruza_con_una_cirugia_se_rechaza(mascota_id, cirugia):
+    # 09:45-10:15 se cruza con los primeros 15 minutos de la cirugía
+    with pytest.raises(HorarioOcupado):
+        crear_cita(mascota_id, VET, DIA.replace(hour=9, minute=45), "Consulta", "", "baja")
+
+
+def test_cita_justo_al_terminar_se_acepta(mascota_id, cirugia):
+    assert crear_cita(mascota_id, VET, DIA.replace(hour=12), "Consulta", "", "baja")
+
+
+def test_otro_profesional_esta_libre(mascota_id, cirugia):
+    assert crear_cita(mascota_id, VET + 1, DIA.replace(hour=10, minute=30), "Consulta", "", "baja")
+
+
+def test_editar_no_choca_consigo_misma(mascota_id, cirugia):
+    # Mover la cirugía 30 minutos solapa con su propio horario anterior
+    actualizar_cita(cirugia, mascota_id, VET, DIA.replace(hour=10, minute=30), "Cirugía", "", "media")
+
+
+def test_editar_hacia_un_horario_ocupado_se_rechaza(mascota_id, cirugia):
+    otra = crear_cita(mascota_id, VET, DIA.replace(hour=13), "Consulta", "", "baja")
+    with pytest.raises(HorarioOcupado):
+        actualizar_cita(otra, mascota_id, VET, DIA.replace(hour=11, minute=30), "Consulta", "", "baja")
@@ -0,0 +1,61 @@
+import pytest
+
+from db import al_confirmar, get_connection, transaccion
+from services import crear_dueno, crear_mascota
+
+
+def _duenos():
+    return [f[0] for f in get_connection().execute("SELECT nombre FROM duenos ORDER BY id;")]
+
+
+def test_fallo_interno_deshace_solo_su_savepoint(clinica):
+    with transaccion():
+        crear_dueno("Ana Gómez", "7777-1111", "ana@vetify.local")
+        with pytest.raises(RuntimeError):
+            with transaccion():
+                crear_dueno("Luis Paz", "7777-2222", "luis@vetify.local")
+                raise RuntimeError("falla adentro")
+        crear_dueno("Eva Ruiz", "7777-3333", "eva@vetify.local")
+
+    assert _duenos() == ["Ana Gómez", "Eva Ruiz"]
+
+
+def test_fallo_externo_deshace_todo_y_no_corre_callbacks(clinica):
+    llamadas = []
+    with pytest.raises(RuntimeError):
+        with transaccion():
+            dueno_id = crear_dueno("Ana Gómez", "7777-1111", "ana@vetify.local")
+            crear_mascota("Luna", "Perro", "", 3, 12.0, dueno_id)
+            al_confirmar(lambda: llamadas.append("confirmada"))
+            raise RuntimeError("falla afuera")
+
+    assert _duenos() == []
+    assert llamadas == []
+    assert not get_connection().in_transaction
+
+
+def test_callbacks_de_un_savepoint_deshecho_no_corren(clinica):
+    llamadas = []
+    with transaccion():
+        with pytest.raises(RuntimeError):
+            with transaccion():
+                al_confirmar(lambda: llamadas.append("interna"))
+                raise RuntimeError("falla adentro")
+        al_confirmar(lambda: llamadas.append("externa"))
+        assert llamadas == []
+
+    assert llamadas == ["externa"]
+
+
+def test_callback_registrado_dos_veces_corre_una(clinica):
+    llamadas = []
+
+    def avisar():
+        llamadas.append(1)
+
+    with transaccion():
+        al_confirmar(avisar)
+        with transaccion():
+            al_confirmar(avisar)
+
+    assert llamadas == [1]
@@ -0,0 +1,381 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import partial
+from typing import Callable, Dict, List, NamedTuple
+
+from db import (
+    abrir_conexion, al_confirmar, clinica_actual, get_connection, liberar_conexion, multiclinica,
+    transaccion, usar_clinica
+)
+from services import (
+    COLUMNAS_EXPORT_CITAS,
+    COLUMNAS_EXPORT_PACIENTES,
+    FORMATOS_EXPORTACION,
+    importar_pacientes_csv,
+    iterar_citas_exportacion,
+    iterar_pacientes_exportacion,
+    reclasificar_urgencias,
+)
+
+# Trabajos en segundo plano: se guardan en la tabla `trabajos` y se ejecutan
+# en un pool de hilos del propio proceso. El trabajo pesado ocurre dentro de
+# SQLite (que suelta el GIL), así que los hilos bastan y comparten las
+# conexiones por hilo de db.get_connection.
+#
+# Estados: pendiente -> en_curso -> terminado | error | cancelado
+
+MAX_HILOS = int(os.environ.get("VETIFY_TRABAJOS_HILOS", "2"))
+
+# El progreso se escribe como mucho una vez por intervalo (segundos)
+INTERVALO_PROGRESO = 1.0
+
+# Filas rechazadas que se guardan en el resultado de una importación
+MAX_RECHAZOS_GUARDADOS = 200
+
+log = logging.getLogger(__name__)
+
+
+class TrabajoCancelado(Exception):
+    pass
+
+
+class TipoTrabajo(NamedTuple):
+    titulo: str
+    funcion: Callable
+    # Si se puede repetir desde cero cuando un reinicio lo corta a medias
+    reanudable: bool
+
+
+_TIPOS: Dict[str, TipoTrabajo] = {}
+
+# Carpeta para los archivos de entrada y salida (la fija registrar_trabajos)
+_carpeta = None
+_reanudadas = set()     # (pid, clínica) ya revisadas tras arrancar
+
+_ejecutor = None
+_ejecutor_pid = None
+_ejecutor_lock = threading.Lock()
+
+
+def tipo_trabajo(nombre: str, titulo: str, reanudable: bool = True):
+    """Registra funcion(avance, **parametros) como tipo de trabajo."""
+    def registrar(funcion):
+        _TIPOS[nombre] = TipoTrabajo(titulo, funcion, reanudable)
+        return funcion
+    return registrar
+
+
+def titulo_tipo(nombre: str) -> str:
+    tipo = _TIPOS.get(nombre)
+    return tipo.titulo if tipo else nombre
+
+
+def _ahora() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _pool() -> ThreadPoolExecutor:
+    # Los hilos no sobreviven a un fork: cada proceso crea su propio pool
+    global _ejecutor, _ejecutor_pid
+    with _ejecutor_lock:
+        if _ejecutor is None or _ejecutor_pid != os.getpid():
+            _ejecutor = ThreadPoolExecutor(max_workers=MAX_HILOS, thread_name_prefix="trabajo")
+            _ejecutor_pid = os.getpid()
+        return _ejecutor
+
+
+class Avance:
+    """
+    Se pasa a cada trabajo para informar su progreso. Cada llamada que llega
+    a escribir en la tabla comprueba también si se pidió cancelar, y en ese
+    caso lanza TrabajoCancelado.
+    """
+
+    def __init__(self, trabajo_id: int):
+        self.trabajo_id = trabajo_id
+        self._ultimo = 0.0
+
+    def __call__(self, actual: int, total: int | None = None, mensaje: str | None = None,
+                 forzar: bool = False) -> None:
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo < INTERVALO_PROGRESO:
+            return
+        self._ultimo = ahora
+
+        with transaccion() as conn:
+            conn.execute(
+                """UPDATE trabajos
+                   SET progreso = ?, total = COALESCE(?, total), mensaje = COALESCE(?, mensaje)
+                   WHERE id = ?;""",
+                (actual, total, mensaje, self.trabajo_id)
+            )
+        fila = conn.execute("SELECT cancelar FROM trabajos WHERE id = ?;", (self.trabajo_id,)).fetchone()
+        if fila and fila["cancelar"]:
+            raise TrabajoCancelado()
+
+
+# --------- API ---------
+
+def encolar(tipo: str, **parametros) -> int:
+    """Crea un trabajo pendiente y lo manda al pool. Devuelve su id."""
+    if tipo not in _TIPOS:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    with transaccion() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO trabajos (tipo, parametros, creado) VALUES (?, ?, ?);",
+            (tipo, json.dumps(parametros), _ahora())
+        )
+        trabajo_id = cur.lastrowid
+        # Se manda al pool tras confirmar: antes el hilo no vería la fila
+        al_confirmar(partial(_pool().submit, _ejecutar, trabajo_id, clinica_actual()))
+    return trabajo_id
+
+
+def _fila_a_dict(fila) -> Dict:
+    trabajo = dict(fila)
+    trabajo["parametros"] = json.loads(trabajo["parametros"] or "{}")
+    trabajo["resultado"] = json.loads(trabajo["resultado"]) if trabajo["resultado"] else None
+    trabajo["titulo"] = titulo_tipo(trabajo["tipo"])
+    trabajo["activo"] = trabajo["estado"] in ("pendiente", "en_curso")
+    return trabajo
+
+
+def obtener_trabajo(trabajo_id: int) -> Dict | None:
+    conn = get_connection()
+    fila = conn.execute("SELECT * FROM trabajos WHERE id = ?;", (trabajo_id,)).fetchone()
+    return _fila_a_dict(fila) if fila else None
+
+
+def listar_trabajos(limite: int = 50) -> List[Dict]:
+    conn = get_connection()
+    filas = conn.execute("SELECT * FROM trabajos ORDER BY id DESC LIMIT ?;", (limite,)).fetchall()
+    return [_fila_a_dict(f) for f in filas]
+
+
+def cancelar_trabajo(trabajo_id: int) -> bool:
+    """
+    Un trabajo pendiente se cancela en el acto; uno en curso se marca y se
+    detiene en su siguiente aviso de progreso. Devuelve False si ya terminó.
+    """
+    with transaccion() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE trabajos SET estado = 'cancelado', terminado = ? WHERE id = ? AND estado = 'pendiente';",
+            (_ahora(), trabajo_id)
+        )
+        if cur.rowcount == 0:
+            cur.execute("UPDATE trabajos SET cancelar = 1 WHERE id = ? AND estado = 'en_curso';", (trabajo_id,))
+    return cur.rowcount > 0
+
+
+def ruta_archivo(nombre: str) -> str:
+    """Ruta dentro de la carpeta de archivos de los trabajos (una por clínica)."""
+    carpeta = _carpeta
+    clinica = clinica_actual()
+    if clinica:
+        carpeta = os.path.join(_carpeta, clinica)
+        os.makedirs(carpeta, exist_ok=True)
+    return os.path.join(carpeta, os.path.basename(nombre))
+
+
+def _ejecutar(trabajo_id: int, clinica: str) -> None:
+    # Los hilos del pool son compartidos: cada trabajo usa la base de la
+    # clínica que lo encoló
+    with usar_clinica(clinica):
+        _ejecutar_trabajo(trabajo_id)
+
+
+def _ejecutar_trabajo(trabajo_id: int) -> None:
+    with transaccion() as conn:
+        cur = conn.cursor()
+        # Se reclama de forma atómica: otro proceso pudo tomarlo o cancelarlo
+        cur.execute(
+            """UPDATE trabajos SET estado = 'en_curso', iniciado = ?, propietario = ?
+               WHERE id = ? AND estado = 'pendiente';""",
+            (_ahora(), os.getpid(), trabajo_id)
+        )
+    if cur.rowcount == 0:
+        return
+
+    fila = conn.execute("SELECT tipo, parametros FROM trabajos WHERE id = ?;", (trabajo_id,)).fetchone()
+    resultado = None
+    mensaje = None
+    try:
+        tipo = _TIPOS.get(fila["tipo"])
+        if tipo is None:
+            raise ValueError(f"Tipo de trabajo desconocido: {fila['tipo']}")
+        resultado = tipo.funcion(Avance(trabajo_id), **json.loads(fila["parametros"]))
+        estado = "terminado"
+    except TrabajoCancelado:
+        estado, mensaje = "cancelado", "Cancelado a pedido del usuario."
+    except Exception as e:
+        log.exception("Falló el trabajo %s", trabajo_id)
+        estado, mensaje = "error", str(e) or e.__class__.__name__
+    finally:
+        # Descarta una transacción que el trabajo haya dejado a medias
+        liberar_conexion()
+
+    with transaccion() as conn:
+        conn.execute(
+            """UPDATE trabajos
+               SET estado = ?, resultado = ?, mensaje = COALESCE(?, mensaje), terminado = ?
+               WHERE id = ?;""",
+            (estado, json.dumps(resultado) if resultado is not None else None, mensaje, _ahora(), trabajo_id)
+        )
+
+
+def _proceso_vivo(pid: int | None) -> bool:
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def reanudar_trabajos() -> int:
+    """
+    Los trabajos que quedaron en curso en un proceso que ya no existe vuelven
+    a pendiente si su tipo es reanudable (o pasan a error si no lo es), y
+    todos los pendientes se mandan al pool. Devuelve cuántos se encolaron.
+    """
+    # Conexión propia, como el resto de tareas de arranque (ver db.init_db)
+    conn = abrir_conexion()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE;")
+        cur.execute("SELECT id, tipo, propietario, cancelar, progreso FROM trabajos WHERE estado = 'en_curso';")
+        for t in cur.fetchall():
+            if _proceso_vivo(t["propietario"]):
+                continue
+            tipo = _TIPOS.get(t["tipo"])
+            if t["cancelar"]:
+                estado, mensaje = "cancelado", "Cancelado a pedido del usuario."
+            elif tipo and tipo.reanudable:
+                estado, mensaje = "pendiente", "Reanudado tras un reinicio."
+            else:
+                estado = "error"
+                mensaje = f"Interrumpido por un reinicio tras procesar {t['progreso']} filas; revisa y vuelve a lanzarlo."
+            conn.execute(
+                "UPDATE trabajos SET estado = ?, mensaje = ?, propietario = NULL WHERE id = ?;",
+                (estado, mensaje, t["id"])
+            )
+        pendientes = [f["id"] for f in conn.execute(
+            "SELECT id FROM trabajos WHERE estado = 'pendiente' ORDER BY id;"
+        )]
+        conn.commit()
+    finally:
+        conn.close()
+
+    for trabajo_id in pendientes:
+        _pool().submit(_ejecutar, trabajo_id, clinica_actual())
+    return len(pendientes)
+
+
+def registrar_trabajos(app, carpeta: str) -> None:
+    """
+    Fija la carpeta de archivos y reanuda los trabajos pendientes con la
+    primera petición de cada proceso (con varias clínicas, la primera de cada
+    clínica). Así los comandos de la CLI, que también importan la app, no se
+    quedan ejecutando trabajos ajenos. Debe registrarse después del hook que
+    fija la clínica de la petición.
+    """
+    global _carpeta
+    _carpeta = carpeta
+    os.makedirs(carpeta, exist_ok=True)
+
+    @app.before_request
+    def _reanudar_una_vez():
+        clinica = clinica_actual()
+        if multiclinica() and not clinica:
+            return
+        clave = (os.getpid(), clinica)
+        if clave in _reanudadas:
+            return
+        with _ejecutor_lock:
+            if clave in _reanudadas:
+                return
+            _reanudadas.add(clave)
+        reanudar_trabajos()
+
+
+# --------- Tipos de trabajo ---------
+
+@tipo_trabajo("reclasificar_urgencias", "Recalcular urgencias")
+def _trabajo_reclasificar(avance: Avance, lote: int = 1000):
+    total = get_connection().execute("SELECT COUNT(*) FROM citas;").fetchone()[0]
+    avance(0, total=total, forzar=True)
+    r = reclasificar_urgencias(
+        lote=lote,
+        progreso=lambda revisadas, cambiadas: avance(revisadas, mensaje=f"{cambiadas} actualizadas")
+    )
+    avance(r["revisadas"], mensaje=f"{r['cambiadas']} actualizadas", forzar=True)
+    return r
+
+
+# Cada bloque importado se confirma por separado: repetirlo desde cero
+# duplicaría pacientes, por eso no es reanudable.
+@tipo_trabajo("importar_pacientes", "Importar pacientes", reanudable=False)
+def _trabajo_importar(avance: Avance, archivo: str, nombre: str = "", lote: int = 5000):
+    ruta = ruta_archivo(archivo)
+    try:
+        with open(ruta, encoding="utf-8-sig", newline="") as f:
+            total = max(sum(1 for _ in f) - 1, 0)
+            f.seek(0)
+            avance(0, total=total, mensaje=nombre or None, forzar=True)
+            r = importar_pacientes_csv(
+                f, lote=lote,
+                progreso=lambda importados, rechazados: avance(importados, mensaje=f"{rechazados} rechazadas")
+            )
+    finally:
+        os.remove(ruta)
+
+    avance(r["importados"], mensaje=f"{len(r['rechazados'])} rechazadas", forzar=True)
+    r["total_rechazados"] = len(r["rechazados"])
+    r["rechazados"] = r["rechazados"][:MAX_RECHAZOS_GUARDADOS]
+    return r
+
+
+@tipo_trabajo("exportar", "Exportar")
+def _trabajo_exportar(avance: Avance, tabla: str, formato: str = "csv",
+                      desde: str | None = None, hasta: str | None = None, urgencia: str | None = None):
+    desde = date.fromisoformat(desde) if desde else None
+    hasta = date.fromisoformat(hasta) if hasta else None
+    if tabla == "citas":
+        filas = iterar_citas_exportacion(desde=desde, hasta=hasta, urgencia=urgencia)
+        columnas = COLUMNAS_EXPORT_CITAS
+    else:
+        filas = iterar_pacientes_exportacion(desde=desde, hasta=hasta)
+        columnas = COLUMNAS_EXPORT_PACIENTES
+
+    escritas = 0
+
+    def contar(filas):
+        nonlocal escritas
+        for fila in filas:
+            escritas += 1
+            if escritas % 5000 == 0:
+                avance(escritas)
+            yield fila
+
+    nombre = f"trabajo-{avance.trabajo_id}-{tabla}.{formato}"
+    ruta = ruta_archivo(nombre)
+    try:
+        with open(ruta, "w", encoding="utf-8", newline="") as f:
+            for trozo in FORMATOS_EXPORTACION[formato][0](contar(filas), columnas):
+                f.write(trozo)
+        avance(escritas, total=escritas, forzar=True)
+    except BaseException:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        raise
+    return {"archivo": nombre, "filas": escritas, "bytes": os.path.getsize(ruta)}